@@ -0,0 +1,112 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import numpy as np
+import logging
+log = logging.getLogger("applogger")
+
+class AdaptiveRetrieval:
+  def __init__(self, overfetch = 2, min_results = 2, distance_ratio = 1.5, gap_ratio = 1.3, mmr_lambda = 0.7):
+    """
+    Adaptive number of hits per query + doc_type instead of a fixed n_results:
+
+    1. The vectorDB is queried once with overfetch * n_results
+    2. Hits which are much further away than the best hit are dropped (relative distance cutoff)
+    3. The number of hits is cut at the first large gap of the distances: a specific question (one endpoint) has a few close hits,
+       a broad question has many hits with similar distances
+    4. The hits are selected with maximal marginal relevance (relevant + not redundant to the already selected hits)
+
+    Args:
+        overfetch (int): factor of n_results which is queried from the vectorDB
+        min_results (int): minimum number of hits per doc_type (if there are as many)
+        distance_ratio (float): hits with a distance above distance_ratio * distance of the best hit are dropped
+        gap_ratio (float): the hits are cut where the distance grows by more than this factor from one hit to the next
+        mmr_lambda (float): weight of the relevance against the diversity (1: only relevance)
+    """
+    self.overfetch = overfetch
+    self.min_results = min_results
+    self.distance_ratio = distance_ratio
+    self.gap_ratio = gap_ratio
+    self.mmr_lambda = mmr_lambda
+
+  def fetch_size(self, n_results):
+    """ number of hits which are queried from the vectorDB for at most n_results hits """
+    return n_results * self.overfetch
+
+  def size(self, distances, n_results):
+    """
+    Number of hits based on the distribution of the distances
+
+    Args:
+        distances (list): distances of the vector hits, best first
+        n_results (int): maximum number of hits
+    """
+    distances = np.sort(np.asarray(distances, dtype=np.float64))
+    if len(distances) == 0:
+      return min(self.min_results, n_results)
+
+    # relative distance cutoff
+    count = int(np.searchsorted(distances, self.limit(distances), side="right"))
+
+    # first large gap after the minimum number of hits
+    ratios = distances[1:count] / np.maximum(distances[:count - 1], 1e-3)
+    gaps = np.nonzero(ratios[self.min_results - 1:] > self.gap_ratio)[0]
+    if len(gaps):
+      count = int(gaps[0]) + self.min_results
+
+    return max(min(self.min_results, n_results), min(count, n_results))
+
+  def limit(self, distances):
+    """ maximum distance of a hit: relative to the best hit (the floor keeps exact matches with a distance of ~0 from cutting everything) """
+    return max(min(distances), 1e-3) * self.distance_ratio
+
+  def select(self, hits, query_embedding, n_results):
+    """
+    Select the hits of one query + doc_type
+
+    Args:
+        hits (list): over-fetched hits of VectorDB._search(), best first, with the embedding of each hit
+        query_embedding (list): embedding of the query string
+        n_results (int): maximum number of hits
+
+    Returns:
+        list: selected hits (without the embeddings), in the order of the selection
+    """
+    if not hits:
+      return []
+
+    distances = [hit["distance"] for hit in hits if hit["distance"] is not None]
+    size = self.size(distances, n_results)
+    limit = self.limit(distances) if distances else None
+    # pure keyword hits (exact API paths, parameters) have no distance and are kept as candidates
+    candidates = [hit for hit in hits if hit["distance"] is None or limit is None or hit["distance"] <= limit]
+    if len(candidates) < size:
+      candidates = hits[:size]
+
+    selected = self._mmr(candidates, query_embedding, size)
+    return [{key: value for key, value in candidates[index].items() if key != "embedding"} for index in selected]
+
+  def _mmr(self, candidates, query_embedding, size):
+    """ indexes of the candidates selected with maximal marginal relevance (cosine similarities, vectorized) """
+    embeddings = np.asarray([candidate["embedding"] for candidate in candidates], dtype=np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    query = np.array(query_embedding, dtype=np.float32)
+    query /= max(np.linalg.norm(query), 1e-12)
+
+    relevance = embeddings @ query
+    similarity = embeddings @ embeddings.T
+
+    # the best hit of the search (also a keyword hit of the hybrid search) is always selected first
+    selected = [0]
+    max_similarity = similarity[0].copy()
+    available = np.ones(len(candidates), dtype=bool)
+    available[0] = False
+    while len(selected) < min(size, len(candidates)):
+      scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * max_similarity
+      scores[~available] = -np.inf
+      index = int(np.argmax(scores))
+      selected.append(index)
+      available[index] = False
+      max_similarity = np.maximum(max_similarity, similarity[index])
+    return selected
@@ -0,0 +1,92 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import collections
+import threading
+import time
+import numpy as np
+import logging
+log = logging.getLogger("applogger")
+
+class SemanticAnswerCache:
+  def __init__(self, similarity_threshold = 0.95, ttl = 3600, max_entries = 256):
+    """
+    In-memory cache for LLM answers. A question is answered from the cache
+    if a previous question was similar enough (cosine similarity of the query embeddings),
+    was answered by the same model and the vectorDB did not change since then.
+
+    Args:
+        similarity_threshold (float): minimum cosine similarity between two query embeddings (0..1)
+        ttl (int): seconds after which a cached answer expires
+        max_entries (int): maximum number of cached answers. The least recently used answer is evicted first.
+    """
+    self.similarity_threshold = similarity_threshold
+    self.ttl = ttl
+    self.max_entries = max_entries
+
+    # entry id --> (normalized query embedding, model, index version, answer, creation time)
+    self._entries = collections.OrderedDict()
+    self._next_id = 0
+    self._lock = threading.Lock()
+
+  def get(self, query_embedding, model, index_version):
+    """
+    Return the cached answer of the most similar question or None
+
+    Args:
+        query_embedding (list): embedding of the user question
+        model (str): name of the LLM
+        index_version (str): version stamp of the vectorDB
+    """
+    query_vector = self._normalize(query_embedding)
+    now = time.time()
+
+    with self._lock:
+      # drop expired answers + answers based on an outdated vectorDB
+      for entry_id in [entry_id for entry_id, entry in self._entries.items() if now - entry[4] > self.ttl or entry[2] != index_version]:
+        del self._entries[entry_id]
+
+      candidates = [(entry_id, entry) for entry_id, entry in self._entries.items() if entry[1] == model]
+      if not candidates:
+        return None
+
+      # cosine similarity with all cached questions at once
+      similarities = np.stack([entry[0] for _, entry in candidates]) @ query_vector
+      best = int(np.argmax(similarities))
+      if similarities[best] < self.similarity_threshold:
+        return None
+
+      entry_id, entry = candidates[best]
+      self._entries.move_to_end(entry_id)
+      log.info(f"Answer cache hit (similarity {similarities[best]:.3f})")
+      return entry[3]
+
+  def put(self, query_embedding, model, index_version, answer):
+    """
+    Cache the answer of a question
+
+    Args:
+        query_embedding (list): embedding of the user question
+        model (str): name of the LLM
+        index_version (str): version stamp of the vectorDB
+        answer (str): answer of the LLM
+    """
+    with self._lock:
+      self._entries[self._next_id] = (self._normalize(query_embedding), model, index_version, answer, time.time())
+      self._next_id += 1
+
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+
+  def clear(self):
+    """
+    Remove all cached answers
+    """
+    with self._lock:
+      self._entries.clear()
+
+  @staticmethod
+  def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
@@ -0,0 +1,159 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import re
+import logging
+log = logging.getLogger("applogger")
+
+class TextChunker:
+    def __init__(self, chunk_size=512, overlap=64):
+        """
+        Chunking by sentences + paragraphs:
+        Sentences are added to a chunk until it is full. A chunk ends early at the end of a paragraph if it is at least half full.
+        The last sentences of a chunk (up to overlap characters) are repeated at the beginning of the next chunk.
+        Only sentences which are longer than a chunk are split by words.
+
+        Args:
+            chunk_size (int): maximum number of characters of a chunk
+            overlap (int): maximum number of characters which are repeated in the next chunk
+        """
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.signature = f"text:{chunk_size}:{overlap}"
+
+    def chunk(self, text):
+        """
+        Yield the chunks of the text (while the text is split into sentences)
+
+        Args:
+            text (str): string to chunk
+        """
+        current = []
+        length = 0
+        # number of units in the current chunk which are not the overlap of the last chunk
+        new_units = 0
+
+        for unit, ends_paragraph in self._units(text):
+            if new_units and length + len(unit) > self.chunk_size:
+                yield " ".join(current)
+                current, length = self._overlap_of(current)
+                new_units = 0
+
+            current.append(unit)
+            length += len(unit) + 1
+            new_units += 1
+
+            if ends_paragraph and length >= self.chunk_size // 2:
+                yield " ".join(current)
+                current, length = self._overlap_of(current)
+                new_units = 0
+
+        if new_units:
+            yield " ".join(current)
+
+    def _overlap_of(self, units):
+        """ the last units of a chunk which fit into the overlap + their length """
+        tail = []
+        length = 0
+        for unit in reversed(units):
+            if length + len(unit) + 1 > self.overlap:
+                break
+            tail.insert(0, unit)
+            length += len(unit) + 1
+        return tail, length
+
+    def _units(self, text):
+        """
+        Yield (sentence, ends_paragraph) of the text.
+        A sentence is never longer than chunk_size - overlap, so that it fits into a chunk together with the overlap.
+        """
+        max_length = self.chunk_size - self.overlap
+
+        for paragraph in re.split(r"\n\s*\n|\f", text):
+            sentences = [" ".join(s.split()) for s in re.split(r"(?<=[.!?:;])\s+", paragraph)]
+            sentences = [s for s in sentences if s]
+
+            for i, sentence in enumerate(sentences):
+                pieces = list(self._split_long(sentence, max_length))
+                for j, piece in enumerate(pieces):
+                    yield piece, i == len(sentences) - 1 and j == len(pieces) - 1
+
+    def _split_long(self, sentence, max_length):
+        """ split a sentence which is too long by words (words which are too long by characters) """
+        if len(sentence) <= max_length:
+            yield sentence
+            return
+
+        piece = ""
+        for word in sentence.split(" "):
+            while len(word) > max_length:
+                if piece:
+                    yield piece
+                    piece = ""
+                yield word[:max_length]
+                word = word[max_length:]
+            if piece and len(piece) + 1 + len(word) > max_length:
+                yield piece
+                piece = word
+            else:
+                piece = f"{piece} {word}" if piece else word
+        if piece:
+            yield piece
+
+class OpenAPIChunker:
+    def __init__(self, chunk_size=512, overlap=64, max_block_size=2048):
+        """
+        Chunking of the extended API specification documents:
+        The description is chunked with the TextChunker. The REST API query information (<api-query> block with path,
+        operation + parameters) is kept together in one chunk. Only if the block is longer than max_block_size,
+        it is split by parameters. Each part repeats the path + REST operation.
+
+        Args:
+            chunk_size (int): maximum number of characters of a description chunk
+            overlap (int): maximum number of characters which are repeated in the next description chunk
+            max_block_size (int): maximum number of characters of a REST API query information chunk
+        """
+        self.text_chunker = TextChunker(chunk_size, overlap)
+        self.max_block_size = max_block_size
+        self.signature = f"openapi:{chunk_size}:{overlap}:{max_block_size}"
+
+    def chunk(self, text):
+        """
+        Yield the chunks of an extended API specification document
+
+        Args:
+            text (str): document to chunk
+        """
+        description, tag, block = text.partition("<api-query>")
+        if not tag:
+            yield from self.text_chunker.chunk(text)
+            return
+
+        # the introduction line of the block ("REST API query information delimited with XML tags") stays with the block
+        description, _, intro = description.rpartition("\n\n") if "\n\n" in description else ("", "", description)
+        yield from self.text_chunker.chunk(description)
+
+        block = f"{intro.strip()}\n<api-query>{block}".strip()
+        if len(block) <= self.max_block_size:
+            yield block
+            return
+
+        # split the parameter list, every part repeats the header (path + REST operation)
+        lines = block.split("\n")
+        parameter_start = next((i for i, line in enumerate(lines) if line.startswith("- ")), len(lines))
+        header = "\n".join(lines[:parameter_start])
+        footer = "</api-query>"
+
+        part = []
+        length = len(header) + len(footer)
+        for line in lines[parameter_start:]:
+            if line.strip() == footer:
+                continue
+            if part and length + len(line) + 1 > self.max_block_size:
+                yield "\n".join([header] + part + [footer])
+                part = []
+                length = len(header) + len(footer)
+            part.append(line)
+            length += len(line) + 1
+        yield "\n".join([header] + part + [footer])
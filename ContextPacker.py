@@ -0,0 +1,135 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import logging
+log = logging.getLogger("applogger")
+
+# Token budget for the context of one prompt, per model
+# The rest of the context window is left for the system prompt, the user question and the answer
+MODEL_TOKEN_BUDGETS = {
+  "gpt-3.5-turbo": 6000,
+  "gpt-4o": 12000,
+  "gpt-4o-mini": 12000,
+  "llama3": 3000,
+}
+DEFAULT_TOKEN_BUDGET = 3000
+
+def token_budget_for_model(model):
+  """
+  Return the context token budget of the model
+
+  Args:
+      model (str): name of the LLM, e.g. "gpt-3.5-turbo" or "llama3"
+  """
+  return MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+def estimate_tokens(text):
+  """
+  Estimate the number of tokens of a text (approx. 4 characters per token for English text)
+
+  Args:
+      text (str): text
+  """
+  return len(text) // 4 + 1
+
+def pack_context(hits, token_budget):
+  """
+  Assemble the context for the prompt out of the hits of a vectorDB query:
+
+  1. Remove duplicated chunks
+  2. Merge adjacent chunks of the same source (ids: <source>_<number>) into one block
+  3. Rank the blocks by their best hit (the hits are ranked by distance, or by the fused score of the hybrid search)
+  4. Add blocks until the token budget is used up
+
+  Args:
+      hits (list): hits of VectorDB.query_db_multi() (best first), dicts with id and document
+      token_budget (int): maximum number of tokens of the context
+
+  Returns:
+      str: plain-text context, one block per source
+  """
+  ranked_hits = [dict(hit, rank=rank) for rank, hit in enumerate(hits)]
+  blocks = _merge_adjacent(_deduplicate(ranked_hits))
+  blocks.sort(key=lambda block: block["rank"])
+
+  packed = []
+  used_tokens = 0
+  for block in blocks:
+    text = f'[{block["label"]}]\n{block["document"]}'
+    tokens = estimate_tokens(text)
+    # a block which does not fit anymore is skipped, a smaller (less relevant) one might still fit
+    if used_tokens + tokens > token_budget:
+      continue
+    packed.append(text)
+    used_tokens += tokens
+
+  log.debug(f"Packed {len(packed)} out of {len(blocks)} context blocks ({len(hits)} hits) into ~{used_tokens} tokens")
+
+  return "\n\n".join(packed)
+
+def _deduplicate(hits):
+  """ keep only the best hit of every chunk text """
+  best = {}
+  for hit in hits:
+    key = " ".join(hit["document"].split())
+    if key not in best or hit["rank"] < best[key]["rank"]:
+      best[key] = hit
+  return list(best.values())
+
+def _split_id(id):
+  """ split "<source>_<number>" into (source, number). Ids without a number are a source on their own. """
+  source, _, number = id.rpartition("_")
+  if source and number.isdigit():
+    return source, int(number)
+  return id, None
+
+def _merge_adjacent(hits):
+  """ merge chunks with consecutive numbers of the same source into one block """
+  by_source = {}
+  for hit in hits:
+    source, number = _split_id(hit["id"])
+    by_source.setdefault(source, []).append((number, hit))
+
+  blocks = []
+  for source, parts in by_source.items():
+    if any(number is None for number, _ in parts):
+      blocks.extend({"label": hit["id"], "document": hit["document"], "rank": hit["rank"]} for _, hit in parts)
+      continue
+
+    parts.sort(key=lambda part: part[0])
+    run = [parts[0]]
+    for part in parts[1:]:
+      if part[0] == run[-1][0] + 1:
+        run.append(part)
+      else:
+        blocks.append(_block(source, run))
+        run = [part]
+    blocks.append(_block(source, run))
+
+  # drop blocks which are completely contained in another (longer) block
+  kept = []
+  for block in sorted(blocks, key=lambda block: len(block["document"]), reverse=True):
+    if not any(block["document"] in other["document"] for other in kept):
+      kept.append(block)
+  return kept
+
+def _block(source, run):
+  """ one block out of consecutive chunks of a source """
+  document = run[0][1]["document"]
+  for _, hit in run[1:]:
+    document = _join_overlapping(document, hit["document"])
+
+  first, last = run[0][0], run[-1][0]
+  return {
+    "label": f"{source}_{first}" if first == last else f"{source}_{first}-{last}",
+    "document": document,
+    "rank": min(hit["rank"] for _, hit in run),
+  }
+
+def _join_overlapping(first, second, min_overlap = 20, max_overlap = 300):
+  """ join two consecutive chunks, the text which overlaps is only kept once """
+  for overlap in range(min(len(first), len(second), max_overlap), min_overlap - 1, -1):
+    if first.endswith(second[:overlap]):
+      return first + second[overlap:]
+  return first + " " + second
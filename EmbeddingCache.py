@@ -0,0 +1,115 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import chromadb
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+import logging
+log = logging.getLogger("applogger")
+
+class CachedEmbeddingFunction(chromadb.EmbeddingFunction):
+  def __init__(self, embedding_function, model_name, cache_path = "embedding_cache.sqlite3", max_entries = 50000):
+    """
+    Embedding function with a persistent, content-addressed cache in front of it.
+    Only texts which were never embedded before with the same model are sent to the wrapped embedding function.
+
+    Args:
+        embedding_function (EmbeddingFunction): chromadb embedding function which does the actual embedding
+        model_name (str): name of the embedding model, part of the cache key
+        cache_path (str): path to the SQLite file which stores the embeddings
+        max_entries (int): maximum number of cached embeddings. Least recently used ones are evicted first.
+    """
+    self.embedding_function = embedding_function
+    self.model_name = model_name
+    self.max_entries = max_entries
+
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(cache_path, check_same_thread=False)
+    self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+    self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+    self._db.commit()
+    self._size = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+  def __call__(self, input):
+    """
+    Return the embeddings for all texts. Cache misses are embedded in one call.
+
+    Args:
+        input (list): list of texts
+    """
+    keys = [self._key(text) for text in input]
+    vectors = self._lookup(set(keys))
+
+    # embed every text which is not cached yet (once, even if it occurs several times)
+    missing = {}
+    for key, text in zip(keys, input):
+      if key not in vectors and key not in missing:
+        missing[key] = text
+
+    if missing:
+      embeddings = self.embedding_function(list(missing.values()))
+      new_vectors = {key: array("f", embedding) for key, embedding in zip(missing, embeddings)}
+      self._store(new_vectors)
+      vectors.update(new_vectors)
+
+    log.debug(f"Embedding cache: {len(input) - len(missing)} hits, {len(missing)} misses")
+
+    return [vectors[key].tolist() for key in keys]
+
+  def _key(self, text):
+    """ content address of a text: hash of model name + text """
+    return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+  def _lookup(self, keys):
+    """
+    Batched lookup of cached vectors. Marks the found entries as recently used.
+
+    Args:
+        keys (set): cache keys
+    """
+    keys = list(keys)
+    found = {}
+    with self._lock:
+      # stay below the SQLite limit for host parameters
+      for i in range(0, len(keys), 500):
+        batch = keys[i:i + 500]
+        placeholders = ",".join("?" * len(batch))
+        for key, blob in self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+          vector = array("f")
+          vector.frombytes(blob)
+          found[key] = vector
+      if found:
+        now = time.time()
+        self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        self._db.commit()
+    return found
+
+  def _store(self, vectors):
+    """
+    Save new vectors + evict the least recently used entries if the cache is full.
+
+    Args:
+        vectors (dict): cache key -> vector
+    """
+    now = time.time()
+    with self._lock:
+      self._db.executemany(
+        "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+        [(key, vector.tobytes(), now) for key, vector in vectors.items()]
+      )
+      self._size += len(vectors)
+
+      if self._size > self.max_entries:
+        # evict down to 90% of the limit so that eviction does not run on every insert
+        self._db.execute(
+          "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+          (self._size - int(self.max_entries * 0.9),)
+        )
+        self._size = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        log.info(f"Embedding cache: evicted entries, {self._size} remaining")
+
+      self._db.commit()
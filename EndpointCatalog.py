@@ -0,0 +1,169 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import re
+import sqlite3
+import threading
+from ContextPacker import estimate_tokens
+import logging
+log = logging.getLogger("applogger")
+
+# API paths which are named in a text, e.g. in the user question
+PATH_PATTERN = re.compile(r"/dna/[A-Za-z0-9_\-/{}\.]*[A-Za-z0-9_}]")
+
+class EndpointCatalog:
+    def __init__(self, filepath):
+        """
+        Catalog of all REST API endpoints (path, REST operation, operationId, tag, parameters) of the API specification.
+        It is built once per import and stored in SQLite. All entries are held in memory, so lookups are plain dict lookups.
+
+        Args:
+            filepath (str): path to the SQLite file
+        """
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+        # e.g. the vectorDB folder, which is only created by the retrieval server when RetrievalClient is used
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+        self._connection.execute("PRAGMA mmap_size=67108864")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS endpoints (
+            operation_id TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            parameters TEXT NOT NULL
+        )""")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+
+        self._load()
+
+    def __len__(self):
+        return len(self._by_operation_id)
+
+    @property
+    def fingerprint(self):
+        """ fingerprint of the API specification from which the catalog was built ("" if it was never built) """
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        return row[0] if row else ""
+
+    def build(self, operations, fingerprint):
+        """
+        Replace the whole catalog (one transaction)
+
+        Args:
+            operations (iterable): dicts with path, operation, operationId, first_tag, summary + parameters (see DataHandler._apispecs_operations())
+            fingerprint (str): fingerprint of the API specification
+        """
+        rows = [(op["operationId"], op["path"], op["operation"], op["first_tag"], op["summary"], op["parameters"]) for op in operations]
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM endpoints")
+                self._connection.executemany("INSERT OR REPLACE INTO endpoints VALUES (?, ?, ?, ?, ?, ?)", rows)
+                self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            self._load()
+
+        log.info(f"Built the endpoint catalog with {len(rows)} REST operations")
+
+    def get(self, operation_id):
+        """
+        Return the endpoint of an operationId or None
+
+        Args:
+            operation_id (str): operationId, e.g. "getDeviceList"
+
+        Returns:
+            dict: operationId, path, operation, tag, summary + parameters
+        """
+        return self._by_operation_id.get(operation_id)
+
+    def by_path(self, path):
+        """
+        Return all endpoints (REST operations) of an API path
+
+        Args:
+            path (str): API path, e.g. "/dna/intent/api/v1/network-device"
+        """
+        return self._by_path.get(path.rstrip("/"), [])
+
+    def by_tag(self, tag):
+        """
+        Return all endpoints of a tag
+
+        Args:
+            tag (str): first tag of the REST operation, e.g. "Devices"
+        """
+        return self._by_tag.get(tag, [])
+
+    def find_in_text(self, text):
+        """
+        Return all endpoints of the API paths which are named in a text
+
+        Args:
+            text (str): e.g. the user question
+        """
+        endpoints = []
+        for path in PATH_PATTERN.findall(text):
+            endpoints.extend(self.by_path(path))
+        return endpoints
+
+    def endpoints_for(self, query_string, hits, token_budget=None, max_endpoints=None):
+        """
+        Return the endpoints which are relevant for a user question:
+        first the API paths named in the question, then the REST operations of the retrieved API specification chunks (ids: <operationId>_<number>)
+
+        Args:
+            query_string (str): user question
+            hits (list): vectorDB hits of the extended API specification (best first)
+            token_budget (int): maximum number of tokens of the parameter blocks of the endpoints (see parameter_block()).
+                                Endpoints which do not fit anymore are skipped. None: no limit
+            max_endpoints (int): maximum number of endpoints. None: no limit
+        """
+        endpoints = self.find_in_text(query_string)
+        for hit in hits:
+            operation_id, _, number = hit["id"].rpartition("_")
+            if number.isdigit() and operation_id in self._by_operation_id:
+                endpoints.append(self._by_operation_id[operation_id])
+
+        unique = {}
+        for endpoint in endpoints:
+            unique.setdefault(endpoint["operationId"], endpoint)
+
+        selected = []
+        tokens = 0
+        for endpoint in unique.values():
+            if max_endpoints is not None and len(selected) >= max_endpoints:
+                break
+            if token_budget is not None:
+                endpoint_tokens = estimate_tokens(self.parameter_block(endpoint))
+                if tokens + endpoint_tokens > token_budget:
+                    continue
+                tokens += endpoint_tokens
+            selected.append(endpoint)
+        return selected
+
+    @staticmethod
+    def parameter_block(endpoint):
+        """
+        Format an endpoint like the REST API query information of the extended API specification documents
+
+        Args:
+            endpoint (dict): endpoint of the catalog
+        """
+        return f'API query path:{endpoint["path"]}\nREST operation:{endpoint["operation"]}\noperationId:{endpoint["operationId"]}\n{endpoint["parameters"]}'.strip()
+
+    def _load(self):
+        """ (re-)load all endpoints into the lookup dicts """
+        by_operation_id, by_path, by_tag = {}, {}, {}
+        for operation_id, path, operation, tag, summary, parameters in self._connection.execute("SELECT * FROM endpoints ORDER BY rowid"):
+            endpoint = {"operationId": operation_id, "path": path, "operation": operation, "tag": tag, "summary": summary, "parameters": parameters}
+            by_operation_id[operation_id] = endpoint
+            by_path.setdefault(path.rstrip("/"), []).append(endpoint)
+            by_tag.setdefault(tag, []).append(endpoint)
+        self._by_operation_id, self._by_path, self._by_tag = by_operation_id, by_path, by_tag
@@ -0,0 +1,194 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+
+Convert the extended API specification from the JSON document into the JSON lines format:
+    python ExtendedApiSpecs.py data/extended_apispecs_documentation.json data/extended_apispecs_documentation.jsonl
+    python ExtendedApiSpecs.py data/extended_apispecs_documentation.json data/extended_apispecs_documentation.jsonl.gz
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import threading
+import time
+import logging
+log = logging.getLogger("applogger")
+
+class ExtendedApiSpecs:
+    def __init__(self, filepath):
+        """
+        Append-only JSON lines file of the extended API specification: one REST operation per line
+        {"id": operationId, "document": extended description, "metadata": {...}, "fingerprint": fingerprint of the REST operation}.
+        The file is compressed with gzip if the path ends with ".gz".
+
+        The generator appends + flushes every REST operation as soon as it is extended, so an interrupted run loses nothing.
+        The importer reads it as a stream (also while the generator is still writing, see read()).
+        If a REST operation is written again, the last line wins (compact() removes the older lines).
+
+        Args:
+            filepath (str): path to the JSON lines file
+        """
+        self.filepath = filepath
+        self.compressed = filepath.endswith(".gz")
+        # exists while a writer is open (also of another process), see read(follow=True)
+        self.writing_path = filepath + ".writing"
+        self._lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.filepath)
+
+    def writing(self):
+        """ True while a writer is open (a marker file of a process which does not exist anymore is ignored) """
+        try:
+            with open(self.writing_path, "r") as f:
+                os.kill(int(f.read()), 0)
+        except (FileNotFoundError, ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            # process of another user
+            pass
+        return True
+
+    def _open(self, mode, filepath=None):
+        """ open the file (or another file of the same format) in binary mode ("rb", "ab", "wb"), with gzip if compressed """
+        filepath = filepath or self.filepath
+        return gzip.open(filepath, mode) if self.compressed else open(filepath, mode)
+
+    @contextlib.contextmanager
+    def writer(self):
+        """
+        Context manager which yields a write(id, document, metadata, fingerprint=None) function (thread-safe).
+        Every REST operation is appended + flushed immediately.
+        """
+        with open(self.writing_path, "w") as f:
+            f.write(str(os.getpid()))
+        try:
+            with self._open("ab") as f:
+                def write(id, document, metadata, fingerprint=None):
+                    line = json.dumps({"id": id, "document": document, "metadata": metadata, "fingerprint": fingerprint}).encode("utf-8") + b"\n"
+                    with self._lock:
+                        f.write(line)
+                        # gzip: sync flush, the line can be read before the file is closed
+                        f.flush()
+                yield write
+        finally:
+            os.remove(self.writing_path)
+
+    def read(self, follow=False, poll_interval=0.5):
+        """
+        Stream the entries of the file (dicts with id, document, metadata, fingerprint) in the order they were written.
+        An incomplete last line (process killed while writing) is skipped.
+
+        Args:
+            follow (bool): wait for new lines while a writer is open (import during the generation)
+            poll_interval (float): seconds between the checks for new lines (only with follow)
+        """
+        if not self.exists():
+            return
+        with self._open("rb") as f:
+            pending = b""
+            while True:
+                try:
+                    line = f.readline()
+                except EOFError:
+                    # gzip: the writer has not finished the current block yet
+                    line = b""
+                if line:
+                    pending += line
+                    if not pending.endswith(b"\n"):
+                        continue
+                    line, pending = pending, b""
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        log.warning(f"Skipped an invalid line of {self.filepath}")
+                    continue
+
+                # end of the file
+                if follow and self.writing():
+                    time.sleep(poll_interval)
+                    continue
+                if pending:
+                    log.warning(f"Skipped the incomplete last line of {self.filepath}")
+                return
+
+    def offsets(self):
+        """
+        Position of the last line of each REST operation (only the ids + positions are kept in memory)
+
+        Returns:
+            dict: id --> position for get()
+        """
+        offsets = {}
+        if not self.exists():
+            return offsets
+        with self._open("rb") as f:
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    return offsets
+                try:
+                    offsets[json.loads(line)["id"]] = position
+                except json.JSONDecodeError:
+                    continue
+
+    def get(self, position):
+        """ entry of the line at the position (see offsets()) """
+        with self._open("rb") as f:
+            f.seek(position)
+            return json.loads(f.readline())
+
+    def compact(self, ids=None):
+        """
+        Rewrite the file with only the last line of each REST operation (atomic replace of the file)
+
+        Args:
+            ids (list): ids in the order of the API specification, other REST operations are removed. Default: all, in the order of the file
+        """
+        offsets = self.offsets()
+        ids = [id for id in (ids if ids is not None else offsets) if id in offsets]
+        with self._open("rb") as source, self._open("wb", self.filepath + ".tmp") as target:
+            for id in ids:
+                source.seek(offsets[id])
+                target.write(source.readline())
+        os.replace(self.filepath + ".tmp", self.filepath)
+        log.info(f"Compacted {self.filepath} to {len(ids)} REST operations")
+
+    @classmethod
+    def convert(cls, json_path, filepath):
+        """
+        Convert the JSON document ({"documents": [...], "ids": [...], "metadatas": [...]}) into the JSON lines format
+
+        Args:
+            json_path (str): path to the JSON document
+            filepath (str): path to the new JSON lines file (".gz": compressed)
+
+        Returns:
+            ExtendedApiSpecs: the new file
+        """
+        with open(json_path, "r") as f:
+            document = json.load(f)
+
+        specs = cls(filepath)
+        if specs.exists():
+            os.remove(filepath)
+        with specs.writer() as write:
+            for j_document, j_id, j_metadatas in zip(document["documents"], document["ids"], document["metadatas"]):
+                write(j_id, j_document, j_metadatas)
+        log.info(f"Converted {len(document['ids'])} REST operations from {json_path} into {filepath}")
+        return specs
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the extended API specification from JSON into JSON lines")
+    parser.add_argument("json_path", help="JSON document, e.g. data/extended_apispecs_documentation.json")
+    parser.add_argument("jsonl_path", help="new JSON lines file, e.g. data/extended_apispecs_documentation.jsonl (.gz: compressed)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ExtendedApiSpecs.convert(args.json_path, args.jsonl_path)
+
+if __name__ == "__main__":
+    main()
@@ -3,243 +3,560 @@ Cisco Sample Code License 1.1
 Author: flopach 2024
 """
 import json
+import hashlib
 import glob
-import fitz
-from bs4 import BeautifulSoup
-import requests
+import os
+import contextlib
+import threading
+from WebFetcher import CachedFetcher
+from ImportManifest import ImportManifest
+from ExtendedApiSpecs import ExtendedApiSpecs
+from EndpointCatalog import EndpointCatalog
+from Chunking import TextChunker, OpenAPIChunker
+from TaskRunner import retry_with_backoff, run_ordered
+from Metrics import span, IMPORTED_DOCUMENTS
+from ImportJobs import current_job, job_progress, job_total
 import logging
 log = logging.getLogger("applogger")
 
+# pages of the API docs on developer.cisco.com/docs/dna-center/
+APIDOCS_PAGES = [
+    "overview",
+    "getting-started",
+    "api-quick-start",
+    "asynchronous-apis",
+    "authentication-and-authorization",
+    "command-runner",
+    "credentials",
+    "device-onboarding",
+    "device-provisioning",
+    "devices",
+    "discovery",
+    "events",
+    "global-ip-pool",
+    "health-monitoring",
+    "path-trace",
+    "rma-device-replacement",
+    "reports",
+    "software-defined-access-sda",
+    "sites",
+    "swim",
+    "topology"
+]
+
+def _extract_pdf_pages(task):
+    """
+    Extract the text of a range of pages of a PDF document (runs in a worker process)
+
+    Args:
+        task (tuple): (filepath, first page, last page + 1)
+
+    Returns:
+        list: (page number, text) for each page, page numbers start with 1
+    """
+    import fitz
+    filepath, start, stop = task
+    with fitz.open(filepath) as doc:
+        return [(number + 1, doc[number].get_text()) for number in range(start, stop)]
+
 class DataHandler:
-    def __init__(self, database, LLM):
+    # doc_types of the documents of each kind: the user guide was imported without metadata before the manifest existed
+    _doc_types = {"userguide": {"userguide", None}}
+
+    def __init__(self, database, LLM, batch_size=128, manifest_path=None, llm_concurrency=4, llm_batch=False, text_chunker=None, apispecs_chunker=None, pdf_workers=None, fetcher=None, endpoint_catalog=None, extended_apispecs_path="data/extended_apispecs_documentation.jsonl"):
+        """
+        Args:
+            database (VectorDB): vectorDB instance
+            LLM (LLMBackend): LLM instance, e.g. LLMOpenAI or LLMOllama
+            batch_size (int): number of chunks which are embedded + written to the vectorDB at once
+            llm_concurrency (int): maximum number of parallel LLM calls when generating new data
+            llm_batch (bool): extend the API specification with one batch job of the LLM provider (e.g. OpenAI Batch API) instead of single calls
+            text_chunker (Chunking class): chunker for the PDF User Guide + API docs. Default: TextChunker
+            apispecs_chunker (Chunking class): chunker for the extended API specification. Default: OpenAPIChunker
+            pdf_workers (int): number of processes which extract the pages of the PDF User Guide. Default: number of CPU cores
+            fetcher (CachedFetcher): fetcher for the API docs web pages. Default: CachedFetcher with the HTTP cache in http_cache/
+            manifest_path (str): path to the import manifest. Default: one manifest per version of the collection within the vectorDB folder
+            endpoint_catalog (EndpointCatalog): catalog of the REST API endpoints. Default: endpoint_catalog.sqlite3 within the vectorDB folder
+            extended_apispecs_path (str): JSON lines file of the extended API specification (".gz": compressed), see ExtendedApiSpecs.py
+        """
         self.llm = LLM
         self.database = database
+        self.batch_size = batch_size
+        self.llm_concurrency = llm_concurrency
+        self.llm_batch = llm_batch
+        self.text_chunker = text_chunker or TextChunker(chunk_size=512, overlap=64)
+        self.apispecs_chunker = apispecs_chunker or OpenAPIChunker(chunk_size=512, overlap=64)
+        self.pdf_workers = pdf_workers or os.cpu_count()
+        self.fetcher = fetcher or CachedFetcher(cache_dir="http_cache")
+
+        # the manifest is stored together with the vectorDB: if the vectorDB is deleted, the manifest is deleted as well
+        self.manifest_path = manifest_path
+        self._manifest = None
+        self._manifest_version = None
+        self._manifest_lock = threading.Lock()
+        self.endpoint_catalog = endpoint_catalog if endpoint_catalog is not None else EndpointCatalog(os.path.join(database.database_path, "endpoint_catalog.sqlite3"))
+        self.extended_apispecs = ExtendedApiSpecs(extended_apispecs_path)
+
+    @property
+    def manifest(self):
+        """
+        Import manifest of the version of the collection which is written, loaded with the first use (see _sync_manifest())
+        """
+        if self._manifest is None:
+            self._sync_manifest()
+        return self._manifest
 
-    def scrape_pdfuserguide_catcenter(self,filepath):
+    def _sync_manifest(self):
+        """
+        Switch the manifest to the version of the collection which is written (see VectorDB.building_version()).
+        Each version has its own manifest file, which is copied + deleted together with the version.
+        When the running imports create a new version (with their first write), the manifest keeps its state
+        (also the sources which are tracked but not saved yet) and is saved into the file of the new version.
+
+        Called at the start of each import + before its manifest is saved, not for each record:
+        with RetrievalClient each lookup of the version is a request to the retrieval server.
+        """
+        if self.manifest_path is not None:
+            version, filepath = None, self.manifest_path
+        else:
+            version = self.database.write_version
+            filepath = self.database.version_file("import_manifest.json", version)
+            legacy_filepath = os.path.join(self.database.database_path, "import_manifest.json")
+            if version == self.database.collection_name and not os.path.exists(filepath) and os.path.exists(legacy_filepath):
+                # manifest of the unversioned collection
+                os.replace(legacy_filepath, filepath)
+
+        with self._manifest_lock:
+            if self._manifest is None:
+                self._manifest = ImportManifest(filepath)
+            elif version != self._manifest_version:
+                if self._manifest_version == self.database.active_version.name:
+                    # new version of the running imports (a copy of the active version)
+                    self._manifest.filepath = filepath
+                else:
+                    # the version of the manifest was deleted (e.g. failed validation): the saved manifest of the written version
+                    self._manifest = ImportManifest(filepath)
+            self._manifest_version = version
+            return self._manifest
+
+    def scrape_pdfuserguide_catcenter(self,filepath,pages_per_task=16):
         """
         Scrape Catalyst Center PDF User Guide
+
+        The pages are extracted in parallel by worker processes and streamed (in page order) into the chunker + batched embedding.
+        Only a bounded number of pages is in memory at the same time. Each page is a source of its own:
+        only new or changed pages are chunked + embedded, every chunk has the page number as metadata.
+
+        Args:
+            filepath (str): path to the PDF file
+            pages_per_task (int): number of pages which are extracted by a worker process at once
         """
+        # the PDF library is only loaded when the PDF is imported (fast app start)
+        import fitz
+
         try:
             log.info(f"=== Start: Chunking + embedding PDF User Guide file ===")
             with fitz.open(filepath) as doc:  # open document
-                content = chr(12).join([page.get_text() for page in doc])
+                page_count = doc.page_count
+            job_total(page_count)
+
+            name = os.path.basename(filepath)
+            tasks = ((filepath, start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
 
-                chunks = self._chunk_text(content,512)
+            def records(seen):
+                """ yield (document, id, metadata) for every new or changed chunk of every page """
+                for _, pages in run_ordered(_extract_pdf_pages, tasks, self.pdf_workers, processes=True):
+                    for number, text in pages:
+                        source = f"{name}:{number}"
+                        seen.add(source)
+
+                        # fingerprint of the page (+ the chunking method)
+                        fingerprint = ImportManifest.fingerprint(self.text_chunker.signature, text)
+                        if self.manifest.unchanged("userguide", source, fingerprint):
+                            continue
+
+                        metadata = { "doc_type" : "userguide", "page" : number }
+                        yield from self.manifest.track("userguide", source, fingerprint,
+                            ((chunk, f"user_guide_{number}_{x}", metadata) for x, chunk in enumerate(self.text_chunker.chunk(text))))
+
+                    log.info(f"PDF User Guide: {number} out of {page_count} pages done")
+
+            self._import_records("userguide", records)
 
-                self.database.collection_add(
-                    documents=chunks,
-                    ids=[f"user_guide_{x}" for x in range(len(chunks))]
-                )
             log.info(f"=== End: Chunking + embedding PDF User Guide file ===")
         except Exception as e:
             log.error(f"Error when reading PDF! Error: {e}")
+            # a background job is marked as failed (or cancelled)
+            if current_job() is not None:
+                raise
 
-    def scrape_apidocs_catcenter(self):
-        """
-        Scrape developer.cisco.com Catalyst Center API docs        
-        """
-        base_url = "https://developer.cisco.com/docs/dna-center/"
-
-        docs_list = [
-            "overview",
-            "getting-started",
-            "api-quick-start",
-            "asynchronous-apis",
-            "authentication-and-authorization",
-            "command-runner",
-            "credentials",
-            "device-onboarding",
-            "device-provisioning",
-            "devices",
-            "discovery",
-            "events",
-            "global-ip-pool",
-            "health-monitoring",
-            "path-trace",
-            "rma-device-replacement",
-            "reports",
-            "software-defined-access-sda",
-            "sites",
-            "swim",
-            "topology"
-        ]
-        
-        for doc in docs_list:
-            try:
-                r = requests.get(base_url+doc)
-                soup = BeautifulSoup(r.content, 'html.parser')
-                chunks = self._chunk_text(soup.get_text(),512)
+    def scrape_apidocs_catcenter(self,base_url="https://developer.cisco.com/docs/dna-center/"):
+        """
+        Scrape developer.cisco.com Catalyst Center API docs
+
+        All pages are requested concurrently by the fetcher (pooled session, timeouts, retries, HTTP cache).
+        Pages which were not modified since the last import (HTTP 304) are skipped entirely.
+
+        Args:
+            base_url (str): URL of the API docs, e.g. a local stand-in server for benchmarks
+        """
+        # the HTML parser is only loaded when the API docs are imported (fast app start)
+        from bs4 import BeautifulSoup
+        job_total(len(APIDOCS_PAGES))
+
+        def records(seen):
+            """ yield (document, id, metadata) for every new or changed chunk of every scraped page """
+            for doc, (url, result) in zip(APIDOCS_PAGES, self.fetcher.fetch_all([base_url+doc for doc in APIDOCS_PAGES])):
+                # a page which can not be requested right now is not deleted from the vectorDB
+                seen.add(doc)
+                if isinstance(result, Exception):
+                    log.error(f"Error when requesting data from {url}! Error: {result}")
+                    continue
+
+                # not modified + already imported with the same chunking method: nothing to do
+                if result.not_modified and self.manifest.entry("apidocs", doc).get("chunker") == self.text_chunker.signature:
+                    log.info(f"{url} was not modified, skipping it")
+                    continue
+
+                soup = BeautifulSoup(result.content, 'html.parser')
+                text = soup.get_text()
+
+                log.info(f"Scraped data from {url}")
+
+                fingerprint = ImportManifest.fingerprint(self.text_chunker.signature, text)
+                if self.manifest.unchanged("apidocs", doc, fingerprint):
+                    log.info(f"{url} did not change, skipping it")
+                    continue
+
+                chunks = self.text_chunker.chunk(text)
 
                 #log.info(chunks)
 
-                self.database.collection_add(
-                    documents=chunks,
-                    ids=[f"{doc}_{x}" for x in range(len(chunks))],
-                    metadatas=[{ "doc_type" : "apidocs" } for x in range(len(chunks))]
-                )
+                yield from self.manifest.track("apidocs", doc, fingerprint,
+                    ((chunk, f"{doc}_{x}", { "doc_type" : "apidocs" }) for x, chunk in enumerate(chunks)),
+                    chunker=self.text_chunker.signature)
 
-                log.info(f"Scraped data from {base_url+doc}")
+        # embed + upsert all new or changed chunks in batches
+        try:
+            self._import_records("apidocs", records)
+        except Exception as e:
+            log.error(f"Error when importing the api docs! Error: {e}")
+            # a background job is marked as failed (or cancelled)
+            if current_job() is not None:
+                raise
 
-            except Exception as e:
-                log.error(f"Error when requesting data from {base_url+doc}! Error: {e}")
-        
         log.info(f"=== Done with api docs scraping ===")
 
-    def import_apispecs_from_json(self):
+    def import_endpoint_catalog(self,filepath):
+        """
+        Build the endpoint catalog (path, REST operation, operationId, tag, parameters) out of the API specification.
+        The catalog is only rebuilt if the API specification file changed.
+
+        Args:
+            filepath (str): path to file
+        """
+        with open(filepath, "rb") as f:
+            content = f.read()
+
+        fingerprint = hashlib.sha256(content).hexdigest()
+        if self.endpoint_catalog.fingerprint == fingerprint:
+            log.info(f"=== Endpoint catalog is up to date ({len(self.endpoint_catalog)} REST operations) ===")
+            return
+
+        with span("import_endpoint_catalog"):
+            self.endpoint_catalog.build(self._apispecs_operations(json.loads(content)), fingerprint)
+
+        log.info(f"=== Built the endpoint catalog ===")
+
+    def import_apispecs_from_json(self, follow=False):
         """
         This function is used to embed the already existing EXTENDED API specification. The data was generated with GPT-3.5-turbo.
+        The JSON lines file is read as a stream straight into the batched embedding (only one REST operation at a time in memory).
 
         The function import_apispecs_generate_new_data() is doing the full implementation: Extend the data + embed (see below)
-        """
-        # open openAPI specs file
-        with open("data/extended_apispecs_documentation.json", "r") as f:
-            dict = json.load(f)
-            log.info(f"=== Opened EXTENDED API Specification ===")
 
-            total_num = len(dict["documents"])
+        Args:
+            follow (bool): also import the REST operations which are appended while import_apispecs_generate_new_data() is still running
+        """
+        self._migrate_extended_apispecs()
+        log.info(f"=== Opened EXTENDED API Specification ===")
+
+        if not follow:
+            total_num = sum(1 for _ in self.extended_apispecs.read())
+            job_total(total_num)
+
+        def records(seen):
+            """ yield (document, id, metadata) for every new or changed chunk of every extended API document """
+            for i, entry in enumerate(self.extended_apispecs.read(follow=follow)):
+                j_document, j_id, j_metadatas = entry["document"], entry["id"], entry["metadata"]
+                seen.add(j_id)
+                fingerprint = ImportManifest.fingerprint(self.apispecs_chunker.signature, j_document, json.dumps(j_metadatas, sort_keys=True))
+                if self.manifest.unchanged("apispecs", j_id, fingerprint):
+                    continue
 
-            # zipping together all 3 arrays from the JSON file + iterating
-            for i, (j_document, j_id, j_metadatas) in enumerate(zip(dict["documents"],dict["ids"],dict["metadatas"])):
                 # logging status
-                log.info(f"Working on {i} out of {total_num} ({j_id}).")
+                log.info(f"Working on {i} ({j_id}).")
 
-                document_chunks = self._chunk_text(j_document,512)
+                document_chunks = self.apispecs_chunker.chunk(j_document)
 
                 # create for each document chunk ids. Use operationId as base id.
-                ids = [f"{j_id}_{x}" for x in range(len(document_chunks))]
+                # every chunk gets the metadata of the document
+                yield from self.manifest.track("apispecs", j_id, fingerprint,
+                    ((chunk, f"{j_id}_{x}", j_metadatas) for x, chunk in enumerate(document_chunks)))
 
-                # create metadata for each document chunk
-                metadatas = [j_metadatas for x in range(len(document_chunks))]
+        # === put all new or changed information into vectorDB (batched) ===
+        self._import_records("apispecs", records)
 
-                #logging chunks
-                #log.debug(document_chunks)
-
-                # === put all information into vectorDB ===
+        log.info(f"=== Chunked and embedded the openapi specification into the vectorDB ===")
 
-                # add into vectordb
-                self.database.collection_add(
-                    documents=document_chunks,
-                    ids=ids,
-                    metadatas=metadatas
-                )
+    def _migrate_extended_apispecs(self, json_path="data/extended_apispecs_documentation.json", checkpoint_path="data/extended_apispecs_checkpoint.jsonl"):
+        """
+        Convert the extended API specification of older versions into the JSON lines file (once):
+        the JSON document + the checkpoint file of an interrupted run of import_apispecs_generate_new_data()
+        """
+        if not self.extended_apispecs.exists() and os.path.exists(json_path):
+            ExtendedApiSpecs.convert(json_path, self.extended_apispecs.filepath)
 
-        log.info(f"=== Chunked and embedded the openapi specification into the vectorDB ===")
+        if os.path.exists(checkpoint_path):
+            with self.extended_apispecs.writer() as write:
+                for entry in ExtendedApiSpecs(checkpoint_path).read():
+                    write(entry["id"], entry["document"], entry["metadata"], entry["fingerprint"])
+            os.remove(checkpoint_path)
+            log.info(f"=== Moved the REST operations of {checkpoint_path} into {self.extended_apispecs.filepath} ===")
 
-    def import_apispecs_generate_new_data(self,filepath):
+    def import_apispecs_generate_new_data(self,filepath,batch_path="data/extended_apispecs_batch.jsonl"):
         """
         The existing API specification will be extended with the LLM in the function: import_apispecs_generate_new_data()
 
         1. Only specific data is extracted from the OpenAPI document
         2. Based on the information within the vectorDB (API docs, User Guide) an extended description is created via the LLM
-        3. The newly created information is saved in the vectorDB + external JSON document
+        3. The newly created information is saved in the vectorDB + the JSON lines file of the extended API specification
+
+        Up to llm_concurrency REST operations are extended in parallel. Every finished operation is appended to the JSON lines file
+        (see ExtendedApiSpecs.py), so that an interrupted run continues where it stopped. At the end, the file is compacted into the
+        order of the API specification. With llm_batch, all REST operations are extended with one batch job instead (if the LLM supports it).
 
         Args:
             filepath (str): path to file
+            batch_path (str): path to the requests file (JSON lines) of the batch job (only used with llm_batch)
         """
 
-        json_document = {
-            "documents" : [],
-            "ids" : [],
-            "metadatas" : []
-        }
-
         # open openAPI specs file
         with open(filepath, "r") as f:
             dict = json.load(f)
             log.info(f"=== Opened API Specification ===")
 
-            p = 1
-            for path in dict["paths"]:
-                """ loop through each API path in the document """
-                path_dict = dict["paths"][path]
-                log.info(f'=== STATUS: {p} out of {len(dict["paths"])} paths ===')
-                p += 1
-                
-                for operation in path_dict:
-                    """ loop through each REST operation """
-                    summary = path_dict[operation]["summary"]
-                    operationId = path_dict[operation]["operationId"]
-                    description = path_dict[operation]["description"]
-                    first_tag = path_dict[operation]["tags"][0]
-
-                    # if parameters are defined, list them
-                    if len(path_dict[operation]["parameters"]) != 0:
-                        parameters = ""
-                        for parameter in path_dict[operation]["parameters"]:
-                            """ loop through each parameters """
-                            p_name = parameter["name"]
-                            p_description = parameter["description"]
-
-                            p_in = f'The query parameters should be used in the {parameter["in"]}. '
-
-                            p_default_value = ""
-                            if "default" in parameter:
-                                if parameter["default"] != "":
-                                    p_default_value = f'The default value is "{parameter["default"]}". '
-
-                            p_required = ""
-                            if "required" in parameter:
-                                p_required = "This query parameter is required. "
-                            else:
-                                p_required = "This query parameter is not required. "
-                            
-                            parameters += f"- {p_name}: {p_description}. {p_in}{p_default_value}{p_required}\n"
-                        parameters = f"REST API query parameters:\n{parameters}\n"
+        # already generated documents: only the positions in the JSON lines file are kept in memory
+        self._migrate_extended_apispecs()
+        positions = self.extended_apispecs.offsets()
+        log.info(f"=== {len(positions)} REST operations already extended ===")
+
+        operations = list(self._apispecs_operations(dict))
+        job_total(len(operations))
+
+        def reusable_document(op):
+            """ return the already generated (document, metadata) of the REST operation or None """
+            if op["operationId"] not in positions:
+                return None
+            entry = self.extended_apispecs.get(positions[op["operationId"]])
+            # generated by an earlier run for the same REST operation (documents of older versions: see the manifest)
+            if entry.get("fingerprint") == op["fingerprint"] or self.manifest.entry("apispecs", op["operationId"]).get("operation") == op["fingerprint"]:
+                return entry["document"], entry["metadata"]
+            return None
+
+        with self.extended_apispecs.writer() as write:
+
+            def save_operation(op, ai_description):
+                """ assemble the document of the extended REST operation + append it to the JSON lines file """
+
+                # === Assemble all information ===
+
+                # Create for each API path an extended documentation
+                content = f"""{ai_description}\n\nREST API query information delimited with XML tags\n<api-query>\nAPI query path:{op["path"]}\nREST operation:{op["operation"]}\n{op["parameters"]}</api-query>"""
+                metadata = { "summary": op["summary"], "tag" : op["first_tag"], "doc_type" : "apispecs" }
+
+                # === save the result immediately ===
+                write(op["operationId"], content, metadata, op["fingerprint"])
+
+                return content, metadata
+
+            def extend_operation(op):
+                """ extend one REST operation with the LLM (runs in a worker thread) """
+                try:
+                    ai_description = retry_with_backoff(
+                        self.llm.extend_api_description,
+                        f'{op["summary"]}.{op["description"]}',op["path"],op["operation"],op["parameters"]
+                    )
+                except Exception as e:
+                    log.error(f'Error when extending {op["operationId"]}! Error: {e}')
+                    return None
+
+                return save_operation(op, ai_description)
+
+            todo = [op for op in operations if reusable_document(op) is None]
+            todo_ids = {op["operationId"] for op in todo}
+            log.info(f"=== {len(todo)} out of {len(operations)} REST operations need to be extended by the LLM ===")
+
+            if self.llm_batch and self.llm.supports_batch:
+                # all REST operations are extended with one batch job of the LLM provider
+                descriptions = self.llm.extend_api_descriptions_batch(
+                    [(op["operationId"], f'{op["summary"]}.{op["description"]}', op["path"], op["operation"], op["parameters"]) for op in todo],
+                    batch_path
+                ) if todo else {}
+                for op in todo:
+                    if op["operationId"] not in descriptions:
+                        log.error(f'Error when extending {op["operationId"]}! The batch request failed.')
+                generated = ((op, save_operation(op, descriptions[op["operationId"]]) if op["operationId"] in descriptions else None) for op in todo)
+            else:
+                # results are returned in the order of the API specification
+                generated = run_ordered(extend_operation, todo, self.llm_concurrency)
+
+            def records(seen):
+                """ yield (document, id, metadata) for each new or changed chunk, in the order of the API specification """
+                for i, op in enumerate(operations):
+                    operationId = op["operationId"]
+                    seen.add(operationId)
+
+                    if operationId in todo_ids:
+                        _, document = next(generated)
+                        if document is None:
+                            # failed after all retries: keep the old chunks, try again with the next import
+                            continue
+                        log.info(f'=== STATUS: {i + 1} out of {len(operations)} REST operations. NEW document added:\n{document[0]} ===')
                     else:
-                        parameters = ""
-                    
-                    # Generate extended description for this API Call
-                    ai_description = self.llm.extend_api_description(f"{summary}.{description}",path,operation,parameters)
+                        document = reusable_document(op)
 
-                    # === Assemble all information ===
+                    content, metadata = document
 
-                    # Create for each API path an extended documentation
                     # chunk the document into several parts
-                    content = f"""{ai_description}\n\nREST API query information delimited with XML tags\n<api-query>\nAPI query path:{path}\nREST operation:{operation}\n{parameters}</api-query>"""
-                    document_chunks = self._chunk_text(content,512)
+                    document_chunks = list(self.apispecs_chunker.chunk(content))
 
                     # create for each document chunk ids. Use operationId as base id.
                     ids = [f"{operationId}_{x}" for x in range(len(document_chunks))]
 
                     # create metadata for each document chunk
-                    metadatas = [{ "summary": summary, "tag" : first_tag, "doc_type" : "apispecs" } for x in range(len(document_chunks))]
+                    metadatas = [metadata for x in range(len(document_chunks))]
 
-                    #logging chunks
-                    #log.debug(document_chunks)
+                    # === hand over all new or changed chunks to the batched vectorDB import ===
+                    # the source fingerprint also covers the chunking method, the fingerprint of the REST operation is kept for re-using the document
+                    fingerprint = ImportManifest.fingerprint(self.apispecs_chunker.signature, content, json.dumps(metadata, sort_keys=True))
+                    yield from self.manifest.track("apispecs", operationId, fingerprint, zip(document_chunks, ids, metadatas), operation=op["fingerprint"])
 
-                    # === put all information into vectorDB ===
+            # === put all information into vectorDB (batched) ===
+            self._import_records("apispecs", records)
 
-                    # add into vectordb
-                    self.database.collection_add(
-                        documents=document_chunks,
-                        ids=ids,
-                        metadatas=metadatas
-                    )
+        # === only the latest document of each REST operation, in the order of the API specification ===
+        self.extended_apispecs.compact([op["operationId"] for op in operations])
 
-                    # === put all information into a dict which will be saved later to JSON ===
+        # everything is saved: the requests (+ the ID) of the batch job are not needed anymore
+        if self.llm_batch and self.llm.supports_batch:
+            self.llm.finish_batch(batch_path)
 
-                    json_document["documents"].append(content)
-                    json_document["ids"].append(operationId)
-                    json_document["metadatas"].append({ "summary": summary, "tag" : first_tag, "doc_type" : "apispecs" })
+        log.info(f"=== Extended, chunked, embedded the openapi specification into the vectorDB ===")
 
-                    log.info(f"=== NEW document added:\n{content} ===")
-        
-        # === put all information into JSON (optional, plain-text saving) ===
+    def _apispecs_operations(self,dict):
+        """
+        Extract the relevant information of each REST operation from the API specification
 
-        with open("data/extended_apispecs_documentation.json", "w") as f:
-            json.dump(json_document, f)
+        Args:
+            dict (dict): loaded OpenAPI document
 
-        log.info(f"=== Extended, chunked, embedded the openapi specification into the vectorDB ===")
-    
-    def _chunk_text(self,content,chunk_size):
+        Yields:
+            dict: path, operation, summary, operationId, description, first_tag, parameters + fingerprint of the REST operation
+        """
+        for path in dict["paths"]:
+            """ loop through each API path in the document """
+            path_dict = dict["paths"][path]
+
+            for operation in path_dict:
+                """ loop through each REST operation """
+                summary = path_dict[operation]["summary"]
+                operationId = path_dict[operation]["operationId"]
+                description = path_dict[operation]["description"]
+                first_tag = path_dict[operation]["tags"][0]
+
+                # if parameters are defined, list them
+                if len(path_dict[operation]["parameters"]) != 0:
+                    parameters = ""
+                    for parameter in path_dict[operation]["parameters"]:
+                        """ loop through each parameters """
+                        p_name = parameter["name"]
+                        p_description = parameter["description"]
+
+                        p_in = f'The query parameters should be used in the {parameter["in"]}. '
+
+                        p_default_value = ""
+                        if "default" in parameter:
+                            if parameter["default"] != "":
+                                p_default_value = f'The default value is "{parameter["default"]}". '
+
+                        p_required = ""
+                        if "required" in parameter:
+                            p_required = "This query parameter is required. "
+                        else:
+                            p_required = "This query parameter is not required. "
+
+                        parameters += f"- {p_name}: {p_description}. {p_in}{p_default_value}{p_required}\n"
+                    parameters = f"REST API query parameters:\n{parameters}\n"
+                else:
+                    parameters = ""
+
+                yield {
+                    "path": path,
+                    "operation": operation,
+                    "summary": summary,
+                    "operationId": operationId,
+                    "description": description,
+                    "first_tag": first_tag,
+                    "parameters": parameters,
+                    # the REST operation is only extended again by the LLM if this fingerprint changes
+                    "fingerprint": ImportManifest.fingerprint(path, operation, json.dumps(path_dict[operation], sort_keys=True))
+                }
+
+    def _import_records(self, kind, records):
         """
-        The most basic method: Chunking by characters
-        + Replacing the new line character with a white space
-        + Removing any leading and trailing whitespaces
+        Embed + upsert all records of one import in batches (tracked in the manifest).
+        The records are written into a new version of the collection, which is queried after all running imports
+        are finished + it is validated. Queries use the current version in the meantime.
 
         Args:
-            content (str): string to chunk
-            chunk_size (int): number of characters when to cut
+            kind (str): type of the sources, e.g. "apidocs"
+            records (function): generator function which gets the set of seen sources and yields (document, id, metadata) tuples
         """
-        chunks = [content[i:i + chunk_size].replace("\n"," ").strip() for i in range(0, len(content), chunk_size)]
-        return chunks
\ No newline at end of file
+        with self.database.building_version(), self._tracked_import(kind) as seen:
+            # progress of the background import job (pause / cancel between records)
+            written = self.database.collection_upsert_bulk(job_progress(records(seen), seen), batch_size=self.batch_size)
+        IMPORTED_DOCUMENTS.inc(written, kind=kind)
+
+    @contextlib.contextmanager
+    def _tracked_import(self, kind):
+        """
+        Context manager around one import of the given kind.
+        Yields a set in which the importer adds the name of every source it has seen.
+
+        On success: stale chunks (shrunk or removed sources) are deleted + the manifest is saved.
+        On error: this kind is reset to the saved manifest, so the next import will redo the unfinished work.
+
+        Args:
+            kind (str): type of the sources, e.g. "apidocs"
+        """
+        seen = set()
+        # the first import of this kind (e.g. of a vectorDB which was imported before the manifest existed)
+        # does not know the ids of the earlier imports
+        untracked = not self._sync_manifest().sources.get(kind)
+        with span(f"import_{kind}") as attributes:
+            try:
+                yield seen
+            except Exception:
+                self.manifest.reload(kind)
+                raise
+
+            attributes["sources"] = len(seen)
+            with span("import_cleanup", kind=kind):
+                self.manifest.prune(kind, seen)
+                if untracked:
+                    doc_types = self._doc_types.get(kind, {kind})
+                    self.manifest.adopt(kind, [id for id, doc_type in self.database.collection_doc_types().items() if doc_type in doc_types])
+                self.database.collection_delete(self.manifest.pop_stale_ids(kind))
+                # the writes of the import (or the delete) can have created the new version
+                self._sync_manifest().save(kind)
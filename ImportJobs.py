@@ -0,0 +1,309 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+log = logging.getLogger("applogger")
+
+# the import job which runs in the current thread (set by JobRunner)
+_current_job = contextvars.ContextVar("current_import_job", default=None)
+
+class JobCancelled(Exception):
+    """ Raised within an importer when its job was cancelled """
+
+def current_job():
+    """ the import job which runs in this thread or None """
+    return _current_job.get()
+
+def job_total(sources):
+    """
+    Report the total number of sources (pages, REST operations, ...) of the running import job. Does nothing outside of a job.
+
+    Args:
+        sources (int): total number of sources
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.total = sources
+
+def job_progress(records, seen):
+    """
+    Pass the records of an importer through + report the progress of the running import job.
+    While the job is paused, the importer waits here. If the job is cancelled, JobCancelled is raised.
+    Outside of a job, the records are returned unchanged.
+
+    Args:
+        records (iterable): (document, id, metadata) tuples
+        seen (set): sources which the importer has already processed
+    """
+    job = _current_job.get()
+    if job is None:
+        return records
+
+    def tracked():
+        for record in records:
+            job.checkpoint(len(seen))
+            job.chunks += 1
+            yield record
+        job.checkpoint(len(seen))
+    return tracked()
+
+class ImportJob:
+    def __init__(self, kind, args=(), job_id=None, depends_on=(), status="queued", **state):
+        """
+        One importer which runs as background task
+
+        Args:
+            kind (str): name of the importer, see JobRunner.register()
+            args (list): arguments of the importer (JSON serializable, they are persisted)
+            job_id (str): unique id. Default: new id
+            depends_on (list): ids of jobs which need to be finished before this job starts
+            status (str): queued, running, paused, done, failed or cancelled
+            state: persisted progress (sources, total, chunks, error, created, started, finished)
+        """
+        self.id = job_id or uuid.uuid4().hex[:8]
+        self.kind = kind
+        self.args = list(args)
+        self.depends_on = list(depends_on)
+        self.status = status
+        self.sources = state.get("sources", 0)
+        self.total = state.get("total")
+        self.chunks = state.get("chunks", 0)
+        self.error = state.get("error")
+        self.created = state.get("created", time.time())
+        self.started = state.get("started")
+        self.finished = state.get("finished")
+
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._thread = None
+        if status in ("done", "failed", "cancelled"):
+            self._done.set()
+
+    def checkpoint(self, sources):
+        """ called by the importer: update the progress, wait while paused, stop if cancelled """
+        self.sources = sources
+        if not self._resumed.is_set():
+            self._resumed.wait()
+        if self._cancelled.is_set():
+            raise JobCancelled(f"Import job {self.id} ({self.kind}) was cancelled")
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running", "paused")
+
+    def progress(self):
+        """
+        Progress of the job: processed sources + chunks, rate (sources / second) + ETA in seconds (if the total is known)
+        """
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        rate = self.sources / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.status == "running" and self.total and rate > 0:
+            eta = max(0.0, (self.total - self.sources) / rate)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "sources": self.sources,
+            "total": self.total,
+            "chunks": self.chunks,
+            "elapsed": round(elapsed, 1),
+            "rate": round(rate, 2),
+            "eta": round(eta) if eta is not None else None,
+            "error": self.error,
+        }
+
+    def to_dict(self):
+        """ persisted state of the job """
+        return {
+            "job_id": self.id, "kind": self.kind, "args": self.args, "depends_on": self.depends_on, "status": self.status,
+            "sources": self.sources, "total": self.total, "chunks": self.chunks, "error": self.error,
+            "created": self.created, "started": self.started, "finished": self.finished,
+        }
+
+class JobRunner:
+    def __init__(self, state_path, max_workers=2, keep_finished=20):
+        """
+        Runs the importers as background jobs in a bounded worker pool.
+        The state of all jobs is persisted, so jobs which were queued or running when the app stopped are started again
+        with resume_jobs(). The importers continue where they stopped (import manifest, HTTP cache, embedding cache + checkpoint
+        of the extended API specification). The vectorDB is still queried while the jobs run.
+
+        Args:
+            state_path (str): path to the JSON state file of the jobs
+            max_workers (int): maximum number of importers which run at the same time
+            keep_finished (int): number of finished jobs which are kept in the state file
+        """
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.keep_finished = keep_finished
+        # each job has its own (daemon) thread, at most max_workers of them run an importer at the same time
+        self._slots = threading.Semaphore(max_workers)
+        self.importers = {}
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+        # e.g. the vectorDB folder, which is only created by the retrieval server when RetrievalClient is used
+        os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                for state in json.load(f):
+                    job = ImportJob(**state)
+                    self.jobs[job.id] = job
+
+    def register(self, kind, importer):
+        """
+        Register an importer which can be started as job
+
+        Args:
+            kind (str): name of the importer, e.g. "apidocs"
+            importer (function): function which runs the import (blocking), called with the job arguments
+        """
+        self.importers[kind] = importer
+
+    def submit(self, kind, *args, depends_on=()):
+        """
+        Queue a new job
+
+        Args:
+            kind (str): name of a registered importer
+            args: arguments of the importer (JSON serializable)
+            depends_on (list): ids of jobs which need to be finished before this job starts
+
+        Returns:
+            ImportJob: the queued job
+        """
+        if kind not in self.importers:
+            raise ValueError(f"Unknown importer '{kind}'. Available importers: {', '.join(self.importers)}")
+        job = ImportJob(kind, args, depends_on=depends_on)
+        with self._lock:
+            # only the latest finished jobs are kept in the state file
+            finished = sorted((job for job in self.jobs.values() if not job.active), key=lambda job: job.created)
+            for old_job in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self.jobs[old_job.id]
+            self.jobs[job.id] = job
+        self._start(job)
+        return job
+
+    def resume_jobs(self):
+        """
+        Start the jobs again which were queued or running when the app stopped (paused jobs stay paused)
+
+        Returns:
+            list: started jobs
+        """
+        jobs = [job for job in self.jobs.values() if job.status in ("queued", "running") and job._thread is None]
+        for job in sorted(jobs, key=lambda job: job.created):
+            job.status = "queued"
+            log.info(f"Resuming import job {job.id} ({job.kind})")
+            self._start(job)
+        return jobs
+
+    def pause(self, job_id):
+        """ pause a job: the importer waits at its next record """
+        job = self.jobs[job_id]
+        if job.active:
+            job._resumed.clear()
+            job.status = "paused"
+            self._save()
+        return job
+
+    def resume(self, job_id):
+        """ continue a paused job (also a job which was paused before the app was restarted) """
+        job = self.jobs[job_id]
+        if job.status == "paused":
+            job._resumed.set()
+            if job._thread is None:
+                # paused before the app was restarted: start it again
+                job.status = "queued"
+                self._start(job)
+            else:
+                job.status = "running" if job.started else "queued"
+                self._save()
+        return job
+
+    def cancel(self, job_id):
+        """ cancel a job: it stops at its next record, the new version of the collection is not used (see VectorDB.building_version()) """
+        job = self.jobs[job_id]
+        if job.active:
+            job._cancelled.set()
+            job._resumed.set()
+            if job.status != "running":
+                self._finish(job, "cancelled")
+        return job
+
+    def active_jobs(self):
+        """ all queued, running + paused jobs """
+        return [job for job in self.jobs.values() if job.active]
+
+    def wait(self, job_id, timeout=None):
+        """ wait until the job is finished, return True if it is finished """
+        return self.jobs[job_id]._done.wait(timeout)
+
+    def _start(self, job):
+        """ start the thread of the job, it waits for its dependencies + a free slot of the worker pool """
+        job._thread = threading.Thread(target=self._run, args=(job,), name=f"import-job-{job.id}", daemon=True)
+        job._thread.start()
+        self._save()
+
+    def _run(self, job):
+        """ run one job (own thread) """
+        # the dependencies are awaited before a slot is taken: waiting jobs do not block the worker pool
+        for dependency in job.depends_on:
+            if dependency in self.jobs:
+                self.jobs[dependency]._done.wait()
+            if self.jobs.get(dependency) is not None and self.jobs[dependency].status != "done":
+                self._finish(job, "cancelled", f"dependency {dependency} did not finish")
+                return
+
+        # paused while it was queued: it does not take a slot until it is resumed
+        job._resumed.wait()
+        with self._slots:
+            job._resumed.wait()
+            if job._cancelled.is_set() or job._done.is_set():
+                return
+
+            job.status = "running"
+            job.started = time.time()
+            job.sources, job.chunks = 0, 0
+            self._save()
+            log.info(f"Import job {job.id} ({job.kind}) started")
+
+            token = _current_job.set(job)
+            try:
+                self.importers[job.kind](*job.args)
+            except JobCancelled:
+                self._finish(job, "cancelled")
+            except Exception as e:
+                log.error(f"Import job {job.id} ({job.kind}) failed! Error: {e}")
+                self._finish(job, "failed", str(e))
+            else:
+                self._finish(job, "done")
+            finally:
+                _current_job.reset(token)
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job._done.set()
+        self._save()
+        log.info(f"Import job {job.id} ({job.kind}) {status}")
+
+    def _save(self):
+        """ persist the state of all jobs (atomic replace of the file) """
+        with self._lock:
+            content = json.dumps([job.to_dict() for job in self.jobs.values()])
+            tmp_filepath = f"{self.state_path}.{threading.get_ident()}.tmp"
+            with open(tmp_filepath, "w") as f:
+                f.write(content)
+            os.replace(tmp_filepath, self.state_path)
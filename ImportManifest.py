@@ -0,0 +1,171 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import hashlib
+import json
+import os
+import threading
+import logging
+log = logging.getLogger("applogger")
+
+class ImportManifest:
+    def __init__(self, filepath):
+        """
+        Keeps track of what was imported into the vectorDB.
+
+        For every source (PDF user guide, scraped page, API operation) the manifest stores
+        a fingerprint of the source content and a fingerprint of each chunk which was created from it.
+        With this information a re-import only upserts changed chunks and deletes stale ones.
+
+        Importers of different kinds can run at the same time (e.g. as background import jobs):
+        stale chunk ids are kept per kind and a failed import only resets its own kind (see reload()).
+
+        Args:
+            filepath (str): path to the JSON manifest file
+        """
+        self.filepath = filepath
+        # kind --> chunk ids which need to be deleted from the vectorDB
+        self.stale_ids = {}
+        self._lock = threading.Lock()
+        self.sources = self._load()
+
+    def _load(self):
+        """ sources of the manifest file """
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "r") as f:
+                return json.load(f)
+        return {}
+
+    def reload(self, kind):
+        """
+        Reset one kind to the saved manifest file, e.g. after a failed import. The next import will redo the unfinished work.
+
+        Args:
+            kind (str): type of the sources, e.g. "apidocs"
+        """
+        saved = self._load().get(kind)
+        with self._lock:
+            if saved is None:
+                self.sources.pop(kind, None)
+            else:
+                self.sources[kind] = saved
+            self.stale_ids.pop(kind, None)
+
+    @staticmethod
+    def fingerprint(*parts):
+        """
+        Create a fingerprint (sha256) of all given parts
+
+        Args:
+            parts (str): strings to hash
+        """
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def unchanged(self, kind, source, fingerprint):
+        """
+        Check if a source was already imported with the same content
+
+        Args:
+            kind (str): type of the source, e.g. "apidocs"
+            source (str): unique name of the source within this kind
+            fingerprint (str): fingerprint of the current source content
+        """
+        entry = self.sources.get(kind, {}).get(source)
+        return entry is not None and entry["fingerprint"] == fingerprint
+
+    def entry(self, kind, source):
+        """
+        Return the manifest entry of a source (fingerprint, chunks + additional information) or an empty dict
+
+        Args:
+            kind (str): type of the source, e.g. "apidocs"
+            source (str): unique name of the source within this kind
+        """
+        return self.sources.get(kind, {}).get(source, {})
+
+    def track(self, kind, source, fingerprint, records, **info):
+        """
+        Filter the records of one source: only yield chunks which are new or changed.
+        Chunk ids which existed before but are not created anymore are marked as stale.
+
+        Args:
+            kind (str): type of the source, e.g. "apidocs"
+            source (str): unique name of the source within this kind
+            fingerprint (str): fingerprint of the current source content
+            records (iterable): (document, id, metadata) tuples of the source
+            info: additional information which is saved in the manifest entry
+        """
+        old_chunks = self.sources.get(kind, {}).get(source, {}).get("chunks", {})
+        new_chunks = {}
+
+        for document, id, metadata in records:
+            chunk_fingerprint = self.fingerprint(document, json.dumps(metadata, sort_keys=True))
+            new_chunks[id] = chunk_fingerprint
+            if old_chunks.get(id) != chunk_fingerprint:
+                yield document, id, metadata
+
+        with self._lock:
+            self.stale_ids.setdefault(kind, []).extend(id for id in old_chunks if id not in new_chunks)
+            self.sources.setdefault(kind, {})[source] = {"fingerprint": fingerprint, "chunks": new_chunks, **info}
+
+    def prune(self, kind, seen_sources):
+        """
+        Remove all sources of a kind which were not seen during the last import. Their chunks are marked as stale.
+
+        Args:
+            kind (str): type of the source, e.g. "apidocs"
+            seen_sources (set): names of all sources which still exist
+        """
+        with self._lock:
+            sources = self.sources.get(kind, {})
+            for source in [s for s in sources if s not in seen_sources]:
+                self.stale_ids.setdefault(kind, []).extend(sources.pop(source)["chunks"])
+                log.info(f"Source {kind}/{source} does not exist anymore")
+
+    def adopt(self, kind, existing_ids):
+        """
+        First import of a kind into a collection which was imported without manifest (or with ids of an older importer):
+        the existing ids of this kind which the import did not create are marked as stale.
+
+        Args:
+            kind (str): type of the sources, e.g. "apidocs"
+            existing_ids (iterable): ids of the documents of this kind in the collection
+        """
+        with self._lock:
+            tracked = {id for entry in self.sources.get(kind, {}).values() for id in entry["chunks"]}
+            self.stale_ids.setdefault(kind, []).extend(id for id in existing_ids if id not in tracked)
+
+    def pop_stale_ids(self, kind):
+        """
+        Return + reset the list of chunk ids of one kind which need to be deleted from the vectorDB
+
+        Args:
+            kind (str): type of the sources, e.g. "apidocs"
+        """
+        with self._lock:
+            return self.stale_ids.pop(kind, [])
+
+    def save(self, kind=None):
+        """
+        Save the manifest (atomic replace of the file)
+
+        Args:
+            kind (str): only save the sources of this kind, the other kinds keep their saved state
+                        (their imports can still be running). None: save everything
+        """
+        with self._lock:
+            if kind is None:
+                sources = self.sources
+            else:
+                sources = self._load()
+                sources[kind] = self.sources.get(kind, {})
+            content = json.dumps(sources)
+            tmp_filepath = f"{self.filepath}.{threading.get_ident()}.tmp"
+            with open(tmp_filepath, "w") as f:
+                f.write(content)
+            os.replace(tmp_filepath, self.filepath)
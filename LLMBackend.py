@@ -0,0 +1,657 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from ContextPacker import pack_context, token_budget_for_model, estimate_tokens
+from EndpointCatalog import EndpointCatalog
+from Metrics import RequestTrace, span, record_llm_usage, COALESCED_REQUESTS
+import logging
+log = logging.getLogger("applogger")
+
+# name --> LLM backend class or "<module>.<class>" (imported when the backend is used for the first time)
+BACKENDS = {
+  "openai": "TalkToOpenAI.LLMOpenAI",
+  "ollama": "TalkToOllama.LLMOllama",
+}
+
+def register_backend(name, backend):
+  """
+  Register an additional LLM backend
+
+  Args:
+      name (str): name of the backend, e.g. "openai"
+      backend (class or str): subclass of LLMBackend or "<module>.<class>"
+  """
+  BACKENDS[name] = backend
+
+def get_backend(name):
+  """
+  Return the LLM backend class of the name
+
+  Args:
+      name (str): name of the backend, e.g. "openai" or "ollama"
+  """
+  backend = BACKENDS.get(name)
+  if backend is None:
+    raise ValueError(f"Unknown LLM backend '{name}'. Available backends: {', '.join(BACKENDS)}")
+  if isinstance(backend, str):
+    module, _, class_name = backend.rpartition(".")
+    backend = BACKENDS[name] = getattr(importlib.import_module(module), class_name)
+  return backend
+
+class LLMBackend:
+  # === set by each backend ===
+  # model which is used if no model is given
+  default_model = None
+  # embeddings function of the VectorDB which belongs to this backend
+  embeddings_function = None
+  # system prompt + number of vectorDB results for extending the API specification
+  extend_system_prompt = "You are provided information of a specific REST API query path of the Cisco Catalyst Center. Describe what this query is for in detail. Describe how this query can be used from a user perspective."
+  extend_n_results = 10
+  # True if extend_api_descriptions_batch() is implemented
+  supports_batch = False
+
+  def __init__(self, database, model = None, answer_cache = None, context_token_budget = None, endpoint_catalog = None, timeout = 120, max_connections = 10, coalesce_requests = True, adaptive_retrieval = True):
+    """
+    Common part of all LLM backends: retrieval, prompt assembly, answer cache, metrics + coalescing of identical requests.
+    The backends only implement the requests to the LLM (_create_client, _create_async_client, _complete, _complete_async, _stream, _stream_async).
+
+    Args:
+        database (VectorDB): vectorDB instance
+        model (str): name of the LLM. None: default model of the backend
+        answer_cache (SemanticAnswerCache): cache for answers of similar questions. None disables the cache.
+        context_token_budget (int): maximum number of context tokens per prompt. None: default budget of the model
+        endpoint_catalog (EndpointCatalog): catalog of the REST API endpoints. The exact REST API query information of
+                                            the retrieved endpoints is added to the prompt. None disables it.
+        timeout (float): timeout in seconds of each request to the LLM
+        max_connections (int): size of the connection pool of the LLM clients
+        coalesce_requests (bool): identical requests which are sent at the same time share one completion
+        adaptive_retrieval (bool): n_results_apidocs / n_results_apispecs are maximum numbers: specific questions get
+                                   fewer, diverse hits (see AdaptiveRetrieval.py). False: always exactly n_results hits
+    """
+    self.database = database
+    self.model = model or self.default_model
+    self.answer_cache = answer_cache
+    self.context_token_budget = context_token_budget or token_budget_for_model(self.model)
+    self.endpoint_catalog = endpoint_catalog
+    self.timeout = timeout
+    self.max_connections = max_connections
+    self.coalesce_requests = coalesce_requests
+    self.adaptive_retrieval = adaptive_retrieval
+
+    # request key --> Future (_generate) or _SharedStream (_generate_stream) of the in-flight request
+    self._in_flight = {}
+    self._in_flight_lock = threading.Lock()
+    # same for the async functions (only used within the event loop)
+    self._in_flight_async = {}
+
+    # the clients (+ the client libraries) are created with the first request, see client / async_client
+    self._client = None
+    self._async_client = None
+    self._clients_lock = threading.Lock()
+
+  @property
+  def client(self):
+    """ client of the LLM, created with the first request """
+    if self._client is None:
+      with self._clients_lock:
+        if self._client is None:
+          self._client = self._create_client()
+    return self._client
+
+  @client.setter
+  def client(self, client):
+    self._client = client
+
+  @property
+  def async_client(self):
+    """ async client of the LLM, created with the first request """
+    if self._async_client is None:
+      with self._clients_lock:
+        if self._async_client is None:
+          self._async_client = self._create_async_client()
+    return self._async_client
+
+  @async_client.setter
+  def async_client(self, async_client):
+    self._async_client = async_client
+
+  # ======================
+  # Requests to the LLM (implemented by each backend)
+  # ======================
+
+  def _create_client(self):
+    """ return the (pooled) client of the LLM """
+    raise NotImplementedError
+
+  def _create_async_client(self):
+    """ return the (pooled) async client of the LLM """
+    raise NotImplementedError
+
+  def _complete(self, messages):
+    """ return (answer, (prompt tokens, completion tokens) or None) """
+    raise NotImplementedError
+
+  async def _complete_async(self, messages):
+    """ same as _complete(), async """
+    raise NotImplementedError
+
+  def _stream(self, messages):
+    """ yield the tokens of the answer """
+    raise NotImplementedError
+
+  async def _stream_async(self, messages):
+    """ same as _stream(), async """
+    raise NotImplementedError
+    yield
+
+  def extend_api_descriptions_batch(self, requests, jsonl_path):
+    """
+    Extend the descriptions of many REST operations with one batch job (only if supports_batch is True)
+
+    Args:
+        requests (list): (custom id, query_string, path, operation, parameters) tuples, see extend_api_description()
+        jsonl_path (str): path to the JSON lines file of the batch requests
+
+    Returns:
+        dict: custom id --> extended description (failed requests are missing)
+    """
+    raise NotImplementedError(f"{type(self).__name__} does not support batch requests")
+
+  def finish_batch(self, jsonl_path):
+    """
+    Called when the results of extend_api_descriptions_batch() are saved: remove the requests file (+ state of the batch job)
+
+    Args:
+        jsonl_path (str): path to the JSON lines file of the batch requests
+    """
+    if os.path.exists(jsonl_path):
+      os.remove(jsonl_path)
+
+  # ======================
+  # Extending the API specification
+  # ======================
+
+  def extend_api_description(self,query_string,path,operation,parameters):
+    """
+    Extend the description for each API REST Call operation
+
+    Args:
+        query_string (str): details of the REST API call
+        path (str): REST API path
+        operation (str): REST API operation (GET, POST, etc.)
+        parameters (str): Query parameters
+    """
+    messages = self._extend_messages(query_string,path,operation,parameters)
+
+    with span("extend_api_description", path=path, operation=operation):
+      answer, usage = self._generate(messages)
+
+    record_llm_usage(self.model,messages,answer,usage)
+    return answer
+
+  def _extend_messages(self,query_string,path,operation,parameters):
+    """
+    Search for context in vectorDB + assemble the messages for extending the description of a REST API call
+
+    Args:
+        query_string (str): details of the REST API call
+        path (str): REST API path
+        operation (str): REST API operation (GET, POST, etc.)
+        parameters (str): Query parameters
+    """
+    # query vector DB for local data
+    # query without the where_clause to include context from the User Guide PDF
+    hits = self.database.query_db_multi(query_string,{None: self.extend_n_results})
+    context_query = pack_context(hits[None], self.context_token_budget)
+
+    # create promt message with local context data
+    message = f'Query path: "{path}"\nREST operation: {operation}\nshort description: {query_string}\n{parameters}\nUse this context delimited with XML tags:\n<context>\n{context_query}\n</context>'
+    log.debug(f"=== Extending the description with: ===\n {message}")
+
+    return [
+      {"role": "system", "content": self.extend_system_prompt},
+      {"role": "user", "content": message}
+    ]
+
+  # ======================
+  # Answering user questions
+  # ======================
+
+  def ask_llm(self,query_string,n_results_apidocs=6,n_results_apispecs=10):
+    """
+    Ask the LLM with the query string.
+    Search for context in vectorDB
+
+    Args:
+        query_string (str): details of the REST API call
+        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
+        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
+    """
+    with RequestTrace(self.model, query_string) as trace:
+      query_embedding = self.database.embed_query(query_string)
+      cached_answer = self._answer_from_cache(trace, query_embedding)
+      if cached_answer is not None:
+        return cached_answer
+
+      messages = self._assemble_messages(query_string,n_results_apidocs,n_results_apispecs,query_embedding)
+      with span("generate"):
+        answer, usage = self._generate(messages)
+
+      return answer+"\n\n"+self._complete_request(trace, query_embedding, messages, answer, usage)
+
+  def ask_llm_stream(self,query_string,n_results_apidocs=6,n_results_apispecs=10):
+    """
+    Ask the LLM with the query string and yield the answer token by token while it is generated.
+    The last yielded part is the execution duration (time to first token + total time).
+
+    Args:
+        query_string (str): details of the REST API call
+        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
+        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
+    """
+    with RequestTrace(self.model, query_string) as trace:
+      query_embedding = self.database.embed_query(query_string)
+      cached_answer = self._answer_from_cache(trace, query_embedding)
+      if cached_answer is not None:
+        yield cached_answer
+        return
+
+      messages = self._assemble_messages(query_string,n_results_apidocs,n_results_apispecs,query_embedding)
+      answer = []
+      with span("generate"):
+        for token in self._generate_stream(messages):
+          trace.first_token()
+          answer.append(token)
+          yield token
+
+      yield "\n\n"+self._complete_request(trace, query_embedding, messages, "".join(answer), stream=True)
+
+  async def ask_llm_async(self,query_string,n_results_apidocs=6,n_results_apispecs=10):
+    """
+    Same as ask_llm(), but it does not block the event loop
+
+    Args:
+        query_string (str): details of the REST API call
+        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
+        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
+    """
+    with RequestTrace(self.model, query_string) as trace:
+      query_embedding = await self.database.embed_query_async(query_string)
+      cached_answer = self._answer_from_cache(trace, query_embedding)
+      if cached_answer is not None:
+        return cached_answer
+
+      messages = await self._assemble_messages_async(query_string,n_results_apidocs,n_results_apispecs,query_embedding)
+      with span("generate"):
+        answer, usage = await self._generate_async(messages)
+
+      return answer+"\n\n"+self._complete_request(trace, query_embedding, messages, answer, usage)
+
+  async def ask_llm_stream_async(self,query_string,n_results_apidocs=6,n_results_apispecs=10):
+    """
+    Same as ask_llm_stream(), but it does not block the event loop
+
+    Args:
+        query_string (str): details of the REST API call
+        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
+        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
+    """
+    with RequestTrace(self.model, query_string) as trace:
+      query_embedding = await self.database.embed_query_async(query_string)
+      cached_answer = self._answer_from_cache(trace, query_embedding)
+      if cached_answer is not None:
+        yield cached_answer
+        return
+
+      messages = await self._assemble_messages_async(query_string,n_results_apidocs,n_results_apispecs,query_embedding)
+      answer = []
+      with span("generate"):
+        async for token in self._generate_stream_async(messages):
+          trace.first_token()
+          answer.append(token)
+          yield token
+
+      yield "\n\n"+self._complete_request(trace, query_embedding, messages, "".join(answer), stream=True)
+
+  def _answer_from_cache(self,trace,query_embedding):
+    """
+    Answer of a similar question from the cache (with the execution duration) or None.
+    A cache hit finishes the request.
+
+    Args:
+        trace (RequestTrace): trace of the request
+        query_embedding (list): embedding of the user question
+    """
+    cached_answer = self._cached_answer(query_embedding)
+    if cached_answer is None:
+      return None
+
+    trace.finish(cache_hit=True)
+    exec_duration = f"The query '{trace.query_string}' was **answered from the cache** in **{round(trace.seconds, 2)} seconds**."
+    log.info(exec_duration)
+    return cached_answer+"\n\n"+exec_duration
+
+  def _complete_request(self,trace,query_embedding,messages,answer,usage=None,stream=False):
+    """
+    Cache the generated answer + finish the request
+
+    Args:
+        trace (RequestTrace): trace of the request
+        query_embedding (list): embedding of the user question
+        messages (list): messages sent to the LLM
+        answer (str): generated answer
+        usage (tuple): (prompt tokens, completion tokens) reported by the LLM. None: estimated from the texts
+        stream (bool): True if the answer was streamed (the time to first token is added)
+
+    Returns:
+        str: execution duration
+    """
+    self._cache_answer(query_embedding,answer)
+    trace.finish(messages,answer,usage)
+
+    exec_duration = f"The query '{trace.query_string}' took **{round(trace.seconds, 2)} seconds** to execute"
+    if stream:
+      exec_duration += f" (first token after **{round(trace.ttft, 2)} seconds**)"
+    exec_duration += "."
+    log.info(exec_duration)
+    return exec_duration
+
+  # ======================
+  # Coalescing of identical in-flight requests
+  # ======================
+
+  def _request_key(self, kind, messages):
+    """ key of a request: identical model + messages --> identical key """
+    return hashlib.sha256(json.dumps([kind, self.model, messages]).encode("utf-8")).hexdigest()
+
+  def _generate(self, messages):
+    """
+    Return (answer, usage) of the messages. An identical request which is already in flight is not sent again,
+    its result is shared.
+    """
+    if not self.coalesce_requests:
+      return self._complete(messages)
+
+    key = self._request_key("complete", messages)
+    with self._in_flight_lock:
+      future = self._in_flight.get(key)
+      leader = future is None
+      if leader:
+        future = self._in_flight[key] = Future()
+
+    if not leader:
+      COALESCED_REQUESTS.inc(model=self.model)
+      return future.result()
+
+    try:
+      future.set_result(self._complete(messages))
+    except Exception as e:
+      future.set_exception(e)
+    finally:
+      with self._in_flight_lock:
+        del self._in_flight[key]
+    return future.result()
+
+  async def _generate_async(self, messages):
+    """ same as _generate(), async """
+    if not self.coalesce_requests:
+      return await self._complete_async(messages)
+
+    key = self._request_key("complete", messages)
+    task = self._in_flight_async.get(key)
+    if task is None:
+      task = self._in_flight_async[key] = asyncio.ensure_future(self._complete_async(messages))
+      task.add_done_callback(lambda _: self._in_flight_async.pop(key, None))
+    else:
+      COALESCED_REQUESTS.inc(model=self.model)
+
+    # a cancelled request does not cancel the shared completion
+    return await asyncio.shield(task)
+
+  def _generate_stream(self, messages):
+    """
+    Yield the tokens of the answer. Identical requests which are in flight at the same time read the same token stream.
+    The stream is produced by a separate thread, so it continues if one of the readers stops.
+    """
+    if not self.coalesce_requests:
+      yield from self._stream(messages)
+      return
+
+    key = self._request_key("stream", messages)
+    with self._in_flight_lock:
+      shared = self._in_flight.get(key)
+      leader = shared is None
+      if leader:
+        shared = self._in_flight[key] = _SharedStream()
+
+    if leader:
+      threading.Thread(target=self._produce_stream, args=(key, shared, messages), daemon=True).start()
+    else:
+      COALESCED_REQUESTS.inc(model=self.model)
+
+    yield from shared.read()
+
+  def _produce_stream(self, key, shared, messages):
+    """ write the tokens of the answer into the shared stream (runs in its own thread) """
+    try:
+      for token in self._stream(messages):
+        shared.append(token)
+      shared.finish()
+    except Exception as e:
+      shared.finish(e)
+    finally:
+      with self._in_flight_lock:
+        self._in_flight.pop(key, None)
+
+  async def _generate_stream_async(self, messages):
+    """ same as _generate_stream(), async: the stream is produced by a separate task """
+    if not self.coalesce_requests:
+      async for token in self._stream_async(messages):
+        yield token
+      return
+
+    key = self._request_key("stream", messages)
+    shared = self._in_flight_async.get(key)
+    if shared is None:
+      shared = self._in_flight_async[key] = _AsyncSharedStream()
+      # the event loop only keeps weak references to its tasks: the shared stream keeps its producer
+      shared.producer = asyncio.ensure_future(self._produce_stream_async(key, shared, messages))
+    else:
+      COALESCED_REQUESTS.inc(model=self.model)
+
+    async for token in shared.read():
+      yield token
+
+  async def _produce_stream_async(self, key, shared, messages):
+    """ write the tokens of the answer into the shared stream (runs as its own task) """
+    try:
+      async for token in self._stream_async(messages):
+        await shared.append(token)
+      await shared.finish()
+    except Exception as e:
+      await shared.finish(e)
+    finally:
+      self._in_flight_async.pop(key, None)
+
+  # ======================
+  # Answer cache + prompt assembly
+  # ======================
+
+  def _cached_answer(self,query_embedding):
+    """
+    Return the cached answer of a similar question or None
+
+    Args:
+        query_embedding (list): embedding of the user question
+    """
+    if self.answer_cache is None:
+      return None
+    return self.answer_cache.get(query_embedding,self.model,self.database.index_version)
+
+  def _cache_answer(self,query_embedding,answer):
+    """
+    Save the answer in the cache
+
+    Args:
+        query_embedding (list): embedding of the user question
+        answer (str): answer of the LLM
+    """
+    if self.answer_cache is not None:
+      self.answer_cache.put(query_embedding,self.model,self.database.index_version,answer)
+
+  def _assemble_messages(self,query_string,n_results_apidocs,n_results_apispecs,query_embedding=None):
+    """
+    Search for context in vectorDB + assemble the messages (system prompt, context + user question) for the LLM
+
+    Args:
+        query_string (str): details of the REST API call
+        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
+        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
+        query_embedding (list): embedding of the query string, if it is already known
+    """
+    # context queries to vectorDB: the query string is embedded once for both searches
+    hits = self.database.query_db_multi(query_string,{"apidocs": n_results_apidocs, "apispecs": n_results_apispecs},query_embedding,adaptive=self.adaptive_retrieval)
+
+    with span("build_prompt"):
+      return self._build_messages(query_string,hits["apidocs"],hits["apispecs"])
+
+  async def _assemble_messages_async(self,query_string,n_results_apidocs,n_results_apispecs,query_embedding=None):
+    """
+    Same as _assemble_messages(), but the vectorDB is queried without blocking the event loop
+
+    Args:
+        query_string (str): details of the REST API call
+        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
+        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
+        query_embedding (list): embedding of the query string, if it is already known
+    """
+    # context queries to vectorDB: the query string is embedded once for both searches
+    hits = await self.database.query_db_multi_async(query_string,{"apidocs": n_results_apidocs, "apispecs": n_results_apispecs},query_embedding,adaptive=self.adaptive_retrieval)
+
+    with span("build_prompt"):
+      return self._build_messages(query_string,hits["apidocs"],hits["apispecs"])
+
+  def _build_messages(self,query_string,hits_apidocs,hits_apispecs):
+    """
+    Assemble the messages (system prompt, context + user question) for the LLM.
+    The exact REST API query information of all retrieved endpoints (endpoint catalog) is added first, up to half of the
+    token budget. The remaining token budget for the context is split between both context types by their number of hits.
+
+    Args:
+        query_string (str): details of the REST API call
+        hits_apidocs (list): vectorDB hits of the API docs on developer.cisco.com
+        hits_apispecs (list): vectorDB hits of the extended API specification document
+    """
+    context = ""
+    context_token_budget = self.context_token_budget
+    if self.endpoint_catalog is not None:
+      endpoints = self.endpoint_catalog.endpoints_for(query_string, hits_apispecs, token_budget=context_token_budget // 2)
+      if endpoints:
+        context_query_endpoints = "\n\n".join(EndpointCatalog.parameter_block(endpoint) for endpoint in endpoints)
+        context_token_budget -= estimate_tokens(context_query_endpoints)
+        context = f'''Exact REST API query information of the relevant endpoints delimited with XML tags:\n<api-endpoints>\n{context_query_endpoints}\n</api-endpoints>\n'''
+
+    budget_apidocs = context_token_budget * len(hits_apidocs) // max(1, len(hits_apidocs) + len(hits_apispecs))
+    context_query_apidocs = pack_context(hits_apidocs, budget_apidocs)
+    context_query_apispecs = pack_context(hits_apispecs, context_token_budget - budget_apidocs)
+    context += f'''Context information delimited with XML tags:\n<context>\n{context_query_apidocs}\n</context>
+                  API specification context delimited with XML tags:\n<api-context>\n{context_query_apispecs}\n</api-context>'''
+
+    question = f"\n\nUser question: '{query_string}'"
+
+    message = context + question
+
+    log.debug(message)
+
+    return [
+      { "role": "system",
+      "content": """You are the Cisco Catalyst Center REST API and Python code assistant. You provide documentation and Python code for developers.
+         Always list all available query parameters from the provided context. Include the REST operation and query path.
+         1. you create documentation to the specific API calls. 
+         2. you create an example source code in the programming language Python using the 'requests' library.
+         Tell the user if you do not know the answer. If loops or advanced code is needed, provide it.
+         ###
+         Every API query needs to include the header parameter 'X-Auth-Token' for authentication and authorization. This is where the access token is defined.
+         If the user does not have the access token, the user needs to call the REST API query '/dna/system/api/v1/auth/token' to receive the access token. Only the API query '/dna/system/api/v1/auth/token' is using the Basic authentication scheme, as defined in RFC 7617. All other API queries need to have the header parameter 'X-Auth-Token' defined.
+         ###
+        """
+      },
+      {"role": "user", "content": message}
+    ]
+
+class _SharedStream:
+  def __init__(self):
+    """ Tokens of one in-flight answer which are read by several requests (threads) """
+    self.tokens = []
+    self.done = False
+    self.error = None
+    self._condition = threading.Condition()
+
+  def append(self, token):
+    with self._condition:
+      self.tokens.append(token)
+      self._condition.notify_all()
+
+  def finish(self, error = None):
+    with self._condition:
+      self.done = True
+      self.error = error
+      self._condition.notify_all()
+
+  def read(self):
+    """ yield all tokens from the beginning, wait for new tokens until the answer is finished """
+    index = 0
+    while True:
+      with self._condition:
+        self._condition.wait_for(lambda: len(self.tokens) > index or self.done)
+        tokens, done, error = self.tokens[index:], self.done, self.error
+      yield from tokens
+      index += len(tokens)
+      if done:
+        if error is not None:
+          raise error
+        return
+
+class _AsyncSharedStream:
+  def __init__(self):
+    """ Tokens of one in-flight answer which are read by several requests (tasks) """
+    self.tokens = []
+    self.done = False
+    self.error = None
+    # task which writes the tokens
+    self.producer = None
+    self._condition = asyncio.Condition()
+
+  async def append(self, token):
+    async with self._condition:
+      self.tokens.append(token)
+      self._condition.notify_all()
+
+  async def finish(self, error = None):
+    async with self._condition:
+      self.done = True
+      self.error = error
+      self._condition.notify_all()
+
+  async def read(self):
+    """ yield all tokens from the beginning, wait for new tokens until the answer is finished """
+    index = 0
+    while True:
+      async with self._condition:
+        await self._condition.wait_for(lambda: len(self.tokens) > index or self.done)
+        tokens, done, error = self.tokens[index:], self.done, self.error
+      for token in tokens:
+        yield token
+      index += len(tokens)
+      if done:
+        if error is not None:
+          raise error
+        return
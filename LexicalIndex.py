@@ -0,0 +1,168 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import collections
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import logging
+log = logging.getLogger("applogger")
+
+def tokenize(text):
+  """
+  Split a text into lower-case search terms.
+  API paths, header names and parameters are kept as a whole term and additionally split into their parts:
+  "/dna/intent/api/v1/network-device" --> the full path + "dna", "intent", "api", "v1", "network", "device"
+  "siteId" --> "siteid" + "site", "id"
+
+  Args:
+      text (str): text to tokenize
+  """
+  terms = []
+  for word in re.findall(r"[A-Za-z0-9_\-\./\{\}]+", text):
+    word = word.strip("./-")
+    if not word:
+      continue
+    terms.append(word.lower())
+    parts = [part.lower() for segment in re.split(r"[^A-Za-z0-9]+", word) for part in re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", segment)]
+    if len(parts) > 1:
+      terms.extend(parts)
+  return terms
+
+class BM25Index:
+  def __init__(self, filepath, k1 = 1.5, b = 0.75):
+    """
+    In-process inverted index with BM25 ranking over the same documents + ids as the vectorDB collection
+
+    Args:
+        filepath (str): path to the JSON file in which the index is persisted
+        k1 (float): BM25 term frequency saturation
+        b (float): BM25 document length normalization
+    """
+    self.filepath = filepath
+    self.k1 = k1
+    self.b = b
+
+    # id --> (term frequencies, document length, doc_type)
+    self._documents = {}
+    # term --> {id: term frequency}
+    self._postings = collections.defaultdict(dict)
+    self._total_length = 0
+    self._lock = threading.Lock()
+
+    if os.path.exists(filepath):
+      with open(filepath, "r") as f:
+        for id, (frequencies, length, doc_type) in json.load(f).items():
+          self._insert(id, frequencies, length, doc_type)
+
+  def __len__(self):
+    return len(self._documents)
+
+  def upsert(self, ids, documents, metadatas = None):
+    """
+    Add documents to the index or replace the documents with the same ids
+
+    Args:
+        ids (list): list of IDs
+        documents (list): list of documents
+        metadatas (list): list of metadata (only "doc_type" is used)
+    """
+    metadatas = metadatas or [None] * len(ids)
+    with self._lock:
+      for id, document, metadata in zip(ids, documents, metadatas):
+        self._remove(id)
+        terms = tokenize(document)
+        self._insert(id, collections.Counter(terms), len(terms), (metadata or {}).get("doc_type"))
+
+  def delete(self, ids):
+    """
+    Remove documents from the index
+
+    Args:
+        ids (list): list of IDs
+    """
+    with self._lock:
+      for id in ids:
+        self._remove(id)
+
+  def search(self, query_string, n_results, doc_type = None):
+    """
+    Return the best matching documents
+
+    Args:
+        query_string (str): search query
+        n_results (int): maximum number of results
+        doc_type (str): only search documents of this doc_type (None: all documents)
+
+    Returns:
+        list: (id, BM25 score) tuples, best match first
+    """
+    with self._lock:
+      if not self._documents:
+        return []
+
+      count = len(self._documents)
+      average_length = self._total_length / count
+      scores = collections.defaultdict(float)
+
+      for term in set(tokenize(query_string)):
+        postings = self._postings.get(term)
+        if not postings:
+          continue
+        idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for id, frequency in postings.items():
+          _, length, document_type = self._documents[id]
+          if doc_type is not None and document_type != doc_type:
+            continue
+          scores[id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+
+      return heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+
+  def save(self):
+    """
+    Save the index (atomic replace of the file)
+    """
+    with self._lock:
+      data = {id: [dict(frequencies), length, doc_type] for id, (frequencies, length, doc_type) in self._documents.items()}
+    with open(self.filepath + ".tmp", "w") as f:
+      json.dump(data, f)
+    os.replace(self.filepath + ".tmp", self.filepath)
+
+  def _insert(self, id, frequencies, length, doc_type):
+    self._documents[id] = (frequencies, length, doc_type)
+    self._total_length += length
+    for term, frequency in frequencies.items():
+      self._postings[term][id] = frequency
+
+  def _remove(self, id):
+    entry = self._documents.pop(id, None)
+    if entry is None:
+      return
+    frequencies, length, _ = entry
+    self._total_length -= length
+    for term in frequencies:
+      postings = self._postings[term]
+      postings.pop(id, None)
+      if not postings:
+        del self._postings[term]
+
+def reciprocal_rank_fusion(rankings, k = 60):
+  """
+  Fuse several rankings of ids into one (reciprocal rank fusion)
+
+  Args:
+      rankings (list): lists of ids, best first
+      k (int): RRF constant, higher values reduce the influence of the top ranks
+
+  Returns:
+      list: (id, fused score) tuples, best first
+  """
+  scores = collections.defaultdict(float)
+  for ranking in rankings:
+    for rank, id in enumerate(ranking):
+      scores[id] += 1 / (k + rank + 1)
+  return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,354 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import json
+import threading
+import time
+import uuid
+from ContextPacker import estimate_tokens
+import logging
+log = logging.getLogger("applogger")
+
+# Price in dollars per 1 million tokens: (input / prompt, output / completion)
+# Local models (Ollama, default embedding function) are free
+MODEL_PRICES = {
+  "gpt-3.5-turbo": (0.5, 1.5),
+  "gpt-4o": (5.0, 15.0),
+  "gpt-4o-mini": (0.15, 0.6),
+  "text-embedding-3-small": (0.02, 0.0),
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Counter:
+  def __init__(self, name, documentation, labelnames = ()):
+    """
+    Prometheus-style counter
+
+    Args:
+        name (str): metric name
+        documentation (str): help text
+        labelnames (tuple): names of the labels
+    """
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def inc(self, amount = 1, **labels):
+    """ increase the counter of the given label values """
+    key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def value(self, **labels):
+    """ current value of the given label values """
+    return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+  def render(self):
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+    with self._lock:
+      for key, value in sorted(self._values.items()):
+        lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+    return lines
+
+class Histogram:
+  def __init__(self, name, documentation, labelnames = (), buckets = DEFAULT_BUCKETS):
+    """
+    Prometheus-style histogram
+
+    Args:
+        name (str): metric name
+        documentation (str): help text
+        labelnames (tuple): names of the labels
+        buckets (tuple): upper bounds of the buckets (+Inf is added)
+    """
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.buckets = tuple(buckets)
+    # label values --> [bucket counts, sum, count]
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def observe(self, value, **labels):
+    """ add an observation to the histogram of the given label values """
+    key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+    with self._lock:
+      entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+      index = bisect.bisect_left(self.buckets, value)
+      if index < len(self.buckets):
+        entry[0][index] += 1
+      entry[1] += value
+      entry[2] += 1
+
+  def render(self):
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+    with self._lock:
+      for key, (bucket_counts, total, count) in sorted(self._values.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, bucket_counts):
+          cumulative += bucket_count
+          lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), key + (repr(float(bound)),))} {cumulative}')
+        lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), key + ("+Inf",))} {count}')
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+    return lines
+
+class Gauge:
+  def __init__(self, name, documentation, labelnames = ()):
+    """
+    Prometheus-style gauge (a value which goes up + down, e.g. a queue depth)
+
+    Args:
+        name (str): metric name
+        documentation (str): help text
+        labelnames (tuple): names of the labels
+    """
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def inc(self, amount = 1, **labels):
+    """ increase the value of the given label values """
+    key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount = 1, **labels):
+    """ decrease the value of the given label values """
+    self.inc(-amount, **labels)
+
+  def set(self, value, **labels):
+    """ set the value of the given label values """
+    with self._lock:
+      self._values[tuple(str(labels.get(name, "")) for name in self.labelnames)] = value
+
+  def value(self, **labels):
+    """ current value of the given label values """
+    return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+  def render(self):
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+    with self._lock:
+      for key, value in sorted(self._values.items()):
+        lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+    return lines
+
+def _labels(names, values):
+  """ {name="value",...} of the Prometheus text format """
+  if not names:
+    return ""
+  escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+  return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Registry:
+  def __init__(self):
+    """ All metrics of the app, rendered in the Prometheus text format """
+    self._metrics = []
+
+  def counter(self, name, documentation, labelnames = ()):
+    metric = Counter(name, documentation, labelnames)
+    self._metrics.append(metric)
+    return metric
+
+  def gauge(self, name, documentation, labelnames = ()):
+    metric = Gauge(name, documentation, labelnames)
+    self._metrics.append(metric)
+    return metric
+
+  def histogram(self, name, documentation, labelnames = (), buckets = DEFAULT_BUCKETS):
+    metric = Histogram(name, documentation, labelnames, buckets)
+    self._metrics.append(metric)
+    return metric
+
+  def render(self):
+    """ text of the /metrics endpoint """
+    return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("assistant_stage_seconds", "Duration of a stage (embedding, vectorDB query, prompt build, generation, import)", ["stage"])
+REQUESTS = REGISTRY.counter("assistant_requests_total", "User questions (status: ok, error or cancelled)", ["model", "cache", "status"])
+REQUEST_SECONDS = REGISTRY.histogram("assistant_request_seconds", "Duration of a user question until the last token", ["model"])
+TTFT_SECONDS = REGISTRY.histogram("assistant_time_to_first_token_seconds", "Duration of a user question until the first token", ["model"])
+LLM_TOKENS = REGISTRY.counter("assistant_llm_tokens_total", "Tokens sent to + generated by the LLM", ["model", "kind"])
+EMBEDDING_TEXTS = REGISTRY.counter("assistant_embedding_texts_total", "Texts sent to the embedding function", ["model"])
+EMBEDDING_TOKENS = REGISTRY.counter("assistant_embedding_tokens_total", "Tokens sent to the embedding function", ["model"])
+COST_DOLLARS = REGISTRY.counter("assistant_cost_dollars_total", "Estimated cost of the LLM + embedding requests", ["model"])
+RETRIEVED_DISTANCE = REGISTRY.histogram("assistant_retrieved_distance", "Distance of the retrieved vectorDB hits", ["doc_type"], buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0, 1.5, 2.0))
+RETRIEVED_HITS = REGISTRY.histogram("assistant_retrieved_hits", "Number of vectorDB hits per query + doc_type (adaptive retrieval)", ["doc_type"], buckets=(1, 2, 3, 5, 8, 10, 15, 20, 30))
+COALESCED_REQUESTS = REGISTRY.counter("assistant_coalesced_requests_total", "LLM requests which shared the completion of an identical in-flight request", ["model"])
+RETRIEVAL_QUEUE_DEPTH = REGISTRY.gauge("assistant_retrieval_queue_depth", "Requests of the retrieval server which are running + requests which wait for the next embedding call", ["queue"])
+RETRIEVAL_RPC_SECONDS = REGISTRY.histogram("assistant_retrieval_rpc_seconds", "Duration of a request of the retrieval server", ["method"])
+EMBEDDING_BATCH_TEXTS = REGISTRY.histogram("assistant_embedding_batch_texts", "Query texts per embedding call of the retrieval server (requests of all workers)", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+IMPORTED_DOCUMENTS = REGISTRY.counter("assistant_imported_documents_total", "Chunks written to the vectorDB", ["kind"])
+
+# the request which is currently processed (also set in the worker threads of the request)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def add_cost(model, input_tokens, output_tokens = 0):
+  """ add the estimated cost of a request to the cost counter """
+  input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+  COST_DOLLARS.inc((input_tokens * input_price + output_tokens * output_price) / 1_000_000, model=model)
+
+def record_llm_usage(model, messages, answer, usage = None):
+  """
+  Add the tokens + cost of one LLM request to the counters
+
+  Args:
+      model (str): name of the LLM
+      messages (list): messages sent to the LLM
+      answer (str): generated answer
+      usage (tuple): (prompt tokens, completion tokens) reported by the LLM. None: estimated from the texts
+
+  Returns:
+      tuple: (prompt tokens, completion tokens)
+  """
+  if usage is None:
+    usage = (sum(estimate_tokens(message["content"]) for message in messages or []), estimate_tokens(answer) if answer else 0)
+  prompt_tokens, completion_tokens = usage
+
+  LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+  LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+  add_cost(model, prompt_tokens, completion_tokens)
+  return prompt_tokens, completion_tokens
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+  """
+  Measure one stage: its duration is added to the stage histogram, logged (JSON) and added to the current request trace.
+  The yielded dict can be used to add attributes (e.g. ids + distances of hits) while the stage is running.
+
+  Args:
+      stage (str): name of the stage, e.g. "query_db"
+      attributes: additional information which is logged
+  """
+  start_time = time.perf_counter()
+  try:
+    yield attributes
+  finally:
+    seconds = time.perf_counter() - start_time
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+    trace = _current_trace.get()
+    record = {"event": "span", "stage": stage, "seconds": round(seconds, 4), **attributes}
+    if trace is not None:
+      record["request_id"] = trace.request_id
+      trace.spans.append(record)
+    log.debug(json.dumps(record, default=str))
+
+class RequestTrace:
+  def __init__(self, model, query_string):
+    """
+    Trace of one user question: all spans (embedding, vectorDB queries, prompt build, generation),
+    time to first token, token counts + cost. It is logged as one JSON line when the request is finished.
+    Used as context manager around the request: a request which fails or is stopped (e.g. the stream is closed)
+    is recorded with the status "error" / "cancelled".
+
+    Args:
+        model (str): name of the LLM
+        query_string (str): user question
+    """
+    self.request_id = uuid.uuid4().hex[:12]
+    self.model = model
+    self.query_string = query_string
+    self.spans = []
+    self.start_time = time.perf_counter()
+    self.first_token_time = None
+    # duration + time to first token in seconds, set by finish()
+    self.seconds = None
+    self.ttft = None
+    self.finished = False
+    self._token = None
+
+  def __enter__(self):
+    self._token = _current_trace.set(self)
+    return self
+
+  def __exit__(self, exc_type, exc, traceback):
+    try:
+      if not self.finished:
+        cancelled = exc_type is not None and issubclass(exc_type, (GeneratorExit, asyncio.CancelledError))
+        self.finish(status="cancelled" if cancelled else "error", error=exc)
+    finally:
+      try:
+        _current_trace.reset(self._token)
+      except ValueError:
+        # finished in another context than it was started (e.g. a stream which is closed by another task)
+        _current_trace.set(None)
+
+  def first_token(self):
+    """ mark the arrival of the first token (only the first call counts) """
+    if self.first_token_time is None:
+      self.first_token_time = time.perf_counter()
+
+  def finish(self, messages = None, answer = "", usage = None, cache_hit = False, status = "ok", error = None):
+    """
+    Record the metrics of the finished request + log the trace
+
+    Args:
+        messages (list): messages sent to the LLM (for the prompt token count)
+        answer (str): generated answer (for the completion token count)
+        usage (tuple): (prompt tokens, completion tokens) reported by the LLM. None: estimated from the texts
+        cache_hit (bool): True if the answer came from the answer cache
+        status (str): "ok", "error" (e.g. the LLM or the vectorDB failed) or "cancelled" (e.g. the stream was closed)
+        error (Exception): exception of a failed request
+    """
+    self.finished = True
+    self.seconds = seconds = time.perf_counter() - self.start_time
+    self.first_token()
+    self.ttft = ttft = self.first_token_time - self.start_time
+
+    # the tokens of a failed request are unknown
+    prompt_tokens, completion_tokens = (0, 0) if cache_hit or status != "ok" else record_llm_usage(self.model, messages, answer, usage)
+
+    REQUESTS.inc(model=self.model, cache="hit" if cache_hit else "miss", status=status)
+    REQUEST_SECONDS.observe(seconds, model=self.model)
+    TTFT_SECONDS.observe(ttft, model=self.model)
+
+    log.info(json.dumps({
+      "event": "request",
+      "request_id": self.request_id,
+      "model": self.model,
+      "query": self.query_string,
+      "cache_hit": cache_hit,
+      "status": status,
+      "seconds": round(seconds, 4),
+      "ttft_seconds": round(ttft, 4),
+      "prompt_tokens": prompt_tokens,
+      "completion_tokens": completion_tokens,
+      "spans": self.spans,
+      **({"error": f"{type(error).__name__}: {error}"} if error is not None else {}),
+    }, default=str))
+
+class MeteredEmbeddingFunction:
+  def __init__(self, embedding_function, model_name):
+    """
+    Counts the texts, tokens + cost of an embedding function and measures each call.
+    It has the interface of chromadb.EmbeddingFunction without importing chromadb (the metrics are needed at app start).
+
+    Args:
+        embedding_function (chromadb.EmbeddingFunction): embedding function which does the work
+        model_name (str): name of the embedding model
+    """
+    self.embedding_function = embedding_function
+    self.model_name = model_name
+
+  def __call__(self, input):
+    with span("embedding_call", texts=len(input)):
+      embeddings = self.embedding_function(input)
+
+    tokens = sum(estimate_tokens(text) for text in input)
+    EMBEDDING_TEXTS.inc(len(input), model=self.model_name)
+    EMBEDDING_TOKENS.inc(tokens, model=self.model_name)
+    add_cost(self.model_name, tokens)
+    return embeddings
@@ -0,0 +1,657 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+
+Shared retrieval server: one process owns the vectorDB (chromadb collection, keyword index + embedding model),
+all chainlit workers use it with RetrievalClient (see setting_retrieval_service in main.py):
+    python RetrievalService.py --llm openai --socket chromadb/retrieval.sock
+    python RetrievalService.py --llm ollama --host 127.0.0.1 --port 8100
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import contextvars
+import functools
+import http.client
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import types
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from TalkToDatabase import VectorDB, IndexVersionFile
+from Metrics import span, REGISTRY, RETRIEVAL_QUEUE_DEPTH, RETRIEVAL_RPC_SECONDS, EMBEDDING_BATCH_TEXTS
+import logging
+log = logging.getLogger("applogger")
+
+class RetrievalServiceError(Exception):
+  """ a request failed on the retrieval server """
+
+# token of the import (begin_build()) of the client which is running in the current context, sent with every request
+_current_build = contextvars.ContextVar("current_build", default=None)
+
+class EmbeddingBatcher:
+  def __init__(self, embedding_function, max_batch_size = 64, max_wait = 0.002):
+    """
+    Micro-batching of the query embeddings: the texts of concurrent requests (of all workers) are embedded with one call.
+    While a call is running, the next texts queue up and are embedded together with the next call.
+
+    Args:
+        embedding_function (function): embedding function, e.g. VectorDB.embeddings_function (with the embedding cache)
+        max_batch_size (int): maximum number of texts per call
+        max_wait (float): seconds the first text of a batch waits for more texts
+    """
+    self.embedding_function = embedding_function
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.calls = 0
+    self.texts = 0
+    # (texts, Future) of the waiting requests
+    self._queue = queue.Queue()
+    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+    self._thread.start()
+
+  def embed(self, texts):
+    """
+    Embeddings of the texts (blocks until the batch with these texts is embedded)
+
+    Args:
+        texts (list): list of texts
+
+    Returns:
+        list: one embedding per text
+    """
+    future = Future()
+    RETRIEVAL_QUEUE_DEPTH.inc(queue="embedding")
+    self._queue.put((list(texts), future))
+    return future.result()
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      size = len(batch[0][0])
+      deadline = time.perf_counter() + self.max_wait
+      while size < self.max_batch_size:
+        try:
+          batch.append(self._queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+        except queue.Empty:
+          break
+        size += len(batch[-1][0])
+      RETRIEVAL_QUEUE_DEPTH.dec(len(batch), queue="embedding")
+      self._embed(batch)
+
+  def _embed(self, batch):
+    """ one embedding call for the texts of all requests of the batch """
+    # identical texts (e.g. the same question in several workers) are embedded once
+    texts = list(dict.fromkeys(text for request_texts, _ in batch for text in request_texts))
+    try:
+      embeddings = dict(zip(texts, self.embedding_function(texts)))
+    except Exception as e:
+      for _, future in batch:
+        future.set_exception(e)
+      return
+
+    self.calls += 1
+    self.texts += len(texts)
+    EMBEDDING_BATCH_TEXTS.observe(len(texts))
+    for request_texts, future in batch:
+      future.set_result([embeddings[text] for text in request_texts])
+
+class _WorkerBuild:
+  def __init__(self, build, context, session, expires):
+    """ import of a worker (begin_build()): building_version() context manager, its context, ImportSession + end of the lease """
+    self.build = build
+    self.context = context
+    self.session = session
+    self.expires = expires
+    # number of requests of this import which are running (the import does not expire while it is written)
+    self.running = 0
+
+class RetrievalServer:
+  def __init__(self, database, address = "chromadb/retrieval.sock", max_batch_size = 64, max_wait = 0.002, latency_samples = 1000, build_lease = 60):
+    """
+    Local retrieval server: the single owner of the vectorDB (chromadb client, collection, keyword index + embedding model).
+    The chainlit workers use it with RetrievalClient instead of opening chromadb themselves: the memory does not grow
+    with every worker, all writes go through one process and the query embeddings of all workers are embedded in batches.
+
+    JSON over HTTP: POST /<method> with {"args": [...], "session": token of begin_build() or null} --> {"result": ..., "seconds": ...} or {"error": ..., "type": ...}
+    GET /stats: queue depths, embedding batches + latencies per method. GET /metrics: Prometheus metrics of the server
+
+    Args:
+        database (VectorDB): the vectorDB
+        address (str or tuple): path of a Unix socket or (host, port) of a TCP socket
+        max_batch_size (int): maximum number of query texts per embedding call
+        max_wait (float): seconds a query text waits for the texts of other requests
+        latency_samples (int): number of the latest durations per method for the percentiles of /stats
+        build_lease (float): seconds an import of a worker stays open without a request or renew_build() (e.g. the worker crashed), then it is rolled back
+    """
+    self.database = database
+    self.address = address
+    self.batcher = EmbeddingBatcher(lambda texts: database.embeddings_function(texts), max_batch_size, max_wait)
+    self.latency_samples = latency_samples
+    self.build_lease = build_lease
+
+    # methods which the clients can call
+    self.methods = {
+      "info": self.info,
+      "embed_query": self.embed_query,
+      "query_db": self.query_db,
+      "query_db_multi": self.query_db_multi,
+      "query_db_batch": database.query_db_batch,
+      "collection_add": database.collection_add,
+      "collection_upsert": database.collection_upsert,
+      "collection_delete": database.collection_delete,
+      "collection_doc_types": database.collection_doc_types,
+      "collection_add_bulk": database.collection_add_bulk,
+      "collection_upsert_bulk": database.collection_upsert_bulk,
+      "begin_build": self.begin_build,
+      "renew_build": self.renew_build,
+      "end_build": self.end_build,
+    }
+
+    # token --> _WorkerBuild of an import of a worker
+    self._builds = {}
+    # method --> latest durations in seconds
+    self._latencies = {}
+    self._lock = threading.Lock()
+    self._server = None
+    self._stopped = threading.Event()
+
+  # ======================
+  # Methods of the clients
+  # ======================
+
+  def info(self):
+    """ settings + state of the vectorDB which the clients need locally """
+    return {
+      "collection_name": self.database.collection_name,
+      "database_path": self.database.database_path,
+      "write_version": self.database.write_version,
+      "active_version": self.database.active_version.name,
+      "index_version": self.database.index_version,
+    }
+
+  def embed_query(self, query_string):
+    return self.batcher.embed([query_string])[0]
+
+  def query_db(self, query_string, n_results, where_clause = None):
+    return self.database.query_db(query_string, n_results, where_clause, query_embedding=self.embed_query(query_string))
+
+  def query_db_multi(self, query_string, n_results_by_filter, query_embedding = None, adaptive = False):
+    """ same as VectorDB.query_db_multi(), but the WHERE clauses (also None) are sent as list of (WHERE clause, n_results) """
+    if query_embedding is None:
+      query_embedding = self.embed_query(query_string)
+    results = self.database.query_db_multi(query_string, dict(n_results_by_filter), query_embedding, adaptive)
+    return list(results.items())
+
+  def begin_build(self):
+    """
+    Enter VectorDB.building_version() for an import of a worker, returns (token for end_build(), lease in seconds).
+    The writes of the import send the token, so they are written into the new version as part of this import.
+    Each request with the token renews the lease, the client calls renew_build() in between.
+    If the lease expires (e.g. the worker crashed), the import is rolled back.
+    """
+    build = self.database.building_version()
+    # entered + exited in the same context (each request of the client can run in another thread)
+    context = contextvars.Context()
+    session = context.run(build.__enter__)
+    token = uuid.uuid4().hex
+    with self._lock:
+      self._builds[token] = _WorkerBuild(build, context, session, time.monotonic() + self.build_lease)
+    return token, self.build_lease
+
+  def renew_build(self, token):
+    """ renew the lease of an import of a worker (heartbeat of the client) """
+    with self._lock:
+      worker_build = self._builds.get(token)
+      if worker_build is None:
+        raise RuntimeError(f"The import '{token}' expired and was rolled back")
+      worker_build.expires = time.monotonic() + self.build_lease
+
+  def end_build(self, token, failed = False):
+    """ exit VectorDB.building_version() of an import of a worker: a failed import rolls back its own documents """
+    with self._lock:
+      worker_build = self._builds.pop(token, None)
+    if worker_build is None:
+      raise RuntimeError(f"The import '{token}' expired and was rolled back")
+    self._exit_build(worker_build, failed)
+
+  def _exit_build(self, worker_build, failed):
+    if failed:
+      error = RuntimeError("The import of a worker failed")
+      worker_build.context.run(worker_build.build.__exit__, RuntimeError, error, None)
+    else:
+      worker_build.context.run(worker_build.build.__exit__, None, None, None)
+
+  def _expire_builds(self):
+    """ roll back the imports whose lease expired (the worker crashed or lost the connection) """
+    while not self._stopped.wait(min(self.build_lease / 4, 5)):
+      now = time.monotonic()
+      with self._lock:
+        expired = [token for token, worker_build in self._builds.items() if worker_build.expires < now and not worker_build.running]
+        expired = [(token, self._builds.pop(token)) for token in expired]
+      for token, worker_build in expired:
+        log.warning(f"Retrieval server: the lease of the import '{token}' expired, rolling it back")
+        try:
+          self._exit_build(worker_build, failed=True)
+        except Exception as e:
+          log.error(f"Retrieval server: rollback of the import '{token}' failed! Error: {e}")
+
+  # ======================
+  # Server
+  # ======================
+
+  def dispatch(self, method, request):
+    """
+    Run one request
+
+    Args:
+        method (str): name of the method
+        request (dict): {"args": [...]}
+
+    Returns:
+        tuple: (HTTP status, response dict)
+    """
+    function = self.methods.get(method)
+    if function is None:
+      return 404, {"error": f"Unknown method '{method}'", "type": "ValueError"}
+
+    token = request.get("session")
+    with self._lock:
+      worker_build = self._builds.get(token)
+      if worker_build is not None:
+        worker_build.running += 1
+    if token is not None and worker_build is None:
+      return 409, {"error": f"Unknown or expired import '{token}'", "type": "RuntimeError"}
+
+    RETRIEVAL_QUEUE_DEPTH.inc(queue="requests")
+    start_time = time.perf_counter()
+    try:
+      with self.database.in_import(worker_build.session) if worker_build is not None else contextlib.nullcontext():
+        result = function(*request.get("args", []))
+    except Exception as e:
+      log.error(f"Retrieval server: {method} failed! Error: {e}")
+      return 500, {"error": str(e), "type": type(e).__name__}
+    finally:
+      seconds = time.perf_counter() - start_time
+      RETRIEVAL_QUEUE_DEPTH.dec(queue="requests")
+      RETRIEVAL_RPC_SECONDS.observe(seconds, method=method)
+      with self._lock:
+        self._latencies.setdefault(method, collections.deque(maxlen=self.latency_samples)).append(seconds)
+        if worker_build is not None:
+          # a request of the import renews its lease
+          worker_build.running -= 1
+          worker_build.expires = time.monotonic() + self.build_lease
+    return 200, {"result": result, "seconds": seconds}
+
+  def stats(self):
+    """ queue depths, embedding batches + latency percentiles (ms) per method """
+    with self._lock:
+      latencies = {method: sorted(values) for method, values in self._latencies.items()}
+    return {
+      "requests_running": RETRIEVAL_QUEUE_DEPTH.value(queue="requests"),
+      "embedding_queue": RETRIEVAL_QUEUE_DEPTH.value(queue="embedding"),
+      "embedding_calls": self.batcher.calls,
+      "embedded_texts": self.batcher.texts,
+      "imports_open": len(self._builds),
+      "latency_ms": {method: {
+        "count": len(values),
+        **{f"p{p}": round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 2) for p in (50, 95, 99)}
+      } for method, values in latencies.items()},
+    }
+
+  def serve_forever(self):
+    """ open the vectorDB, load the embedding model + answer requests until the process is stopped """
+    self.database.warm_up()
+    self._bind()
+    log.info(f"Retrieval server listening on {self.address}")
+    try:
+      self._server.serve_forever()
+    finally:
+      self._close()
+
+  def __enter__(self):
+    """ answer requests in a background thread (e.g. in the benchmark) """
+    self._bind()
+    threading.Thread(target=self._server.serve_forever, name="retrieval-server", daemon=True).start()
+    return self
+
+  def __exit__(self, *exc):
+    self._server.shutdown()
+    self._close()
+
+  def _bind(self):
+    retrieval = self
+
+    class Handler(BaseHTTPRequestHandler):
+      # keep-alive: every thread of a client keeps its connection
+      protocol_version = "HTTP/1.1"
+
+      def do_GET(self):
+        if self.path == "/stats":
+          self._send(200, json.dumps(retrieval.stats()).encode("utf-8"))
+        elif self.path == "/metrics":
+          self._send(200, REGISTRY.render().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+          self._send(404, b'{"error": "Not found"}')
+
+      def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        status, response = retrieval.dispatch(self.path.strip("/"), request)
+        self._send(status, json.dumps(response, default=_to_json).encode("utf-8"))
+
+      def _send(self, status, content, content_type = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+      def log_message(self, format, *args):
+        # the client address of a Unix socket is empty
+        log.debug(f"Retrieval server: {format % args}")
+
+    if isinstance(self.address, str):
+      if os.path.exists(self.address):
+        if _listening(self.address):
+          raise RuntimeError(f"A retrieval server is already listening on {self.address}")
+        # left over by a server which was killed
+        os.remove(self.address)
+      self._server = _ThreadingUnixHTTPServer(self.address, Handler)
+    else:
+      self._server = _ThreadingTCPHTTPServer(tuple(self.address), Handler)
+
+    self._stopped.clear()
+    threading.Thread(target=self._expire_builds, name="retrieval-build-leases", daemon=True).start()
+
+  def _close(self):
+    self._stopped.set()
+    self._server.server_close()
+    # the imports which are still open cannot be finished anymore
+    with self._lock:
+      open_builds = list(self._builds.values())
+      self._builds.clear()
+    for worker_build in open_builds:
+      self._exit_build(worker_build, failed=True)
+    if isinstance(self.address, str) and os.path.exists(self.address):
+      os.remove(self.address)
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+  daemon_threads = True
+  # connections of all threads of all workers: a full backlog of a Unix socket fails the connect() immediately (EAGAIN)
+  request_queue_size = 256
+
+class _ThreadingTCPHTTPServer(ThreadingHTTPServer):
+  daemon_threads = True
+  request_queue_size = 256
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+  def __init__(self, socket_path):
+    """ HTTP connection over a Unix socket """
+    super().__init__("localhost", timeout=None)
+    self.socket_path = socket_path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.settimeout(self.timeout)
+    self.sock.connect(self.socket_path)
+
+def _listening(socket_path):
+  """ True if a server accepts connections on the Unix socket """
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+    try:
+      s.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+      return False
+  return True
+
+def _to_json(value):
+  """ NumPy arrays + numbers (embeddings, distances) as JSON """
+  if hasattr(value, "tolist"):
+    return value.tolist()
+  raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class RetrievalClient:
+  def __init__(self, address = "chromadb/retrieval.sock", collection_name = "catcenter_vectors", database_path = "chromadb/", timeout = 120, executor_workers = 8, records_per_request = 2048):
+    """
+    Thin client of the RetrievalServer with the interface of VectorDB (query_db, query_db_multi, embed_query, collection_add, ...).
+    The chainlit workers use it instead of their own VectorDB. Each thread has its own keep-alive connection.
+    The server has to run on the same host: the index version + the import manifests are files in database_path.
+
+    Args:
+        address (str or tuple): path of the Unix socket or (host, port) of the retrieval server
+        collection_name (str): name of the collection of the server
+        database_path (str): persistent storage of the vectorDB of the server
+        timeout (float): seconds until a query fails. Writes + new versions of the collection have no timeout
+        executor_workers (int): number of threads which run the requests of the async functions
+        records_per_request (int): records of collection_*_bulk() which are sent with one request (the server writes them in batches)
+    """
+    self.address = address
+    self.collection_name = collection_name
+    self.database_path = database_path
+    self.timeout = timeout
+    self.records_per_request = records_per_request
+    self._local = threading.local()
+    self._index_version = IndexVersionFile(os.path.join(database_path, f"{collection_name}_index_version"))
+
+    # the requests are blocking: the async functions run them in these threads
+    self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="retrievalclient")
+
+  # ======================
+  # Requests
+  # ======================
+
+  def _call(self, method, *args, writes = False):
+    """
+    Call a method of the retrieval server
+
+    Args:
+        method (str): name of the method, see RetrievalServer.methods
+        args: arguments of the method (JSON)
+        writes (bool): True for writes + new versions of the collection (no timeout)
+    """
+    body = json.dumps({"args": args, "session": _current_build.get()}, default=_to_json).encode("utf-8")
+    with span("retrieval_rpc", method=method) as attributes:
+      status, response = self._request("POST", f"/{method}", body, None if writes else self.timeout)
+      attributes["server_seconds"] = response.get("seconds")
+    if status != 200:
+      raise RetrievalServiceError(f"{method} failed on the retrieval server: {response.get('type')}: {response.get('error')}")
+    return response["result"]
+
+  def _request(self, http_method, path, body = None, timeout = None):
+    """ one HTTP request on the connection of this thread, returns (status, JSON response) """
+    for attempt in range(2):
+      connection = self._connection()
+      connection.timeout = timeout
+      if connection.sock is not None:
+        connection.sock.settimeout(timeout)
+      try:
+        connection.request(http_method, path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+      except (ConnectionResetError, BrokenPipeError):
+        # the keep-alive connection was closed by the server (e.g. restarted): once more with a new connection
+        self._drop_connection(connection)
+        if attempt:
+          raise
+      except BaseException:
+        # e.g. timeout: the connection is in the middle of a request and cannot be used anymore
+        self._drop_connection(connection)
+        raise
+
+  def _drop_connection(self, connection):
+    """ close the connection of this thread, the next request opens a new one """
+    connection.close()
+    self._local.connection = None
+
+  def _connection(self):
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      if isinstance(self.address, str):
+        connection = _UnixHTTPConnection(self.address)
+      else:
+        connection = http.client.HTTPConnection(*self.address)
+      self._local.connection = connection
+    return connection
+
+  def stats(self):
+    """ queue depths, embedding batches + latencies of the retrieval server (see RetrievalServer.stats()) """
+    return self._request("GET", "/stats", timeout=self.timeout)[1]
+
+  # ======================
+  # Interface of VectorDB
+  # ======================
+
+  def warm_up(self):
+    """ connect to the retrieval server (it opens the vectorDB + loads the embedding model itself) """
+    self._call("info")
+
+  @property
+  def write_version(self):
+    """ name of the version of the collection which is written (see VectorDB.write_version) """
+    return self._call("info")["write_version"]
+
+  @property
+  def active_version(self):
+    """ queried version of the collection (see VectorDB.active_version), only its name is known on the client """
+    return types.SimpleNamespace(name=self._call("info")["active_version"])
+
+  def version_file(self, suffix, version = None):
+    """ path of a file which belongs to one version of the collection (see VectorDB.version_file()) """
+    return os.path.join(self.database_path, f"{version or self.write_version}_{suffix}")
+
+  @property
+  def index_version(self):
+    """ version stamp of the collection (see VectorDB.index_version), read from the file of the server """
+    return self._index_version.read()
+
+  def query_db(self, query_string, n_results, where_clause=None):
+    return self._call("query_db", query_string, n_results, where_clause)
+
+  def embed_query(self, query_string):
+    return self._call("embed_query", query_string)
+
+  def query_db_multi(self, query_string, n_results_by_filter, query_embedding=None, adaptive=False):
+    """ see VectorDB.query_db_multi() """
+    results = self._call("query_db_multi", query_string, list(n_results_by_filter.items()), query_embedding, adaptive)
+    return {where_clause: hits for where_clause, hits in results}
+
+  def query_db_batch(self, query_strings, n_results, where_clause=None):
+    return self._call("query_db_batch", list(query_strings), n_results, where_clause)
+
+  def collection_add(self,documents,ids,metadatas=None):
+    self._call("collection_add", documents, ids, metadatas, writes=True)
+
+  def collection_upsert(self,documents,ids,metadatas=None):
+    self._call("collection_upsert", documents, ids, metadatas, writes=True)
+
+  def collection_delete(self,ids):
+    if ids:
+      self._call("collection_delete", list(ids), writes=True)
+
+  def collection_doc_types(self):
+    return self._call("collection_doc_types", writes=True)
+
+  def collection_add_bulk(self,records,batch_size=128):
+    return self._write_bulk("collection_add_bulk",records,batch_size)
+
+  def collection_upsert_bulk(self,records,batch_size=128):
+    return self._write_bulk("collection_upsert_bulk",records,batch_size)
+
+  def _write_bulk(self,method,records,batch_size):
+    """ send the stream of records in chunks of records_per_request, the server writes each chunk in batches of batch_size """
+    total = 0
+    records = iter(records)
+    while True:
+      chunk = [list(record) for record in itertools.islice(records, max(self.records_per_request, batch_size))]
+      if not chunk:
+        return total
+      total += self._call(method, chunk, batch_size, writes=True)
+
+  @contextlib.contextmanager
+  def building_version(self):
+    """
+    see VectorDB.building_version(): the new version is built + activated by the server.
+    A heartbeat renews the lease of the import, if this process dies the server rolls the import back.
+    """
+    token, lease = self._call("begin_build", writes=True)
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=self._renew_build, args=(token, lease, stopped), name="retrievalclient-heartbeat", daemon=True)
+    heartbeat.start()
+    context_token = _current_build.set(token)
+    try:
+      yield
+    except BaseException:
+      _current_build.reset(context_token)
+      stopped.set()
+      self._call("end_build", token, True, writes=True)
+      raise
+    _current_build.reset(context_token)
+    stopped.set()
+    self._call("end_build", token, False, writes=True)
+
+  def _renew_build(self, token, lease, stopped):
+    """ heartbeat of an import (own thread + connection): renew its lease on the server until it is finished """
+    try:
+      while not stopped.wait(lease / 3):
+        try:
+          self._call("renew_build", token)
+        except Exception as e:
+          log.warning(f"Retrieval client: renewing the import '{token}' failed! Error: {e}")
+    finally:
+      connection = getattr(self._local, "connection", None)
+      if connection is not None:
+        self._drop_connection(connection)
+
+  async def embed_query_async(self, query_string):
+    return await self._run_in_executor(self.embed_query, query_string)
+
+  async def query_db_async(self, query_string, n_results, where_clause=None):
+    return await self._run_in_executor(self.query_db, query_string, n_results, where_clause)
+
+  async def query_db_multi_async(self, query_string, n_results_by_filter, query_embedding=None, adaptive=False):
+    return await self._run_in_executor(self.query_db_multi, query_string, n_results_by_filter, query_embedding, adaptive)
+
+  async def collection_add_bulk_async(self,records,batch_size=128):
+    return await self._run_in_executor(self.collection_add_bulk, records, batch_size)
+
+  async def collection_upsert_bulk_async(self,records,batch_size=128):
+    return await self._run_in_executor(self.collection_upsert_bulk, records, batch_size)
+
+  async def _run_in_executor(self, function, *args):
+    """ run a blocking request in the executor of this client (in a copy of the current context, e.g. the request trace) """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(self.executor, functools.partial(context.run, function, *args))
+
+def main():
+  parser = argparse.ArgumentParser(description="Shared retrieval server: one process owns the vectorDB + embedding model for all chainlit workers")
+  parser.add_argument("--llm", default="openai", help="LLM backend whose embedding function is used, e.g. openai or ollama (same as setting_chosen_LLM)")
+  parser.add_argument("--collection", default="catcenter_vectors", help="name of the collection")
+  parser.add_argument("--database-path", default="chromadb/", help="persistent storage of the vectorDB")
+  parser.add_argument("--socket", default="chromadb/retrieval.sock", help="path of the Unix socket")
+  parser.add_argument("--host", help="listen on this host + --port instead of the Unix socket, e.g. 127.0.0.1")
+  parser.add_argument("--port", type=int, default=8100, help="TCP port (only with --host)")
+  parser.add_argument("--snapshot", action="store_true", help="answer the vector searches from a memory-mapped NumPy snapshot (see VectorSnapshot.py)")
+  parser.add_argument("--max-batch-size", type=int, default=64, help="maximum number of query texts per embedding call")
+  parser.add_argument("--max-wait", type=float, default=0.002, help="seconds a query text waits for the texts of other requests")
+  parser.add_argument("--build-lease", type=float, default=60, help="seconds until the import of a worker without heartbeat (e.g. crashed) is rolled back")
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.WARNING)
+  log.setLevel(logging.INFO)
+
+  from LLMBackend import get_backend
+  database = VectorDB(args.collection, get_backend(args.llm).embeddings_function, args.database_path, snapshot=args.snapshot)
+  address = (args.host, args.port) if args.host else args.socket
+  RetrievalServer(database, address, max_batch_size=args.max_batch_size, max_wait=args.max_wait, build_lease=args.build_lease).serve_forever()
+
+if __name__ == "__main__":
+  main()
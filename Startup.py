@@ -0,0 +1,112 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from Metrics import span
+import logging
+log = logging.getLogger("applogger")
+
+class StartupProfile:
+  def __init__(self):
+    """
+    Durations of the app start: each phase (imports, instance creation, warm-up) is measured with phase()
+    and the report is logged as one JSON line. Create it as early as possible, e.g. as the first statement of main.py.
+    """
+    self.start_time = time.perf_counter()
+    self.phases = {}
+    self.ready_seconds = None
+    self.modules_before = set(sys.modules)
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """
+    Measure one phase of the app start (also added to the stage histogram as startup_<name>)
+
+    Args:
+        name (str): name of the phase, e.g. "imports"
+    """
+    start_time = time.perf_counter()
+    with span(f"startup_{name}"):
+      yield
+    self.phases[name] = round(time.perf_counter() - start_time, 4)
+
+  def report(self):
+    """
+    Log the startup report: duration of each phase, time until ready + the heavy libraries which are already loaded
+    (chromadb, openai, ollama, fitz, bs4 should not be in the list, they are loaded on first use)
+    """
+    # the app is ready with the first report, later reports only add the warm-up
+    if self.ready_seconds is None:
+      self.ready_seconds = round(time.perf_counter() - self.start_time, 4)
+
+    heavy = ["chromadb", "openai", "ollama", "fitz", "bs4", "onnxruntime", "httpx"]
+    report = {
+      "event": "startup",
+      "ready_seconds": self.ready_seconds,
+      "phases": self.phases,
+      "new_modules": len(set(sys.modules) - self.modules_before),
+      "heavy_modules_loaded": [name for name in heavy if name in sys.modules],
+    }
+    log.info(json.dumps(report))
+    return report
+
+def wait_until_listening(host, port, timeout = 60, interval = 0.1):
+  """
+  Wait until the server accepts connections
+
+  Args:
+      host (str): host of the server. "0.0.0.0" is checked via localhost
+      port (int): port of the server
+      timeout (float): maximum seconds to wait
+      interval (float): seconds between the connection attempts
+
+  Returns:
+      bool: True if the server is listening
+  """
+  host = "127.0.0.1" if host in ("0.0.0.0", "", None) else host
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    try:
+      with socket.create_connection((host, port), timeout=interval):
+        return True
+    except OSError:
+      time.sleep(interval)
+  return False
+
+def warm_up_in_background(*functions, host = None, port = None, profile = None):
+  """
+  Run the warm-up functions (e.g. loading the embedding model) in a background thread as soon as the server is listening,
+  so that the app is ready immediately and the first user question does not pay for the warm-up.
+
+  Args:
+      functions: functions without arguments which are called one after the other
+      host (str): host of the server. Default: CHAINLIT_HOST or 127.0.0.1
+      port (int): port of the server. Default: CHAINLIT_PORT or 8000
+      profile (StartupProfile): the warm-up is added as phase "warm_up" + the report is logged again afterwards
+  """
+  host = host or os.getenv("CHAINLIT_HOST", "127.0.0.1")
+  port = port or int(os.getenv("CHAINLIT_PORT", "8000"))
+
+  def run():
+    if not wait_until_listening(host, port):
+      log.warning(f"Server is not listening on {host}:{port}, warming up anyway")
+    try:
+      with profile.phase("warm_up") if profile is not None else contextlib.nullcontext():
+        for function in functions:
+          function()
+    except Exception as e:
+      log.error(f"Warm-up failed! Error: {e}")
+      return
+    if profile is not None:
+      profile.report()
+
+  thread = threading.Thread(target=run, name="warm-up", daemon=True)
+  thread.start()
+  return thread
@@ -2,39 +2,588 @@
 Cisco Sample Code License 1.1
 Author: flopach 2024
 """
-import chromadb
+from LexicalIndex import BM25Index, reciprocal_rank_fusion
+from AdaptiveRetrieval import AdaptiveRetrieval
+from Metrics import span, MeteredEmbeddingFunction, RETRIEVED_DISTANCE, RETRIEVED_HITS
+from TaskRunner import retry_with_backoff
+import contextlib
+import json
 import os
+import shutil
+import time
+import asyncio
+import contextvars
+import threading
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import logging
 log = logging.getLogger("applogger")
 
+class CollectionVersion:
+  def __init__(self, name, collection, lexical_index):
+    """
+    One version of the collection: chromadb collection + keyword index of the same documents
+
+    Args:
+        name (str): name of the chromadb collection
+        collection (chromadb.Collection): the collection
+        lexical_index (BM25Index): keyword index of the collection
+    """
+    self.name = name
+    self.collection = collection
+    self.lexical_index = lexical_index
+    # whether a successful import changed this version (building_version())
+    self.changed = False
+    # ids which the imports deleted from this version on purpose (e.g. stale chunks), see _validate_version()
+    self.deleted = set()
+
+class ImportSession:
+  def __init__(self):
+    """
+    One import within VectorDB.building_version(): the new version which it writes + the ids which it wrote or deleted
+    (a failed import only rolls back its own documents)
+    """
+    self.build = None
+    self.ids = set()
+    self.failed = False
+
+class IndexVersionFile:
+  def __init__(self, filepath):
+    """
+    Version stamp of a collection in a file, so that the other processes (e.g. chainlit workers with RetrievalClient)
+    notice the writes as well. The stamp is kept in memory: the file is only read again if it was replaced (inode + mtime).
+
+    Args:
+        filepath (str): path to the file, one file per collection
+    """
+    self.filepath = filepath
+    self._stat = None
+    self._value = ""
+    self._lock = threading.Lock()
+
+  def read(self):
+    """ current stamp ("" if the collection was never written) """
+    try:
+      stat = os.stat(self.filepath)
+    except FileNotFoundError:
+      return ""
+    key = (stat.st_ino, stat.st_mtime_ns)
+    if key != self._stat:
+      with self._lock:
+        with open(self.filepath, "r") as f:
+          self._value = f.read()
+        self._stat = key
+    return self._value
+
+  def bump(self):
+    """ set a new stamp (atomic replace of the file) """
+    value = str(time.time_ns())
+    with self._lock:
+      with open(self.filepath + ".tmp", "w") as f:
+        f.write(value)
+      os.replace(self.filepath + ".tmp", self.filepath)
+      stat = os.stat(self.filepath)
+      self._value, self._stat = value, (stat.st_ino, stat.st_mtime_ns)
+
+# import which is running in the current context (see VectorDB.building_version() + in_import())
+_current_import = contextvars.ContextVar("current_import", default=None)
+
 class VectorDB:
-  def __init__(self, collection_name, embeddings_function = "openai", database_path = "chromadb/"):
+  def __init__(self, collection_name, embeddings_function = "openai", database_path = "chromadb/", embedding_cache_path = "embedding_cache.sqlite3", embedding_cache_size = 50000, executor_workers = 8, hybrid_search = True, versioned = True, grace_period = 600, min_count_ratio = 0.5, snapshot = False, snapshot_dtype = "float32", adaptive_retrieval = None):
     """
     Create new VectorDB instance
 
     Args:
         collection_name (str): Name of the collectiong
-        embeddings_function (str): "openai" or "ollama"
+        embeddings_function (str): "openai", "ollama" or an instance of a chromadb embedding function
         database_path (str): persistent storage for vectorDB
+        embedding_cache_path (str): persistent storage for already calculated embeddings. None disables the cache.
+        embedding_cache_size (int): maximum number of cached embeddings
+        executor_workers (int): number of threads which run the blocking chromadb calls of the async functions
+        hybrid_search (bool): fuse the vector search results with a BM25 keyword search (exact API paths, parameters, headers)
+        versioned (bool): imports write into a new version of the collection which replaces the queried version when it is
+                          complete + validated (see building_version()). False: imports write directly into the queried collection
+        grace_period (float): seconds until a replaced version is deleted (queries which are still running can finish)
+        min_count_ratio (float): a new version needs at least this share of the documents of the current version
+                                 which the imports did not delete (e.g. a broken copy). 0 disables the check
+        snapshot (bool): answer the vector searches from a memory-mapped NumPy snapshot of the collection (exact search,
+                         see VectorSnapshot.py) instead of chromadb. The snapshot is exported again after each import,
+                         while it is outdated the searches use chromadb
+        snapshot_dtype (str): "float32" or "float16" (half the memory) for the embeddings of the snapshot
+        adaptive_retrieval (AdaptiveRetrieval): settings of the adaptive number of hits (query_db_multi(adaptive=True)). Default: AdaptiveRetrieval()
+    """
+
+    self.database_path = database_path
+    os.makedirs(database_path, exist_ok=True)
+    self.collection_name = collection_name
+    self.embedding_cache_path = embedding_cache_path
+    self.embedding_cache_size = embedding_cache_size
+    self.hybrid_search = hybrid_search
+    self.versioned = versioned
+    self.grace_period = grace_period
+    self.min_count_ratio = min_count_ratio
+    self.snapshot = snapshot
+    self.snapshot_dtype = snapshot_dtype
+    self.adaptive_retrieval = adaptive_retrieval or AdaptiveRetrieval()
+    self._embeddings_function_setting = embeddings_function
+
+    # chromadb client, embedding function, collection + keyword index are opened with the first access (see open()),
+    # so that the app is ready immediately and chromadb / the embedding model are only loaded when they are needed
+    self._chromadb_client = None
+    self._embeddings_function = None
+    self._embedding_model_function = None
+    self._ready = False
+    self._open_lock = threading.RLock()
+
+    # queried version of the collection + the version which is built by the running imports (or None)
+    self._active = None
+    self._build = None
+    # running imports (ImportSession) of building_version()
+    self._sessions = []
+    self._version_lock = threading.Lock()
+    # held while the new version is created or activated / deleted
+    self._build_lock = threading.Lock()
+
+    # version stamp of the collection (answer cache + snapshot)
+    self._index_version = IndexVersionFile(os.path.join(database_path, f"{collection_name}_index_version"))
+
+    # memory-mapped snapshot of the active version (VectorSnapshot) or None
+    self._snapshot = None
+    self._snapshot_lock = threading.Lock()
+
+    # chromadb (+ the embedding function) is blocking: the async functions run it in these threads
+    self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="vectordb")
+
+  def open(self):
+    """
+    Open the chromadb client, the embedding function, the collection + the keyword index.
+    This is done automatically with the first access. Calling it again does nothing.
+    """
+    with self._open_lock:
+      # already open or being opened by this thread (rebuild_lexical_index() below)
+      if self._active is not None:
+        return
+
+      with span("open_vectordb"):
+        import chromadb
+        import chromadb.utils.embedding_functions
+        from EmbeddingCache import CachedEmbeddingFunction
+
+        # define chromadb client
+        self._chromadb_client = chromadb.PersistentClient(path=self.database_path)
+
+        # set embeddings function
+        # different for each chosen LLM
+        embeddings_function = self._embeddings_function_setting
+        if embeddings_function == "openai":
+          embedding_model = "text-embedding-3-small"
+          embeddings_function = chromadb.utils.embedding_functions.OpenAIEmbeddingFunction(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    model_name=embedding_model
+                )
+        elif embeddings_function == "ollama":
+          embedding_model = "all-MiniLM-L6-v2"
+          embeddings_function =  chromadb.utils.embedding_functions.DefaultEmbeddingFunction()
+        else:
+          # any other chromadb embedding function instance, e.g. a stand-in for benchmarks
+          embedding_model = getattr(embeddings_function, "model_name", type(embeddings_function).__name__)
+
+        # count the texts, tokens + cost of all embedding requests
+        self._embedding_model_function = MeteredEmbeddingFunction(embeddings_function, embedding_model)
+        self._embeddings_function = self._embedding_model_function
+
+        # put the persistent embedding cache in front of the embedding function
+        # re-imports and repeated user queries are then not embedded again
+        if self.embedding_cache_path is not None:
+          self._embeddings_function = CachedEmbeddingFunction(
+            self._embeddings_function,
+            model_name=embedding_model,
+            cache_path=self.embedding_cache_path,
+            max_entries=self.embedding_cache_size
+          )
+
+        # set collection: the active version of the alias file
+        alias = self._read_alias()
+        if "building" in alias:
+          # the process stopped while a new version was built: it is deleted by the garbage collection
+          alias["retired"][alias.pop("building")] = 0
+          self._write_alias(alias)
+        self._active = self._open_version(alias["active"])
+
+        if len(self._active.lexical_index) == 0 and self._active.collection.count() > 0:
+          self.rebuild_lexical_index()
+
+      self._ready = True
+      if alias["retired"]:
+        self.collect_garbage()
+      self._refresh_snapshot_safely()
+
+  def warm_up(self):
+    """
+    Open the vectorDB + load the embedding model (e.g. the ONNX model of the default embedding function) with one embedding.
+    The embedding cache is bypassed, otherwise a cached text would not load the model.
+    """
+    self.open()
+    with span("warm_up_embedding"):
+      self._embedding_model_function(["warm-up"])
+
+  @property
+  def chromadb_client(self):
+    if not self._ready:
+      self.open()
+    return self._chromadb_client
+
+  @property
+  def embeddings_function(self):
+    if not self._ready:
+      self.open()
+    return self._embeddings_function
+
+  @property
+  def collection(self):
+    """ queried (active) version of the collection """
+    return self.active_version.collection
+
+  @property
+  def lexical_index(self):
+    """ keyword index of the queried (active) version of the collection """
+    return self.active_version.lexical_index
+
+  @property
+  def active_version(self):
+    """ queried version of the collection (CollectionVersion) """
+    if not self._ready:
+      self.open()
+    return self._active
+
+  @property
+  def write_version(self):
+    """ name of the version which is written: the version which is built by the running imports or the active version """
+    if not self._ready:
+      self.open()
+    return (self._build or self._active).name
+
+  def version_file(self, suffix, version = None):
+    """
+    Path of a file which belongs to one version of the collection, e.g. its keyword index
+
+    Args:
+        suffix (str): name of the file, e.g. "lexical_index.json"
+        version (str): name of the version. Default: write_version
+    """
+    return os.path.join(self.database_path, f"{version or self.write_version}_{suffix}")
+
+  # ======================
+  # Versions of the collection (blue/green imports)
+  # ======================
+
+  # files of a version which are copied into a new version (the import manifest is written by DataHandler)
+  VERSION_FILES = ["lexical_index.json", "import_manifest.json"]
+
+  @contextlib.contextmanager
+  def building_version(self):
+    """
+    Context manager around an import: all writes go into a new version of the collection, a copy of the active version.
+    The copy is created with the first write (or delete): an import without changes does not copy anything.
+    Queries keep using the active version. Imports which run at the same time write into the same new version.
+    When the last of them is finished, the new version is validated (document count + smoke query) and replaces
+    the active version. A failed import only rolls back its own documents in the new version, the changes of the other
+    imports are kept. If the validation fails, the new version is deleted. Replaced versions are deleted after the grace period.
+
+    Yields:
+        ImportSession: the running import
+    """
+    session = ImportSession()
+    if not self.versioned:
+      try:
+        yield session
+      finally:
+        self._import_finished()
+      return
+
+    self.open()
+    self.collect_garbage()
+    with self._version_lock:
+      self._sessions.append(session)
+
+    try:
+      with self.in_import(session):
+        yield session
+    except BaseException:
+      session.failed = True
+      raise
+    finally:
+      self._finish_import(session)
+
+  @contextlib.contextmanager
+  def in_import(self, session):
+    """
+    Context manager: the writes within it belong to the import (e.g. the writes of the retrieval server for a client's import)
+
+    Args:
+        session (ImportSession): the import of building_version()
     """
+    token = _current_import.set(session)
+    try:
+      yield session
+    finally:
+      _current_import.reset(token)
 
-    # define chromadb client
-    self.chromadb_client = chromadb.PersistentClient(path=database_path)
+  def _finish_import(self, session):
+    """ roll back a failed import, then (last running import) activate or delete the new version """
+    build = session.build
+    if build is not None and session.ids:
+      if session.failed:
+        self._rollback(build, session)
+      else:
+        build.changed = True
 
-    # set embeddings function
-    # different for each chosen LLM
-    if embeddings_function == "openai":
-      self.embeddings_function = chromadb.utils.embedding_functions.OpenAIEmbeddingFunction(
-                api_key=os.getenv('OPENAI_API_KEY'),
-                model_name="text-embedding-3-small"
-            )
-    elif embeddings_function == "ollama":
-      self.embeddings_function =  chromadb.utils.embedding_functions.DefaultEmbeddingFunction()
-    
-    # set collection
-    self.collection = self.chromadb_client.get_or_create_collection(name=collection_name,embedding_function=self.embeddings_function)
+    with self._build_lock:
+      with self._version_lock:
+        self._sessions.remove(session)
+        last = not self._sessions
+        build = self._build if last else None
 
-  def query_db(self, query_string, n_results, where_clause=None):
+      if build is not None:
+        try:
+          if build.changed:
+            self._switch_version(build)
+          else:
+            # nothing was imported (or only by failed imports): the query results (+ cached answers) stay valid
+            self._discard_version(build)
+        finally:
+          # new imports create their version from the (new) active version
+          self._build = None
+
+    if last:
+      self._import_finished()
+
+  def _rollback(self, build, session, batch_size = 128):
+    """
+    Restore the documents which a failed import wrote or deleted in the new version to the active version
+
+    Args:
+        build (CollectionVersion): the new version
+        session (ImportSession): the failed import
+        batch_size (int): number of documents which are restored at once
+    """
+    ids = sorted(session.ids)
+    with span("rollback_import", version=build.name, documents=len(ids)):
+      for offset in range(0, len(ids), batch_size):
+        batch_ids = ids[offset:offset + batch_size]
+        results = self._active.collection.get(ids=batch_ids, include=["embeddings", "documents", "metadatas"])
+        removed = [id for id in batch_ids if id not in set(results["ids"])]
+        if removed:
+          build.collection.delete(ids=removed)
+          build.lexical_index.delete(removed)
+        if results["ids"]:
+          build.collection.upsert(ids=results["ids"], embeddings=results["embeddings"], documents=results["documents"], metadatas=results["metadatas"])
+          build.lexical_index.upsert(results["ids"], results["documents"], results["metadatas"])
+      build.deleted.difference_update(ids)
+      build.lexical_index.save()
+    log.error(f"Import failed: its {len(ids)} documents in the new version {build.name} are rolled back, the other imports are kept")
+
+  def _create_version(self, batch_size = 128):
+    """
+    Create a new version of the collection as copy of the active version (documents, embeddings, keyword index, files)
+
+    Args:
+        batch_size (int): number of documents which are copied at once
+    """
+    active = self._active
+    with self._version_lock:
+      alias = self._read_alias()
+      name = f"{self.collection_name}_v{alias['next']}"
+      alias["next"] += 1
+      alias["building"] = name
+      self._write_alias(alias)
+
+    with span("copy_version", version=name) as attributes:
+      active.lexical_index.save()
+      for suffix in self.VERSION_FILES:
+        if os.path.exists(self.version_file(suffix, active.name)):
+          shutil.copyfile(self.version_file(suffix, active.name), self.version_file(suffix, name))
+      build = self._open_version(name)
+
+      try:
+        # the embeddings are copied: nothing is embedded again
+        count = active.collection.count()
+        # small batches: chromadb blocks the queries during each write
+        for offset in range(0, count, batch_size):
+          results = active.collection.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+          if results["ids"]:
+            build.collection.add(ids=results["ids"], embeddings=results["embeddings"], documents=results["documents"], metadatas=results["metadatas"])
+      except BaseException:
+        self._discard_version(build)
+        raise
+      attributes["documents"] = count
+
+    log.info(f"Building the new version {name} of the collection (copy of {active.name}, {count} documents)")
+    return build
+
+  def _switch_version(self, build):
+    """ validate the new version + make it the active version (atomic replace of the alias file) """
+    with span("switch_version", version=build.name):
+      build.lexical_index.save()
+      try:
+        self._validate_version(build)
+      except ValueError as e:
+        self._discard_version(build)
+        log.error(f"The new version {build.name} is invalid: {e}. It is deleted, {self._active.name} is still used")
+        raise
+
+      with self._version_lock:
+        alias = self._read_alias()
+        alias["retired"][self._active.name] = time.time()
+        alias["active"] = build.name
+        alias.pop("building", None)
+        self._write_alias(alias)
+        self._active = build
+      self._bump_index_version()
+
+    log.info(f"Switched to the new version {build.name} of the collection ({build.collection.count()} documents)")
+    self.collect_garbage()
+
+  def _validate_version(self, version, batch_size = 1000):
+    """
+    raise ValueError if the version has too few documents, its keyword index is incomplete or the smoke query fails.
+    The documents which the imports deleted on purpose (e.g. a source which shrunk) are not expected in the new version.
+    """
+    count = version.collection.count()
+    previous_count = self._active.collection.count()
+    deleted = sorted(version.deleted)
+    for offset in range(0, len(deleted), batch_size):
+      previous_count -= len(self._active.collection.get(ids=deleted[offset:offset + batch_size], include=[])["ids"])
+    if count == 0 or count < previous_count * self.min_count_ratio:
+      raise ValueError(f"{count} documents, {previous_count} documents of the active version were not deleted by the imports")
+    if len(version.lexical_index) != count:
+      raise ValueError(f"keyword index has {len(version.lexical_index)} documents, the collection has {count} documents")
+
+    # smoke query with the embedding of a stored document: the vector index needs to return results
+    # (the document itself is not required: the search is approximate, near duplicates can be ranked first)
+    sample = version.collection.get(limit=1, include=["embeddings"])
+    results = version.collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=min(10, count), include=[])
+    if not results["ids"][0]:
+      raise ValueError("smoke query returned no results")
+    if sample["ids"][0] not in results["ids"][0]:
+      log.warning(f"Smoke query of the new version {version.name}: {sample['ids'][0]} is not within the top results")
+
+  def collect_garbage(self, grace_period = None):
+    """
+    Delete the replaced versions of the collection after the grace period
+
+    Args:
+        grace_period (float): seconds since the version was replaced. Default: grace period of this instance
+    """
+    grace_period = self.grace_period if grace_period is None else grace_period
+    with self._version_lock:
+      alias = self._read_alias()
+      building = {alias.get("building"), self._build.name if self._build is not None else None}
+      for name, retired in list(alias["retired"].items()):
+        if time.time() - retired >= grace_period and name != alias["active"] and name not in building:
+          self._drop_version(name)
+          del alias["retired"][name]
+      self._write_alias(alias)
+
+  def _discard_version(self, build):
+    """ delete a new version which is not used """
+    with self._version_lock:
+      alias = self._read_alias()
+      alias.pop("building", None)
+      self._write_alias(alias)
+    self._drop_version(build.name)
+
+  def _drop_version(self, name):
+    """ delete the collection + the files of a version """
+    try:
+      self.chromadb_client.delete_collection(name)
+    except ValueError:
+      # does not exist (anymore)
+      pass
+    for suffix in self.VERSION_FILES:
+      if os.path.exists(self.version_file(suffix, name)):
+        os.remove(self.version_file(suffix, name))
+    self._remove_snapshots(name)
+    log.info(f"Deleted the version {name} of the collection")
+
+  def _open_version(self, name):
+    """ open the collection + keyword index of a version """
+    collection = self._chromadb_client.get_or_create_collection(name=name,embedding_function=self._embeddings_function)
+    return CollectionVersion(name, collection, BM25Index(self.version_file("lexical_index.json", name)))
+
+  def _read_alias(self):
+    """ alias file: active version, next version number + replaced versions. Without file: the unversioned collection """
+    try:
+      with open(os.path.join(self.database_path, f"{self.collection_name}_versions.json"), "r") as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return {"active": self.collection_name, "next": 1, "retired": {}}
+
+  def _write_alias(self, alias):
+    """ atomic replace of the alias file """
+    filepath = os.path.join(self.database_path, f"{self.collection_name}_versions.json")
+    with open(filepath + ".tmp", "w") as f:
+      json.dump(alias, f)
+    os.replace(filepath + ".tmp", filepath)
+
+  # ======================
+  # Memory-mapped snapshot (read path)
+  # ======================
+
+  def refresh_snapshot(self):
+    """
+    Export the active version of the collection into a memory-mapped snapshot (or load the snapshot of the same
+    index version, e.g. after a restart) + delete the older snapshots. This is done automatically after each import.
+
+    Returns:
+        VectorSnapshot: the current snapshot
+    """
+    from VectorSnapshot import VectorSnapshot
+    with self._snapshot_lock:
+      version = self.active_version
+      stamp = self.index_version or "0"
+      if self._snapshot is not None and (self._snapshot.version, self._snapshot.stamp) == (version.name, stamp):
+        return self._snapshot
+
+      directory = self.version_file(f"snapshot_{stamp}", version.name)
+      with span("export_snapshot", version=version.name) as attributes:
+        if os.path.exists(directory):
+          self._snapshot = VectorSnapshot(directory)
+        else:
+          self._snapshot = VectorSnapshot.export(version.collection, directory, version.name, stamp, dtype=self.snapshot_dtype)
+        attributes["documents"] = len(self._snapshot)
+      self._remove_snapshots(version.name, keep=directory)
+      return self._snapshot
+
+  def _current_snapshot(self, version):
+    """ the snapshot if it is up to date with the version of the collection, otherwise None (search with chromadb) """
+    snapshot = self._snapshot
+    if self.snapshot and snapshot is not None and snapshot.version == version.name and snapshot.stamp == (self.index_version or "0"):
+      return snapshot
+    return None
+
+  def _remove_snapshots(self, version, keep = None):
+    """ delete the snapshot folders of a version (open memory maps stay valid until they are closed) """
+    for entry in os.listdir(self.database_path):
+      directory = os.path.join(self.database_path, entry)
+      if entry.startswith(f"{version}_snapshot_") and directory != keep:
+        shutil.rmtree(directory, ignore_errors=True)
+
+  def _import_finished(self):
+    """ called when an import is finished: export the snapshot of the (new) active version """
+    self._refresh_snapshot_safely()
+
+  def _refresh_snapshot_safely(self):
+    """ refresh_snapshot() if the snapshot is enabled. If the export fails, the searches use chromadb """
+    if not self.snapshot:
+      return
+    try:
+      self.refresh_snapshot()
+    except Exception as e:
+      log.error(f"Export of the snapshot failed, the searches use chromadb! Error: {e}")
+
+  def query_db(self, query_string, n_results, where_clause=None, query_embedding=None):
     """
     Query the vector DB
 
@@ -45,6 +594,7 @@ class VectorDB:
                             default --> None
                             apidocs --> {"doc_type": "apidocs"}
                             apispecs --> {"doc_type": "apispecs"}
+        query_embedding (list): embedding of the query string, if it is already known (e.g. embedded in a batch by the retrieval server)
     """
 
     # define vectorDB search
@@ -55,18 +605,262 @@ class VectorDB:
     elif where_clause == "apispecs":
       where_clause = {"doc_type": "apispecs"}
 
-    results = self.collection.query(
-      query_texts=[query_string],
-      n_results=n_results,
-      where=where_clause
-    )
+    if query_embedding is None:
+      results = self.collection.query(
+        query_texts=[query_string],
+        n_results=n_results,
+        where=where_clause
+      )
+    else:
+      results = self.collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        where=where_clause
+      )
 
     # Display queried documents
     log.debug(f'Queried documents: {results["metadatas"]}')
     log.debug(f'Queried distances: {results["distances"]}')
 
     return results["documents"]
-  
+
+  def embed_query(self, query_string):
+    """
+    Return the embedding of the query string
+
+    Args:
+        query_string (str): specific query string
+    """
+    with span("embed_query"):
+      return self.embeddings_function([query_string])[0]
+
+  async def embed_query_async(self, query_string):
+    """
+    Same as embed_query(), but it does not block the event loop
+
+    Args:
+        query_string (str): specific query string
+    """
+    return await self._run_in_executor(self.embed_query, query_string)
+
+  @property
+  def index_version(self):
+    """
+    Version stamp of the collection. It changes with every write to the collection (also by other processes).
+    """
+    return self._index_version.read()
+
+  def _bump_index_version(self):
+    """ set a new version stamp after the collection was changed """
+    self._index_version.bump()
+
+  def query_db_multi(self, query_string, n_results_by_filter, query_embedding=None, adaptive=False):
+    """
+    Query the vector DB with several WHERE clauses at once.
+    The query string is only embedded once and the searches for all WHERE clauses run in parallel.
+
+    Args:
+        query_string (str): specific query string
+        n_results_by_filter (dict): WHERE clause (None, "apidocs", "apispecs") --> n_results,
+                                    e.g. {"apidocs": 10, "apispecs": 20}
+        query_embedding (list): embedding of the query string, if it is already known
+        adaptive (bool): n_results are maximum numbers: the number of hits depends on the distances + the hits are diversified
+                         (see AdaptiveRetrieval.py)
+
+    Returns:
+        dict: WHERE clause --> list of hits, best first. Each hit is a dict with id, document, metadata and distance
+              (+ the fused score with hybrid search, the distance of pure keyword hits is None)
+    """
+    if query_embedding is None:
+      query_embedding = self.embed_query(query_string)
+    query_embeddings = [query_embedding]
+
+    # every search runs in a copy of the current context (request trace)
+    where_clauses = list(n_results_by_filter)
+    results = self.executor.map(
+      lambda where_clause, context: context.run(self._query_by_embeddings, query_embeddings, n_results_by_filter[where_clause], where_clause, query_string, adaptive),
+      where_clauses,
+      [contextvars.copy_context() for _ in where_clauses]
+    )
+    return dict(zip(where_clauses, results))
+
+  async def query_db_multi_async(self, query_string, n_results_by_filter, query_embedding=None, adaptive=False):
+    """
+    Same as query_db_multi(), but it does not block the event loop
+
+    Args:
+        query_string (str): specific query string
+        n_results_by_filter (dict): WHERE clause (None, "apidocs", "apispecs") --> n_results
+        query_embedding (list): embedding of the query string, if it is already known
+        adaptive (bool): adaptive number of hits, see query_db_multi()
+    """
+    if query_embedding is None:
+      query_embedding = await self.embed_query_async(query_string)
+    query_embeddings = [query_embedding]
+
+    where_clauses = list(n_results_by_filter)
+    results = await asyncio.gather(*(
+      self._run_in_executor(self._query_by_embeddings, query_embeddings, n_results_by_filter[where_clause], where_clause, query_string, adaptive)
+      for where_clause in where_clauses
+    ))
+    return dict(zip(where_clauses, results))
+
+  def query_db_batch(self, query_strings, n_results, where_clause=None):
+    """
+    Query the vector DB with many query strings at once: one embedding call + one search for all of them
+    (with the snapshot: one matrix product)
+
+    Args:
+        query_strings (list): list of query strings
+        n_results (int): number of documents per query string
+        where_clause (str): None, "apidocs" or "apispecs"
+
+    Returns:
+        list: per query string a list of hits, best first (see query_db_multi())
+    """
+    with span("embed_query", queries=len(query_strings)):
+      query_embeddings = self.embeddings_function(list(query_strings))
+
+    with span("query_db_batch", where=where_clause, n_results=n_results, queries=len(query_strings)):
+      results = self._search(query_embeddings, n_results, where_clause, query_strings)
+
+    for hits in results:
+      for hit in hits:
+        if hit["distance"] is not None:
+          RETRIEVED_DISTANCE.observe(hit["distance"], doc_type=where_clause or "all")
+    return results
+
+  def _query_by_embeddings(self, query_embeddings, n_results, where_clause=None, query_string=None, adaptive=False):
+    """
+    Query the vector DB with an already embedded query string.
+    With hybrid search (+ query string), the vector hits and the BM25 keyword hits are fused with reciprocal rank fusion.
+
+    Args:
+        query_embeddings (list): embedding of the query string (list with one embedding)
+        n_results (int): number of documents to return
+        where_clause (str): None, "apidocs" or "apispecs"
+        query_string (str): query string for the keyword search
+        adaptive (bool): over-fetch once + select at most n_results hits with AdaptiveRetrieval
+
+    Returns:
+        list: hits, best first. Each hit is a dict with id, document, metadata and distance
+    """
+    with span("query_db", where=where_clause, n_results=n_results) as attributes:
+      query_strings = None if query_string is None else [query_string]
+      if adaptive:
+        hits = self._search(query_embeddings, self.adaptive_retrieval.fetch_size(n_results), where_clause, query_strings, include_embeddings=True)[0]
+        attributes["fetched"] = len(hits)
+        hits = self.adaptive_retrieval.select(hits, query_embeddings[0], n_results)
+      else:
+        hits = self._search(query_embeddings, n_results, where_clause, query_strings)[0]
+      attributes["ids"] = [hit["id"] for hit in hits]
+      attributes["distances"] = [hit["distance"] for hit in hits]
+
+    for hit in hits:
+      if hit["distance"] is not None:
+        RETRIEVED_DISTANCE.observe(hit["distance"], doc_type=where_clause or "all")
+    RETRIEVED_HITS.observe(len(hits), doc_type=where_clause or "all")
+
+    return hits
+
+  def _search(self, query_embeddings, n_results, where_clause, query_strings, include_embeddings=False):
+    """
+    Vector search (+ keyword search and fusion) for one or many query embeddings, see _query_by_embeddings()
+    With include_embeddings, each hit also has the embedding of its document (for AdaptiveRetrieval).
+
+    Returns:
+        list: per query embedding a list of hits, best first
+    """
+    # the same version for all steps, also if the active version is replaced meanwhile
+    version = self.active_version
+    snapshot = self._current_snapshot(version)
+    if snapshot is not None:
+      results = [
+        [snapshot.hit(row, distance, include_embeddings) for row, distance in rows]
+        for rows in snapshot.search(query_embeddings, n_results, where_clause)
+      ]
+    else:
+      results = version.collection.query(
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        where=None if where_clause is None else {"doc_type": where_clause},
+        include=["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+      )
+
+      # Display queried documents
+      log.debug(f'Queried documents: {results["metadatas"]}')
+      log.debug(f'Queried distances: {results["distances"]}')
+
+      results = [
+        [{"id": id, "document": document, "metadata": metadata, "distance": distance} for id, document, metadata, distance in zip(*columns)]
+        for columns in zip(results["ids"], results["documents"], results["metadatas"], results["distances"])
+      ] if not include_embeddings else [
+        [{"id": id, "document": document, "metadata": metadata, "distance": distance, "embedding": embedding} for id, document, metadata, distance, embedding in zip(*columns)]
+        for columns in zip(results["ids"], results["documents"], results["metadatas"], results["distances"], results["embeddings"])
+      ]
+
+    if not self.hybrid_search or query_strings is None:
+      return results
+
+    return [self._fuse(version, snapshot, hits, query_string, n_results, where_clause, include_embeddings) for hits, query_string in zip(results, query_strings)]
+
+  def _fuse(self, version, snapshot, hits, query_string, n_results, where_clause, include_embeddings=False):
+    """ fuse the vector hits with the BM25 keyword hits of the same version (reciprocal rank fusion) """
+    keyword_ids = [id for id, _ in version.lexical_index.search(query_string, n_results, where_clause)]
+    fused = reciprocal_rank_fusion([[hit["id"] for hit in hits], keyword_ids])[:n_results]
+    log.debug(f"Keyword hits: {keyword_ids}")
+
+    # the documents of pure keyword hits are not part of the vector search results
+    hits_by_id = {hit["id"]: hit for hit in hits}
+    missing_ids = [id for id, _ in fused if id not in hits_by_id]
+    if snapshot is not None:
+      for id in missing_ids:
+        if id in snapshot.rows:
+          hits_by_id[id] = snapshot.hit(snapshot.rows[id], include_embedding=include_embeddings)
+    elif missing_ids:
+      results = version.collection.get(ids=missing_ids, include=["documents", "metadatas"] + (["embeddings"] if include_embeddings else []))
+      for i, (id, document, metadata) in enumerate(zip(results["ids"], results["documents"], results["metadatas"])):
+        hits_by_id[id] = {"id": id, "document": document, "metadata": metadata, "distance": None}
+        if include_embeddings:
+          hits_by_id[id]["embedding"] = results["embeddings"][i]
+
+    return [dict(hits_by_id[id], score=score) for id, score in fused if id in hits_by_id]
+
+  def rebuild_lexical_index(self, batch_size = 5000):
+    """
+    Build the keyword index from all documents of the collection (e.g. for a collection which was imported before the index existed)
+
+    Args:
+        batch_size (int): number of documents which are read from the collection at once
+    """
+    count = self.collection.count()
+    for offset in range(0, count, batch_size):
+      results = self.collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+      self.lexical_index.upsert(results["ids"], results["documents"], results["metadatas"])
+    self.lexical_index.save()
+    log.info(f"Built the keyword index of {count} documents")
+
+  def collection_doc_types(self, batch_size = 5000):
+    """
+    doc_type of every document of the version which is written (e.g. to find the documents of an import without manifest)
+
+    Args:
+        batch_size (int): number of documents which are read from the collection at once
+
+    Returns:
+        dict: id --> doc_type (None for documents without doc_type)
+    """
+    if not self._ready:
+      self.open()
+    session = _current_import.get()
+    # an import which has not written yet reads the version which its first write copies
+    version = (session.build if session is not None else None) or self._build or self._active
+    doc_types = {}
+    for offset in range(0, version.collection.count(), batch_size):
+      results = version.collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+      doc_types.update((id, (metadata or {}).get("doc_type")) for id, metadata in zip(results["ids"], results["metadatas"]))
+    return doc_types
+
   def collection_add(self,documents,ids,metadatas=None):
     """
     Add to collection
@@ -76,10 +870,203 @@ class VectorDB:
         ids (dict): list of IDs
         metadatas (dict): list of metadata
     """
-    r = self.collection.add(
+    target = self._write_target()
+    self._add_batch(documents,ids,metadatas,target=target)
+    target.lexical_index.save()
+
+  def collection_upsert(self,documents,ids,metadatas=None):
+    """
+    Add to collection or update existing entries with the same IDs
+
+    Args:
+        documents (dict): list of chunked documents
+        ids (dict): list of IDs
+        metadatas (dict): list of metadata
+    """
+    target = self._write_target()
+    self._upsert_batch(documents,ids,metadatas,target=target)
+    target.lexical_index.save()
+
+  def _write_target(self):
+    """
+    Version which is written: within an import the new version (created with the first write of the running imports),
+    otherwise the version which is built by the running imports or the active version
+    """
+    if not self._ready:
+      self.open()
+    session = _current_import.get()
+    if session is None or not self.versioned:
+      return self._build or self._active
+    if session.build is None:
+      with self._build_lock:
+        if self._build is None:
+          self._build = self._create_version()
+        session.build = self._build
+    return session.build
+
+  def _written(self, target, ids, deleted = False):
+    """
+    A write into the active version changes the query results (a new version changes them when it is activated).
+    The ids which an import writes into the new version are kept for its rollback.
+    """
+    if target is self._active:
+      self._bump_index_version()
+      return
+    if deleted:
+      target.deleted.update(ids)
+    else:
+      target.deleted.difference_update(ids)
+    session = _current_import.get()
+    if session is not None and session.build is target:
+      session.ids.update(ids)
+    else:
+      target.changed = True
+
+  def _add_batch(self,documents,ids,metadatas=None,target=None):
+    """ add to the collection + keyword index, the keyword index is not saved """
+    target = target or self._write_target()
+    r = target.collection.add(
       documents=documents,
       ids=ids,
       metadatas=metadatas,
     )
+    target.lexical_index.upsert(ids,documents,metadatas)
+    self._written(target, ids)
     if r != None:
-      log.warning(f"{ids} returned NOT None...")
\ No newline at end of file
+      log.warning(f"{ids} returned NOT None...")
+
+  def _upsert_batch(self,documents,ids,metadatas=None,target=None):
+    """ upsert into the collection + keyword index, the keyword index is not saved """
+    target = target or self._write_target()
+    target.collection.upsert(
+      documents=documents,
+      ids=ids,
+      metadatas=metadatas,
+    )
+    target.lexical_index.upsert(ids,documents,metadatas)
+    self._written(target, ids)
+
+  def collection_delete(self,ids):
+    """
+    Delete entries from the collection
+
+    Args:
+        ids (list): list of IDs
+    """
+    if ids:
+      target = self._write_target()
+      target.collection.delete(ids=ids)
+      target.lexical_index.delete(ids)
+      target.lexical_index.save()
+      self._written(target, ids, deleted=True)
+      log.info(f"Deleted {len(ids)} documents from the collection")
+
+  def collection_add_bulk(self,records,batch_size=128):
+    """
+    Add a stream of records to the collection in batches.
+    Each batch results in one embedding call and one collection write.
+
+    Args:
+        records (iterable): iterable of (document, id, metadata) tuples
+        batch_size (int): number of records per embedding call + collection write
+
+    Returns:
+        int: number of records added
+    """
+    return self._write_bulk(self._add_batch,records,batch_size)
+
+  def collection_upsert_bulk(self,records,batch_size=128):
+    """
+    Same as collection_add_bulk() but existing entries with the same IDs are updated
+
+    Args:
+        records (iterable): iterable of (document, id, metadata) tuples
+        batch_size (int): number of records per embedding call + collection write
+
+    Returns:
+        int: number of records upserted
+    """
+    return self._write_bulk(self._upsert_batch,records,batch_size)
+
+  def _write_bulk(self,write_function,records,batch_size):
+    """
+    Split the stream of records into batches and write each batch with write_function.
+    The keyword index is saved once at the end (also if a batch fails).
+
+    Args:
+        write_function (function): _add_batch or _upsert_batch
+        records (iterable): iterable of (document, id, metadata) tuples
+        batch_size (int): number of records per write
+    """
+    total = 0
+    records = iter(records)
+    target = None
+
+    try:
+      while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+          break
+        # resolved with the first batch: an import without changed records does not create a new version
+        target = target or self._write_target()
+
+        documents, ids, metadatas = (list(x) for x in zip(*batch))
+
+        # chromadb does not accept None entries within the metadata list
+        if all(m is None for m in metadatas):
+          metadatas = None
+
+        # a failing batch (e.g. embedding API error) is retried, the batches before are already saved
+        with span("collection_write", documents=len(batch)):
+          retry_with_backoff(
+            write_function,
+            documents=documents,
+            ids=ids,
+            metadatas=metadatas,
+            target=target
+          )
+
+        total += len(batch)
+        log.debug(f"Wrote batch of {len(batch)} documents ({total} in total)")
+    finally:
+      if target is not None:
+        target.lexical_index.save()
+
+    return total
+
+  async def query_db_async(self, query_string, n_results, where_clause=None):
+    """
+    Same as query_db(), but it does not block the event loop
+
+    Args:
+        query_string (str): specific query string
+        n_results
+        where_clause (str): None, "apidocs" or "apispecs"
+    """
+    return await self._run_in_executor(self.query_db, query_string, n_results, where_clause)
+
+  async def collection_add_bulk_async(self,records,batch_size=128):
+    """
+    Same as collection_add_bulk(), but it does not block the event loop
+
+    Args:
+        records (iterable): iterable of (document, id, metadata) tuples
+        batch_size (int): number of records per embedding call + collection write
+    """
+    return await self._run_in_executor(self.collection_add_bulk, records, batch_size)
+
+  async def collection_upsert_bulk_async(self,records,batch_size=128):
+    """
+    Same as collection_upsert_bulk(), but it does not block the event loop
+
+    Args:
+        records (iterable): iterable of (document, id, metadata) tuples
+        batch_size (int): number of records per embedding call + collection write
+    """
+    return await self._run_in_executor(self.collection_upsert_bulk, records, batch_size)
+
+  async def _run_in_executor(self, function, *args):
+    """ run a blocking function in the executor of this VectorDB instance (in a copy of the current context, e.g. the request trace) """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(self.executor, functools.partial(context.run, function, *args))
@@ -2,95 +2,182 @@
 Cisco Sample Code License 1.1
 Author: flopach 2024
 """
-from openai import OpenAI
+import json
+import os
 import time
+from LLMBackend import LLMBackend
+from Metrics import span, record_llm_usage
 import logging
 log = logging.getLogger("applogger")
 
-class LLMOpenAI:
-  def __init__(self, database, model = "gpt-3.5-turbo"):
-    self.client = OpenAI()
-    self.database = database
-    self.model = model
-
-  def extend_api_description(self,query_string,path,operation,parameters):
-    """
-    Extend the description for each API REST Call operation
-
-    Args:
-        query_string (str): details of the REST API call
-        path (str): REST API path
-        operation (str): REST API operation (GET, POST, etc.) 
-        parameters (str): Query parameters
-    """
-
-    # query vector DB for local data
-    context_query = self.database.query_db(query_string,10)
-
-    # create promt message with local context data
-    message = f'Query path: "{path}"\nREST operation: {operation}\nshort description: {query_string}\n{parameters}\nUse this context delimited with XML tags:\n<context>\n{context_query}\n</context>'
-    log.debug(f"=== Extending the description with: ===\n {message}")
-
-    # ask GPT
+class LLMOpenAI(LLMBackend):
+  default_model = "gpt-3.5-turbo"
+  embeddings_function = "openai"
+  extend_n_results = 10
+  supports_batch = True
+
+  def _create_client(self):
+    """ OpenAI client with a connection pool of max_connections (the openai library is loaded with the first request) """
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+    return OpenAI(timeout=self.timeout, http_client=DefaultHttpxClient(limits=limits))
+
+  def _create_async_client(self):
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+    return AsyncOpenAI(timeout=self.timeout, http_client=DefaultAsyncHttpxClient(limits=limits))
+
+  def _complete(self, messages):
     completion = self.client.chat.completions.create(
       model=self.model,
       temperature=0.8,
-      messages=[
-        {"role": "system", "content": "You are provided information of a specific REST API query path of the Cisco Catalyst Center. Describe what this query is for in detail. Describe how this query can be used from a user perspective."},
-        {"role": "user", "content": message}
-      ]
+      messages=messages
     )
+    return completion.choices[0].message.content, self._usage(completion)
 
-    return completion.choices[0].message.content
-
-  def ask_llm(self,query_string,n_results_apidocs=10,n_results_apispecs=20):
-    """
-    Ask the LLM with the query string.
-    Search for context in vectorDB
-
-    Args:
-        query_string (str): details of the REST API call
-        n_results_apidocs (int): Number of documents return by vectorDB query for API docs on developer.cisco.com
-        n_results_apispecs (int): Number of documents return by vectorDB query for extended API specification document
-    """
-    # Record the start time
-    start_time = time.time()
-
-    # context queries to vectorDB
-    context_query_apidocs = self.database.query_db(query_string,n_results_apidocs,"apidocs")
-    context_query_apispecs = self.database.query_db(query_string,n_results_apispecs,"apispecs")
-    context = f'''Context information delimited with XML tags:\n<context>\n{context_query_apidocs}\n</context>
-                  API specification context delimited with XML tags:\n<api-context>\n{context_query_apispecs}\n</api-context>'''
-
-    question = f"\n\nUser question: '{query_string}'"
-
-    message = context + question
-
-    log.debug(message)
+  async def _complete_async(self, messages):
+    completion = await self.async_client.chat.completions.create(
+      model=self.model,
+      temperature=0.8,
+      messages=messages
+    )
+    return completion.choices[0].message.content, self._usage(completion)
 
-    completion = self.client.chat.completions.create(
+  def _stream(self, messages):
+    stream = self.client.chat.completions.create(
       model=self.model,
       temperature=0.8,
-      messages=[
-        { "role": "system",
-        "content": """You are the Cisco Catalyst Center REST API and Python code assistant. You provide documentation and Python code for developers.
-         Always list all available query parameters from the provided context. Include the REST operation and query path.
-         1. you create documentation to the specific API calls. 
-         2. you create an example source code in the programming language Python using the 'requests' library.
-         Tell the user if you do not know the answer. If loops or advanced code is needed, provide it.
-         ###
-         Every API query needs to include the header parameter 'X-Auth-Token' for authentication and authorization. This is where the access token is defined.
-         If the user does not have the access token, the user needs to call the REST API query '/dna/system/api/v1/auth/token' to receive the access token. Only the API query '/dna/system/api/v1/auth/token' is using the Basic authentication scheme, as defined in RFC 7617. All other API queries need to have the header parameter 'X-Auth-Token' defined.
-         ###
-        """
-        },
-        {"role": "user", "content": message}
-      ]
+      messages=messages,
+      stream=True
     )
+    for chunk in stream:
+      if not chunk.choices:
+        continue
+      token = chunk.choices[0].delta.content
+      if token:
+        yield token
+
+  async def _stream_async(self, messages):
+    stream = await self.async_client.chat.completions.create(
+      model=self.model,
+      temperature=0.8,
+      messages=messages,
+      stream=True
+    )
+    async for chunk in stream:
+      if not chunk.choices:
+        continue
+      token = chunk.choices[0].delta.content
+      if token:
+        yield token
+
+  def _usage(self,completion):
+    """ (prompt tokens, completion tokens) reported by the API or None """
+    usage = getattr(completion, "usage", None)
+    return (usage.prompt_tokens, usage.completion_tokens) if usage else None
+
+  # ======================
+  # OpenAI Batch API
+  # ======================
+
+  def extend_api_descriptions_batch(self, requests, jsonl_path, poll_interval = 30):
+    """
+    Extend the descriptions of many REST operations with one job of the OpenAI Batch API (lower price, no rate limits).
+    The requests are written into a local JSON lines file which is uploaded. The ID of the batch job is saved next to it
+    (with the custom ids + the model), so a restarted import continues with the same job instead of submitting it again if the job
+    contains all requested REST operations (e.g. some of its results were saved before the restart), also if the context in
+    the vectorDB changed in the meantime.
+    The ID of a completed job is kept until the results are saved, see finish_batch().
 
-    # Calculate the total duration
-    duration = round(time.time() - start_time, 2)
-    exec_duration = f"The query '{query_string}' took **{duration} seconds** to execute."
-    log.info(exec_duration)
+    Args:
+        requests (list): (custom id, query_string, path, operation, parameters) tuples, see extend_api_description()
+        jsonl_path (str): path to the JSON lines file of the batch requests
+        poll_interval (float): seconds between the status requests of the batch job
 
-    return completion.choices[0].message.content+"\n\n"+exec_duration
\ No newline at end of file
+    Returns:
+        dict: custom id --> extended description (failed requests are missing)
+    """
+    if not requests:
+      return {}
+
+    # === continue with the job of an earlier run which contains all REST operations ===
+    custom_ids = [request[0] for request in requests]
+    state_path = self._batch_state_path(jsonl_path)
+    batch_id = None
+    if os.path.exists(state_path):
+      with open(state_path, "r") as f:
+        state = json.load(f)
+      if state.get("model") == self.model and set(custom_ids) <= set(state.get("custom_ids", [])):
+        batch_id = state["batch_id"]
+        log.info(f"Continuing with the batch job {batch_id}")
+
+    # === write the requests into the JSON lines file + submit the job ===
+    # (the messages are only known for a new job: the token counts of a continued job are the reported ones)
+    messages = {}
+    if batch_id is None:
+      with span("batch_prepare", requests=len(requests)):
+        with open(jsonl_path, "w") as f:
+          for custom_id, query_string, path, operation, parameters in requests:
+            messages[custom_id] = self._extend_messages(query_string,path,operation,parameters)
+            f.write(json.dumps({
+              "custom_id": custom_id,
+              "method": "POST",
+              "url": "/v1/chat/completions",
+              "body": {"model": self.model, "temperature": 0.8, "messages": messages[custom_id]},
+            }) + "\n")
+
+      with open(jsonl_path, "rb") as f:
+        input_file = self.client.files.create(file=f, purpose="batch")
+      batch_id = self.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h").id
+      with open(state_path, "w") as f:
+        json.dump({"batch_id": batch_id, "model": self.model, "custom_ids": custom_ids}, f)
+      log.info(f"Submitted the batch job {batch_id} with {len(requests)} requests")
+
+    # === wait for the job ===
+    with span("batch_wait", batch_id=batch_id):
+      batch = self.client.batches.retrieve(batch_id)
+      while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        log.info(f"Batch job {batch_id}: {batch.status} ({batch.request_counts.completed if batch.request_counts else 0}/{len(requests)})")
+        time.sleep(poll_interval)
+        batch = self.client.batches.retrieve(batch_id)
+
+    if batch.status != "completed" or not batch.output_file_id:
+      # the next import submits a new job
+      os.remove(state_path)
+      log.error(f"Batch job {batch_id} finished with the status {batch.status}")
+      return {}
+
+    # === read the results ===
+    results = {}
+    requested = set(custom_ids)
+    for line in self.client.files.content(batch.output_file_id).text.splitlines():
+      if not line.strip():
+        continue
+      result = json.loads(line)
+      if result.get("custom_id") not in requested:
+        # result of a continued job which was already saved
+        continue
+      response = result.get("response") or {}
+      if response.get("status_code") != 200:
+        log.warning(f"Batch request {result.get('custom_id')} failed: {result.get('error')}")
+        continue
+      body = response["body"]
+      answer = body["choices"][0]["message"]["content"]
+      usage = body.get("usage")
+      record_llm_usage(self.model, messages.get(result["custom_id"]), answer, (usage["prompt_tokens"], usage["completion_tokens"]) if usage else None)
+      results[result["custom_id"]] = answer
+
+    log.info(f"Batch job {batch_id}: {len(results)}/{len(requests)} requests completed")
+    return results
+
+  def finish_batch(self, jsonl_path):
+    """ the results of the batch job are saved: remove the requests file + the ID of the job """
+    super().finish_batch(jsonl_path)
+    if os.path.exists(self._batch_state_path(jsonl_path)):
+      os.remove(self._batch_state_path(jsonl_path))
+
+  def _batch_state_path(self, jsonl_path):
+    """ file with the ID of the batch job of the requests file """
+    return jsonl_path + ".batch.json"
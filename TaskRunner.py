@@ -0,0 +1,95 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import collections
+import multiprocessing
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import logging
+log = logging.getLogger("applogger")
+
+def is_rate_limit_error(error):
+    """
+    Check if an exception of the OpenAI or Ollama client was caused by rate limiting (HTTP 429)
+
+    Args:
+        error (Exception): raised exception
+    """
+    return getattr(error, "status_code", None) == 429 or "RateLimit" in type(error).__name__
+
+def retry_with_backoff(function, *args, max_retries=5, base_delay=1.0, max_delay=60.0, **kwargs):
+    """
+    Call the function and retry with exponential backoff + jitter if it fails.
+    If the server asks to wait (Retry-After header of a rate limit response), this waiting time is used instead.
+
+    Args:
+        function (function): function to call
+        max_retries (int): number of retries before the last exception is raised
+        base_delay (float): waiting time in seconds before the first retry
+        max_delay (float): maximum waiting time in seconds between two retries
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if is_rate_limit_error(e):
+                # rate limits: honour the waiting time requested by the server
+                response = getattr(e, "response", None)
+                retry_after = response.headers.get("retry-after") if response is not None else None
+                if retry_after is not None:
+                    try:
+                        delay = min(max_delay, float(retry_after))
+                    except ValueError:
+                        pass
+                log.warning(f"Rate limited, retry {attempt + 1}/{max_retries} in {delay:.1f} seconds")
+            else:
+                log.warning(f"Error: {e}. Retry {attempt + 1}/{max_retries} in {delay:.1f} seconds")
+            time.sleep(delay)
+
+def run_ordered(function, items, max_workers, processes=False):
+    """
+    Run the function for all items with at most max_workers in parallel.
+    The results are yielded in the order of the items, no matter in which order they finish.
+    Only a bounded number of items is in flight, so the items can be a (lazy) generator.
+
+    Args:
+        function (function): function which is called with one item
+        items (iterable): items to process
+        max_workers (int): maximum number of parallel calls
+        processes (bool): use worker processes instead of threads (CPU-bound functions, must be picklable).
+                          The processes are started with forkserver / spawn: a fork of this process copies the locks of its other threads
+
+    Yields:
+        tuple: (item, result)
+    """
+    items = iter(items)
+    pending = collections.deque()
+
+    if processes:
+        # e.g. background import jobs run this in a thread of the chainlit server: no fork of a multi-threaded process
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    with executor:
+        # keep the pool busy + some items queued
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= max_workers * 2:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+
+            next_item = next(items, None)
+            if next_item is not None:
+                pending.append((next_item, executor.submit(function, next_item)))
+
+            yield item, future.result()
@@ -0,0 +1,154 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import json
+import os
+import shutil
+import numpy as np
+import logging
+log = logging.getLogger("applogger")
+
+class VectorSnapshot:
+  def __init__(self, directory):
+    """
+    Read-only snapshot of a chromadb collection (embeddings, ids, documents, metadata) in memory-mapped NumPy files.
+    At the size of this corpus (tens of thousands of chunks) the exact search with one matrix product is faster than
+    a query of the persistent chromadb client. The rows are sorted by doc_type, so a doc_type filter is a slice (no copy).
+    Create it with VectorSnapshot.export().
+
+    Args:
+        directory (str): folder of the snapshot
+    """
+    self.directory = directory
+    with open(os.path.join(directory, "snapshot.json"), "r") as f:
+      info = json.load(f)
+    self.version = info["version"]
+    self.stamp = info["stamp"]
+    self.space = info["space"]
+    # doc_type --> [first row, last row + 1]
+    self.doc_types = info["doc_types"]
+
+    self.embeddings = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r")
+    self.norms = np.load(os.path.join(directory, "norms.npy"), mmap_mode="r")
+    self._strings = {name: (np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"), np.load(os.path.join(directory, f"{name}_offsets.npy"), mmap_mode="r")) for name in ("ids", "documents", "metadatas")}
+    self.rows = {self._string("ids", row): row for row in range(len(self))}
+
+  def __len__(self):
+    return self.embeddings.shape[0]
+
+  @classmethod
+  def export(cls, collection, directory, version, stamp, dtype = "float32", batch_size = 5000):
+    """
+    Write a snapshot of the collection into a new folder (the folder appears atomically when it is complete)
+
+    Args:
+        collection (chromadb.Collection): the collection
+        directory (str): folder of the snapshot, must not exist
+        version (str): name of the version of the collection
+        stamp (str): index version of the collection at the time of the export (see VectorDB.index_version)
+        dtype (str): "float32" or "float16" (half the memory, scored in float32 blocks)
+        batch_size (int): number of documents which are read from the collection at once
+
+    Returns:
+        VectorSnapshot: the loaded snapshot
+    """
+    ids, embeddings, documents, metadatas = [], [], [], []
+    for offset in range(0, collection.count(), batch_size):
+      results = collection.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+      ids += results["ids"]
+      embeddings += list(results["embeddings"])
+      documents += results["documents"]
+      metadatas += [metadata or {} for metadata in results["metadatas"]]
+
+    # sort the rows by doc_type (documents without doc_type first)
+    order = sorted(range(len(ids)), key=lambda row: metadatas[row].get("doc_type") or "")
+    doc_types = {}
+    for position, row in enumerate(order):
+      doc_type = metadatas[row].get("doc_type")
+      if doc_type is not None:
+        doc_types.setdefault(doc_type, [position, position])[1] = position + 1
+
+    # an empty collection has no dimensions yet: (0, 0) matrix, every search returns no hits
+    matrix = np.asarray([embeddings[row] for row in order], dtype=np.float32).reshape(len(order), -1) if order else np.zeros((0, 0), dtype=np.float32)
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    np.save(os.path.join(tmp_directory, "embeddings.npy"), matrix.astype(dtype))
+    np.save(os.path.join(tmp_directory, "norms.npy"), np.einsum("ij,ij->i", matrix, matrix))
+    for name, values in (("ids", ids), ("documents", documents), ("metadatas", [json.dumps(metadata) for metadata in metadatas])):
+      encoded = [values[row].encode("utf-8") for row in order]
+      np.save(os.path.join(tmp_directory, f"{name}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+      np.save(os.path.join(tmp_directory, f"{name}_offsets.npy"), np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64))
+
+    with open(os.path.join(tmp_directory, "snapshot.json"), "w") as f:
+      json.dump({
+        "version": version,
+        "stamp": stamp,
+        "space": (collection.metadata or {}).get("hnsw:space", "l2"),
+        "doc_types": doc_types,
+      }, f)
+    os.rename(tmp_directory, directory)
+    log.info(f"Exported the snapshot of {version} ({len(order)} documents, {dtype})")
+    return cls(directory)
+
+  def search(self, query_embeddings, n_results, doc_type = None, block_size = 16384):
+    """
+    Exact top-k search for one or many query embeddings (same distances as chromadb: squared L2, 1 - inner product or cosine distance)
+
+    Args:
+        query_embeddings (list): list of query embeddings
+        n_results (int): number of results per query
+        doc_type (str): only search documents of this doc_type (None: all documents)
+        block_size (int): number of rows which are scored at once (bounds the temporary memory)
+
+    Returns:
+        list: per query embedding a list of (row, distance) tuples, best first
+    """
+    queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+    if doc_type is None:
+      start, stop = 0, len(self)
+    else:
+      start, stop = self.doc_types.get(doc_type, (0, 0))
+    k = min(n_results, stop - start)
+    if k <= 0:
+      return [[] for _ in range(len(queries))]
+
+    query_norms = np.einsum("ij,ij->i", queries, queries)
+    distances = np.empty((stop - start, len(queries)), dtype=np.float32)
+    for block_start in range(start, stop, block_size):
+      block_stop = min(block_start + block_size, stop)
+      products = np.asarray(self.embeddings[block_start:block_stop], dtype=np.float32) @ queries.T
+      norms = np.asarray(self.norms[block_start:block_stop])[:, None]
+      if self.space == "ip":
+        block = 1.0 - products
+      elif self.space == "cosine":
+        block = 1.0 - products / np.sqrt(np.maximum(norms * query_norms[None, :], 1e-30))
+      else:
+        block = np.maximum(norms - 2.0 * products + query_norms[None, :], 0.0)
+      distances[block_start - start:block_stop - start] = block
+
+    # top-k per query (column): partition, then sort only the k candidates
+    candidates = np.argpartition(distances, k - 1, axis=0)[:k] if k < distances.shape[0] else np.broadcast_to(np.arange(distances.shape[0])[:, None], distances.shape)
+    results = []
+    for column in range(len(queries)):
+      rows = candidates[:, column]
+      rows = rows[np.argsort(distances[rows, column], kind="stable")]
+      results.append([(int(row) + start, float(distances[row, column])) for row in rows])
+    return results
+
+  def hit(self, row, distance = None, include_embedding = False):
+    """ hit dict (id, document, metadata, distance + optionally the embedding) of a row, like VectorDB._search() """
+    hit = {
+      "id": self._string("ids", row),
+      "document": self._string("documents", row),
+      "metadata": json.loads(self._string("metadatas", row)) or None,
+      "distance": distance,
+    }
+    if include_embedding:
+      hit["embedding"] = np.asarray(self.embeddings[row], dtype=np.float32)
+    return hit
+
+  def _string(self, name, row):
+    values, offsets = self._strings[name]
+    return bytes(values[offsets[row]:offsets[row + 1]]).decode("utf-8")
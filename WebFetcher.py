@@ -0,0 +1,140 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import hashlib
+import json
+import os
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from TaskRunner import run_ordered
+from Metrics import span
+import logging
+log = logging.getLogger("applogger")
+
+class FetchResult:
+    def __init__(self, url, content, not_modified):
+        """
+        Result of a fetched web page
+
+        Args:
+            url (str): requested URL
+            content (bytes): body of the page (from the cache if the page was not modified)
+            not_modified (bool): True if the page did not change since the last request (HTTP 304)
+        """
+        self.url = url
+        self.content = content
+        self.not_modified = not_modified
+
+class CachedFetcher:
+    def __init__(self, cache_dir="http_cache", max_workers=8, timeout=(5, 30), retries=3, mirror_dir=None):
+        """
+        Fetch web pages concurrently with one pooled session.
+        Every response is saved in an on-disk HTTP cache. The next request of the same URL is a conditional GET
+        (ETag / Last-Modified), so unchanged pages are not downloaded again.
+
+        Args:
+            cache_dir (str): folder of the HTTP cache. None disables the cache.
+            max_workers (int): number of parallel requests (+ size of the connection pool)
+            timeout (tuple): (connect timeout, read timeout) in seconds of each request
+            retries (int): number of retries for connection errors and 429/5xx responses
+            mirror_dir (str): read the pages from this local folder instead (<last part of the URL path>.html)
+        """
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.mirror_dir = mirror_dir
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url):
+        """
+        Fetch one web page
+
+        Args:
+            url (str): URL of the page
+
+        Returns:
+            FetchResult
+        """
+        if self.mirror_dir is not None:
+            name = os.path.basename(urlparse(url).path.rstrip("/")) or "index"
+            with open(os.path.join(self.mirror_dir, f"{name}.html"), "rb") as f:
+                return FetchResult(url, f.read(), False)
+
+        cached = self._load(url)
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with span("fetch_page", url=url) as attributes:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+            attributes["status_code"] = r.status_code
+
+        if r.status_code == 304 and cached is not None:
+            return FetchResult(url, cached["content"], True)
+
+        r.raise_for_status()
+        self._save(url, r)
+        return FetchResult(url, r.content, False)
+
+    def fetch_all(self, urls):
+        """
+        Fetch all web pages concurrently. The results are yielded in the order of the URLs.
+
+        Args:
+            urls (list): URLs of the pages
+
+        Yields:
+            tuple: (url, FetchResult or the raised exception)
+        """
+        def fetch_or_error(url):
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                return e
+
+        yield from run_ordered(fetch_or_error, urls, self.max_workers)
+
+    def _cache_path(self, url):
+        """ file path (without extension) of the cached URL """
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def _load(self, url):
+        """ return the cached response (etag, last_modified, content) of the URL or None """
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(url)
+        try:
+            with open(path + ".json", "r") as f:
+                cached = json.load(f)
+            with open(path + ".body", "rb") as f:
+                cached["content"] = f.read()
+            return cached
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, url, response):
+        """ save the response in the cache if it has a validator (ETag or Last-Modified) """
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if self.cache_dir is None or (etag is None and last_modified is None):
+            return
+
+        path = self._cache_path(url)
+        with open(path + ".body", "wb") as f:
+            f.write(response.content)
+        with open(path + ".json", "w") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified}, f)
@@ -0,0 +1,119 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from types import SimpleNamespace
+import numpy as np
+import chromadb
+from TalkToOpenAI import LLMOpenAI
+from ContextPacker import estimate_tokens
+import logging
+log = logging.getLogger("applogger")
+
+class FakeEmbeddingFunction(chromadb.EmbeddingFunction):
+    def __init__(self, dimensions=384, latency=0.05, latency_per_text=0.0005):
+        """
+        Deterministic stand-in for the OpenAI / Ollama embedding functions.
+        Every word is hashed into one dimension (hashing trick), so texts with the same words get similar vectors.
+
+        Args:
+            dimensions (int): number of dimensions of each vector
+            latency (float): seconds per call (like the round trip of an embedding API request)
+            latency_per_text (float): additional seconds per text of the call
+        """
+        self.dimensions = dimensions
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.model_name = f"fake-embedding-{dimensions}"
+        self.calls = 0
+
+    def __call__(self, input):
+        self.calls += 1
+        time.sleep(self.latency + self.latency_per_text * len(input))
+
+        vectors = np.zeros((len(input), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[row, int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "little") % self.dimensions] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors.tolist()
+
+class _FakeCompletions:
+    def __init__(self, ttft, latency_per_token, answer_tokens, latency_per_prompt_token=0.0):
+        self.ttft = ttft
+        self.latency_per_token = latency_per_token
+        self.answer_tokens = answer_tokens
+        self.latency_per_prompt_token = latency_per_prompt_token
+
+    def prefill(self, messages):
+        """ seconds until the first token: fixed latency + processing of the prompt """
+        return self.ttft + self.latency_per_prompt_token * sum(estimate_tokens(message["content"]) for message in messages)
+
+    def answer(self, messages):
+        """ deterministic answer: the words of the prompt, repeated up to answer_tokens words """
+        words = re.findall(r"\S+", messages[-1]["content"]) or ["answer"]
+        return [words[i % len(words)] + " " for i in range(self.answer_tokens)]
+
+    @staticmethod
+    def chunk(token):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+    @staticmethod
+    def completion(content):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class FakeChatCompletions(_FakeCompletions):
+    def create(self, model, messages, temperature=None, stream=False):
+        tokens = self.answer(messages)
+        if not stream:
+            time.sleep(self.prefill(messages) + self.latency_per_token * len(tokens))
+            return self.completion("".join(tokens))
+
+        def generate():
+            time.sleep(self.prefill(messages))
+            for token in tokens:
+                time.sleep(self.latency_per_token)
+                yield self.chunk(token)
+        return generate()
+
+class FakeAsyncChatCompletions(_FakeCompletions):
+    async def create(self, model, messages, temperature=None, stream=False):
+        tokens = self.answer(messages)
+        if not stream:
+            await asyncio.sleep(self.prefill(messages) + self.latency_per_token * len(tokens))
+            return self.completion("".join(tokens))
+
+        async def generate():
+            await asyncio.sleep(self.prefill(messages))
+            for token in tokens:
+                await asyncio.sleep(self.latency_per_token)
+                yield self.chunk(token)
+        return generate()
+
+class FakeLLM(LLMOpenAI):
+    def __init__(self, database, model="fake-llm", ttft=0.2, latency_per_token=0.005, answer_tokens=100, latency_per_prompt_token=0.0, **kwargs):
+        """
+        LLMOpenAI with deterministic stand-in clients instead of the OpenAI API.
+        Retrieval, context packing + prompt assembly are the real implementation, only the API requests are simulated.
+
+        Args:
+            database (VectorDB): vectorDB instance
+            model (str): name of the LLM (only used for the token budget + the answer cache)
+            ttft (float): seconds until the first token of an answer
+            latency_per_token (float): seconds per generated token
+            answer_tokens (int): number of tokens of each answer
+            latency_per_prompt_token (float): additional seconds until the first token per prompt token
+            kwargs: further arguments of LLMOpenAI, e.g. answer_cache or endpoint_catalog
+        """
+        # the OpenAI clients are not used, they only need an API key to be created
+        os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+        super().__init__(database, model=model, **kwargs)
+
+        self.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeChatCompletions(ttft, latency_per_token, answer_tokens, latency_per_prompt_token)))
+        self.async_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncChatCompletions(ttft, latency_per_token, answer_tokens, latency_per_prompt_token)))
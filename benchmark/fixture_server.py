@@ -0,0 +1,95 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import hashlib
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import logging
+log = logging.getLogger("applogger")
+
+WORDS = ("device site network api token request response parameter header query path health "
+         "template discovery provisioning credential inventory interface client wireless fabric "
+         "the a to of and is with for this can be used by all").split()
+
+def generate_page(name, paragraphs, seed=0):
+    """
+    Deterministic HTML page which looks like an API docs page
+
+    Args:
+        name (str): name of the page
+        paragraphs (int): number of paragraphs (approx. 60 words each)
+        seed (int): seed of the random text
+    """
+    rng = random.Random(f"{seed}:{name}")
+    body = []
+    for i in range(paragraphs):
+        sentences = []
+        for _ in range(5):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        if i % 4 == 0:
+            sentences.append(f"Use GET /dna/intent/api/v1/{name}/{i} with the header X-Auth-Token.")
+        body.append(f"<p>{' '.join(sentences)}</p>")
+    return f"<html><head><title>{name}</title></head><body><h1>{name}</h1>{''.join(body)}</body></html>".encode("utf-8")
+
+class FixtureServer:
+    def __init__(self, pages, latency=0.0):
+        """
+        Local HTTP server which serves fixed pages (stand-in for developer.cisco.com).
+        Every page has an ETag, conditional requests are answered with 304 Not Modified.
+
+        Args:
+            pages (dict): page name --> HTML content (bytes), served at /<page name>
+            latency (float): seconds before each response
+        """
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency)
+
+                content = server.pages.get(self.path.strip("/"))
+                if content is None:
+                    self.send_error(404)
+                    return
+
+                etag = '"' + hashlib.sha256(content).hexdigest()[:16] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(content)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        """ URL of the server, the page names are appended """
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
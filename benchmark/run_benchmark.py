@@ -0,0 +1,304 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+
+Offline benchmark of the data import + the query path.
+The LLM, the embedding function and developer.cisco.com are replaced by deterministic stand-ins (see fakes.py, fixture_server.py),
+everything else (chunking, vectorDB, keyword index, caches, context packing) is the real implementation.
+
+Run from the repository root:
+    python benchmark/run_benchmark.py --output benchmark_result.json
+    python benchmark/run_benchmark.py --baseline benchmark_result.json   # exit code 1 on a regression
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import json
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import fitz
+from TalkToDatabase import VectorDB
+from RetrievalService import RetrievalServer, RetrievalClient
+from ImportData import DataHandler, APIDOCS_PAGES
+from EndpointCatalog import EndpointCatalog
+from Metrics import LLM_TOKENS
+from WebFetcher import CachedFetcher
+from fakes import FakeEmbeddingFunction, FakeLLM
+from fixture_server import FixtureServer, generate_page
+import logging
+log = logging.getLogger("applogger")
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SWAGGER_FILE = os.path.join(REPOSITORY, "data", "GA-2-3-7-swagger-v1.annotated.json")
+
+QUESTIONS = [
+    "How do I get the list of network devices with /dna/intent/api/v1/network-device?",
+    "Which header is needed for the authentication token?",
+    "How can I deploy a configuration template?",
+    "Show me Python code to get the health of all sites",
+    "What are the query parameters of the discovery API?",
+    "How do I track the progress of an asynchronous task?",
+    "How can I add a new wireless client?",
+    "Which API returns the interfaces of a device?",
+]
+
+def percentiles(values):
+    """ p50 / p95 / p99 of a list of seconds, in milliseconds """
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return {"p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2)}
+
+def peak_rss_mb():
+    """ peak resident set size of this process + of the (finished) worker processes """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"process": round(own, 1), "children": round(children, 1)}
+
+def measure_import(database, function, *args):
+    """ run one importer, return its duration + throughput (chunks written to the vectorDB per second) """
+    count_before = database.collection.count()
+    start_time = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start_time
+    documents = database.collection.count() - count_before
+    return {"documents": documents, "seconds": round(seconds, 3), "docs_per_second": round(documents / seconds, 1)}
+
+def generate_pdf(filepath, pages, paragraphs_per_page):
+    """ write a PDF document with deterministic text (stand-in for the user guide) """
+    with fitz.open() as doc:
+        for number in range(pages):
+            html = generate_page(f"guide-{number}", paragraphs_per_page).decode("utf-8")
+            text = html.replace("</p>", "\n\n").split("<body>")[1]
+            text = "".join(part.split(">")[-1] for part in text.split("<"))
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=7)
+        doc.save(filepath)
+
+def generate_swagger(filepath, operations):
+    """ write the first operations of the API specification into a new OpenAPI document """
+    with open(SWAGGER_FILE, "r") as f:
+        swagger = json.load(f)
+
+    paths = {}
+    count = 0
+    for path, path_dict in swagger["paths"].items():
+        if count >= operations:
+            break
+        paths[path] = dict(list(path_dict.items())[:operations - count])
+        count += len(paths[path])
+    swagger["paths"] = paths
+
+    with open(filepath, "w") as f:
+        json.dump(swagger, f)
+
+def run_retrieval(database, queries, concurrency):
+    """ vectorDB + keyword search only (no LLM), threads like the chainlit workers """
+    def query(question):
+        start_time = time.perf_counter()
+        database.query_db_multi(question, {"apidocs": 6, "apispecs": 10})
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(query, queries))
+    seconds = time.perf_counter() - start_time
+
+    return {"count": len(queries), "concurrency": concurrency, "queries_per_second": round(len(queries) / seconds, 1), "latency_ms": percentiles(latencies)}
+
+def run_search(database, queries, concurrency):
+    """ vector search only (the queries are embedded before): single searches in threads + one batched search of all queries """
+    query_embeddings = database.embeddings_function(queries)
+
+    def search(query_embedding):
+        start_time = time.perf_counter()
+        database._search([query_embedding], 10, "apispecs", None)
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = list(executor.map(search, query_embeddings))
+    seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    database._search(query_embeddings, 10, "apispecs", None)
+    batch_seconds = time.perf_counter() - start_time
+
+    return {
+        "count": len(queries),
+        "queries_per_second": round(len(queries) / seconds, 1),
+        "latency_ms": percentiles(latencies),
+        "batch_ms_per_query": round(batch_seconds / len(queries) * 1000, 3),
+    }
+
+async def run_questions(llm, queries, concurrency):
+    """ full query path with streaming (like main.py): embed, retrieve, pack, generate """
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts, latencies = [], []
+
+    async def ask(question):
+        async with semaphore:
+            start_time = time.perf_counter()
+            first_token_time = None
+            async for _ in llm.ask_llm_stream_async(question):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+            ttfts.append(first_token_time - start_time)
+            latencies.append(time.perf_counter() - start_time)
+
+    prompt_tokens = LLM_TOKENS.value(model=llm.model, kind="prompt")
+    start_time = time.perf_counter()
+    await asyncio.gather(*(ask(question) for question in queries))
+    seconds = time.perf_counter() - start_time
+    prompt_tokens = LLM_TOKENS.value(model=llm.model, kind="prompt") - prompt_tokens
+
+    return {
+        "count": len(queries),
+        "concurrency": concurrency,
+        "queries_per_second": round(len(queries) / seconds, 2),
+        "ttft_ms": percentiles(ttfts),
+        "latency_ms": percentiles(latencies),
+        "prompt_tokens_per_question": round(prompt_tokens / len(queries)),
+    }
+
+def run(args):
+    """ run all benchmark stages in a temporary working directory, return the report """
+    report = {"config": vars(args), "imports": {}}
+    working_directory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the importers write to data/ relative to the working directory
+        os.chdir(tmp)
+        try:
+            os.makedirs("data")
+            embedding_function = FakeEmbeddingFunction(latency=args.embedding_latency, latency_per_text=args.embedding_latency_per_text)
+            database = VectorDB("benchmark", embedding_function, os.path.join(tmp, "chromadb"), embedding_cache_path=os.path.join(tmp, "embedding_cache.sqlite3"))
+            endpoint_catalog = EndpointCatalog(os.path.join(tmp, "chromadb", "endpoint_catalog.sqlite3"))
+            llm = FakeLLM(database, ttft=args.llm_ttft, latency_per_token=args.llm_latency_per_token, answer_tokens=args.answer_tokens, latency_per_prompt_token=args.llm_latency_per_prompt_token, endpoint_catalog=endpoint_catalog)
+            datahandler = DataHandler(database, llm,
+                batch_size=args.batch_size,
+                llm_concurrency=args.concurrency,
+                fetcher=CachedFetcher(cache_dir=os.path.join(tmp, "http_cache")),
+                endpoint_catalog=endpoint_catalog
+            )
+
+            # === API docs from the local fixture server: first import + re-import of unchanged pages (HTTP 304) ===
+            pages = {name: generate_page(name, args.paragraphs_per_page) for name in APIDOCS_PAGES}
+            with FixtureServer(pages, latency=args.http_latency) as server:
+                report["imports"]["apidocs"] = measure_import(database, datahandler.scrape_apidocs_catcenter, server.base_url)
+                report["imports"]["apidocs_unchanged"] = measure_import(database, datahandler.scrape_apidocs_catcenter, server.base_url)
+
+            # === PDF user guide ===
+            generate_pdf("data/user_guide.pdf", args.pdf_pages, args.paragraphs_per_page)
+            report["imports"]["userguide"] = measure_import(database, datahandler.scrape_pdfuserguide_catcenter, os.path.join(tmp, "data", "user_guide.pdf"))
+
+            # === API specification: endpoint catalog + extension by the LLM ===
+            generate_swagger("data/swagger.json", args.apispecs_operations)
+            report["imports"]["endpoint_catalog"] = measure_import(database, datahandler.import_endpoint_catalog, "data/swagger.json")
+            report["imports"]["apispecs"] = measure_import(database, datahandler.import_apispecs_generate_new_data, "data/swagger.json")
+
+            # === query path ===
+            queries = [QUESTIONS[i % len(QUESTIONS)] + f" ({i})" for i in range(args.queries)]
+            report["retrieval"] = run_retrieval(database, queries, args.concurrency)
+            report["questions"] = asyncio.run(run_questions(llm, queries, args.concurrency))
+
+            # === same questions with a fixed number of hits (without the adaptive retrieval) ===
+            llm.adaptive_retrieval = False
+            report["questions_fixed_retrieval"] = asyncio.run(run_questions(llm, [query + " (fixed)" for query in queries], args.concurrency))
+            llm.adaptive_retrieval = True
+
+            # === query path while the changed PDF user guide is imported (into a new version of the collection) ===
+            generate_pdf("data/user_guide.pdf", args.pdf_pages, args.paragraphs_per_page + 1)
+            with ThreadPoolExecutor(1) as executor:
+                reimport = executor.submit(datahandler.scrape_pdfuserguide_catcenter, os.path.join(tmp, "data", "user_guide.pdf"))
+                report["retrieval_during_import"] = run_retrieval(database, queries, args.concurrency)
+                reimport.result()
+
+            # === vector search: chromadb vs. memory-mapped snapshot (exact search with NumPy) ===
+            report["search"] = {"chroma": run_search(database, queries, args.concurrency)}
+            database.snapshot = True
+            database.refresh_snapshot()
+            report["search"]["snapshot"] = run_search(database, queries, args.concurrency)
+            report["retrieval_snapshot"] = run_retrieval(database, queries, args.concurrency)
+
+            # === shared retrieval server: the workers (threads with their own connections) query the vectorDB via a Unix socket ===
+            # the query embeddings of concurrent requests are embedded with one call
+            with RetrievalServer(database, os.path.join(tmp, "retrieval.sock")) as retrieval_server:
+                client = RetrievalClient(retrieval_server.address, "benchmark", os.path.join(tmp, "chromadb"))
+                calls = embedding_function.calls
+                report["retrieval_service"] = run_retrieval(client, [query + " (service)" for query in queries], args.concurrency)
+                report["retrieval_service"]["embedding_calls"] = embedding_function.calls - calls
+                report["retrieval_service"]["server"] = client.stats()
+
+            report["collection_size"] = database.collection.count()
+            report["embedding_calls"] = embedding_function.calls
+            report["peak_rss_mb"] = peak_rss_mb()
+        finally:
+            os.chdir(working_directory)
+
+    return report
+
+def compare(report, baseline, tolerance):
+    """ return the regressions of the report compared to the baseline report """
+    regressions = []
+    for name, result in baseline.get("imports", {}).items():
+        current = report["imports"].get(name)
+        if current and result["documents"] and current["docs_per_second"] < result["docs_per_second"] * (1 - tolerance):
+            regressions.append(f'import {name}: {current["docs_per_second"]} docs/s (baseline {result["docs_per_second"]} docs/s)')
+    for stage in ["retrieval", "retrieval_during_import", "retrieval_snapshot", "retrieval_service", "questions"]:
+        for metric in ["latency_ms", "ttft_ms"]:
+            if metric not in baseline.get(stage, {}):
+                continue
+            current, previous = report[stage][metric]["p95"], baseline[stage][metric]["p95"]
+            if previous and current > previous * (1 + tolerance):
+                regressions.append(f"{stage} {metric} p95: {current} ms (baseline {previous} ms)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the data import + query path")
+    parser.add_argument("--paragraphs-per-page", type=int, default=20, help="size of each API docs page + PDF page")
+    parser.add_argument("--pdf-pages", type=int, default=50, help="number of pages of the PDF user guide")
+    parser.add_argument("--apispecs-operations", type=int, default=50, help="number of REST operations which are extended by the LLM")
+    parser.add_argument("--queries", type=int, default=50, help="number of user questions")
+    parser.add_argument("--concurrency", type=int, default=4, help="parallel user questions + parallel LLM calls of the import")
+    parser.add_argument("--batch-size", type=int, default=128, help="chunks per embedding call + vectorDB write")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embedding call")
+    parser.add_argument("--embedding-latency-per-text", type=float, default=0.0005, help="additional seconds per embedded text")
+    parser.add_argument("--llm-ttft", type=float, default=0.2, help="seconds until the first token of the LLM")
+    parser.add_argument("--llm-latency-per-token", type=float, default=0.005, help="seconds per generated token")
+    parser.add_argument("--llm-latency-per-prompt-token", type=float, default=0.0001, help="additional seconds until the first token per prompt token")
+    parser.add_argument("--answer-tokens", type=int, default=100, help="tokens per LLM answer")
+    parser.add_argument("--http-latency", type=float, default=0.05, help="seconds per HTTP response of the fixture server")
+    parser.add_argument("--output", help="write the JSON report into this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON report of an earlier run: exit code 1 if the throughput or p95 latency regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression compared to the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the log messages of the app")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    log.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    logging.getLogger("chromadb").setLevel(logging.CRITICAL)
+
+    report = run(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
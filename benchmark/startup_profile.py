@@ -0,0 +1,98 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+
+Startup profile of the app: time until the app is ready (imports + instance creation like main.py, without the chainlit server)
+and the modules with the longest import time (python -X importtime), each in a fresh interpreter.
+
+Run from the repository root:
+    python benchmark/startup_profile.py
+    python benchmark/startup_profile.py --llm ollama --warm-up    # also load the vector DB + the embedding model
+"""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import subprocess
+import tempfile
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# same imports + instances as main.py (without chainlit), the report is printed as JSON
+STARTUP_SCRIPT = """
+import json, sys, time
+from Startup import StartupProfile
+startup = StartupProfile()
+with startup.phase("imports"):
+    from LLMBackend import get_backend
+    from TalkToDatabase import VectorDB
+    from AnswerCache import SemanticAnswerCache
+    from ImportData import DataHandler
+    from WebFetcher import CachedFetcher
+    from EndpointCatalog import EndpointCatalog
+    from Metrics import REGISTRY
+with startup.phase("instances"):
+    answer_cache = SemanticAnswerCache()
+    LLMBackendClass = get_backend({llm!r})
+    database = VectorDB("catcenter_vectors", LLMBackendClass.embeddings_function, {database_path!r}, embedding_cache_path={embedding_cache_path!r})
+    endpoint_catalog = EndpointCatalog({endpoint_catalog_path!r})
+    LLM = LLMBackendClass(database=database, answer_cache=answer_cache, endpoint_catalog=endpoint_catalog)
+    datahandler = DataHandler(database, LLM, endpoint_catalog=endpoint_catalog)
+report = startup.report()
+if {warm_up!r}:
+    with startup.phase("warm_up"):
+        database.warm_up()
+    report = startup.report()
+print(json.dumps(report))
+"""
+
+def profile_startup(args, tmp):
+    """ run the startup in a fresh interpreter, return its report + the import times of the modules """
+    script = STARTUP_SCRIPT.format(
+        llm=args.llm,
+        warm_up=args.warm_up,
+        database_path=args.database_path or os.path.join(tmp, "chromadb"),
+        embedding_cache_path=os.path.join(tmp, "embedding_cache.sqlite3"),
+        endpoint_catalog_path=os.path.join(tmp, "endpoint_catalog.sqlite3"),
+    )
+    # the OpenAI embedding function needs an API key when the vector DB is opened (--warm-up)
+    env = dict(os.environ, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "startup-profile"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=REPOSITORY, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+
+    # "import time: self [us] | cumulative | imported package" (top-level imports have no indentation)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name.startswith("  "):
+            modules.append((name.strip(), int(cumulative) / 1_000_000))
+    modules.sort(key=lambda module: module[1], reverse=True)
+    report["slowest_imports"] = {name: round(seconds, 4) for name, seconds in modules[:args.top]}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup profile of the app")
+    parser.add_argument("--llm", default="openai", help="LLM backend, see LLMBackend.BACKENDS")
+    parser.add_argument("--warm-up", action="store_true", help="also open the vector DB + load the embedding model")
+    parser.add_argument("--database-path", help="existing vector DB (default: new, empty vector DB)")
+    parser.add_argument("--top", type=int, default=15, help="number of listed top-level imports")
+    parser.add_argument("--max-ready-seconds", type=float, help="exit code 1 if the app needs longer until it is ready")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = profile_startup(args, tmp)
+    print(json.dumps(report, indent=2))
+
+    if args.max_ready_seconds is not None and report["ready_seconds"] > args.max_ready_seconds:
+        print(f'REGRESSION: ready after {report["ready_seconds"]} seconds (maximum {args.max_ready_seconds} seconds)', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
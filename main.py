@@ -2,26 +2,94 @@
 Cisco Sample Code License 1.1
 Author: flopach 2024
 """
-from TalkToOpenAI import LLMOpenAI
-from TalkToOllama import LLMOllama
-from TalkToDatabase import VectorDB
-from ImportData import DataHandler
-import logging
-import chainlit as cl
+# measure the app start from the first statement on (see the "startup" log line)
+from Startup import StartupProfile, warm_up_in_background
+startup = StartupProfile()
+
+# chromadb, the embedding model, the LLM client libraries, fitz + bs4 are not loaded here:
+# they are loaded on first use or by the background warm-up, so that the app is ready immediately
+with startup.phase("imports"):
+  from LLMBackend import get_backend
+  from TalkToDatabase import VectorDB
+  from RetrievalService import RetrievalClient
+  from AnswerCache import SemanticAnswerCache
+  from ImportData import DataHandler
+  from ImportJobs import JobRunner
+  from WebFetcher import CachedFetcher
+  from EndpointCatalog import EndpointCatalog
+  from Metrics import REGISTRY
+  import asyncio
+  import logging
+  import chainlit as cl
+  from chainlit.server import app
+  from fastapi import Response
 
 # ======================
 # SETTINGS
 # ======================
 
 # Select the LLM which you would like to use.
-# "openai" or "ollama". You can also define the specific model below
+# "openai" or "ollama" (more backends can be added with LLMBackend.register_backend())
 setting_chosen_LLM = "openai"
 
+# Specific model of the chosen LLM. None = default model of the backend ("gpt-3.5-turbo" / "llama3")
+setting_llm_model = None
+
+# Timeout in seconds of each LLM request + size of the connection pool to the LLM
+setting_llm_timeout = 120
+setting_llm_max_connections = 10
+
 # Do you want to extend the API specification from scratch?
 # True = Your chosen LLM will generate the existing base API documentation. This can take several hours.
 # False = Use the already generated JSON file (generated with GPT-3.5-turbo)
 setting_full_import = False
 
+# Number of chunks which are embedded + written to the vector DB in one go during the data import
+setting_import_batch_size = 128
+
+# Number of REST operations which are extended by the LLM in parallel (only used with setting_full_import = True)
+# Every extended REST operation is appended to data/extended_apispecs_documentation.jsonl, an interrupted full import continues where it stopped
+setting_llm_concurrency = 4
+
+# True = the REST operations are extended with one batch job instead of single requests (only OpenAI: Batch API).
+# Cheaper, but the batch job can take up to 24 hours. An interrupted import continues to wait for the same job.
+setting_llm_batch = False
+
+# Number of importers which run at the same time as background jobs ("importdata")
+# Jobs which were running when the app stopped are started again (state in chromadb/import_jobs.json)
+setting_import_workers = 2
+
+# Read the API docs pages from a local folder (<page>.html) instead of developer.cisco.com, e.g. for offline benchmarks
+# None = request developer.cisco.com. Unchanged pages are skipped via the HTTP cache in http_cache/
+setting_apidocs_mirror_dir = None
+
+# Answer cache: similar questions (cosine similarity of the question embeddings) are answered from the cache
+# Cached answers are invalidated automatically as soon as an import changes the vector DB
+setting_answer_cache_similarity = 0.95
+setting_answer_cache_ttl = 3600
+setting_answer_cache_size = 256
+
+# Maximum number of context tokens per prompt. None = default budget of the chosen model (see ContextPacker.py)
+# The exact REST API query information of the retrieved endpoints (endpoint catalog) uses up to half of it
+setting_context_token_budget = None
+
+# True = the number of context hits per question depends on their distances (specific questions: fewer tokens, faster answers)
+# + similar hits are skipped in favour of diverse ones. False = always the same number of hits (see AdaptiveRetrieval.py)
+setting_adaptive_retrieval = True
+
+# True = the vector searches are answered from a memory-mapped NumPy snapshot of the vector DB (exact search, faster at this corpus size)
+# The snapshot is exported again after each import (chromadb/<collection>_snapshot_<version>/), until then chromadb is used
+setting_vector_snapshot = False
+
+# Shared retrieval server for several chainlit worker processes: None = this process opens the vector DB + embedding model itself.
+# Path of a Unix socket (e.g. "chromadb/retrieval.sock") or ("127.0.0.1", 8100) = the vector DB is used via the retrieval server,
+# which has to be started first: python RetrievalService.py --llm openai --socket chromadb/retrieval.sock (same LLM as setting_chosen_LLM)
+setting_retrieval_service = None
+
+# True = open the vector DB + load the embedding model in the background as soon as the server is listening
+# False = they are loaded with the first user question
+setting_warm_up = True
+
 # ======================
 # Instance creations
 # ======================
@@ -30,17 +98,71 @@ setting_full_import = False
 log = logging.getLogger("applogger")
 logging.getLogger("applogger").setLevel(logging.DEBUG)
 
-if setting_chosen_LLM == "openai":
-  # OpenAI: Create instance for Vector DB and LLM
-  database = VectorDB("catcenter_vectors","openai","chromadb/")
-  LLM = LLMOpenAI(database=database,model="gpt-3.5-turbo")
-else:
-  # Open Source LLM: Create instance for Vector DB and LLM
-  database = VectorDB("catcenter_vectors","ollama","chromadb/")
-  LLM = LLMOllama(database=database,model="llama3")
+with startup.phase("instances"):
+  # Create the cache for answers of similar questions
+  answer_cache = SemanticAnswerCache(
+    similarity_threshold=setting_answer_cache_similarity,
+    ttl=setting_answer_cache_ttl,
+    max_entries=setting_answer_cache_size
+  )
+
+  # Create instance for Vector DB and LLM
+  LLMBackendClass = get_backend(setting_chosen_LLM)
+  if setting_retrieval_service is None:
+    database = VectorDB("catcenter_vectors",LLMBackendClass.embeddings_function,"chromadb/",snapshot=setting_vector_snapshot)
+  else:
+    database = RetrievalClient(setting_retrieval_service,"catcenter_vectors","chromadb/")
+  endpoint_catalog = EndpointCatalog("chromadb/endpoint_catalog.sqlite3")
+  LLM = LLMBackendClass(database=database,
+    model=setting_llm_model,
+    answer_cache=answer_cache,
+    context_token_budget=setting_context_token_budget,
+    endpoint_catalog=endpoint_catalog,
+    timeout=setting_llm_timeout,
+    max_connections=setting_llm_max_connections,
+    adaptive_retrieval=setting_adaptive_retrieval
+  )
+
+  # Create DataHandler instance to import and embed data from local documents
+  datahandler = DataHandler(database,LLM,
+    batch_size=setting_import_batch_size,
+    llm_concurrency=setting_llm_concurrency,
+    llm_batch=setting_llm_batch,
+    fetcher=CachedFetcher(cache_dir="http_cache",mirror_dir=setting_apidocs_mirror_dir),
+    endpoint_catalog=endpoint_catalog
+  )
+
+  # Background import jobs: each importer is a job which can be paused, resumed + cancelled
+  jobrunner = JobRunner("chromadb/import_jobs.json", max_workers=setting_import_workers)
+  jobrunner.register("apidocs", datahandler.scrape_apidocs_catcenter)
+  jobrunner.register("userguide", datahandler.scrape_pdfuserguide_catcenter)
+  jobrunner.register("endpoint_catalog", datahandler.import_endpoint_catalog)
+  jobrunner.register("apispecs", datahandler.import_apispecs_from_json)
+  jobrunner.register("apispecs_generate", datahandler.import_apispecs_generate_new_data)
+  jobrunner.resume_jobs()
+
+# ======================
+# Metrics (Prometheus text format): http://localhost:8000/metrics
+# Per request: durations of all stages, time to first token, token counts + estimated cost
+# ======================
+
+@app.get("/metrics")
+def metrics():
+  return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
-# Create DataHandler instance to import and embed data from local documents
-datahandler = DataHandler(database,LLM)
+# chainlit serves its web UI for all other paths: the metrics route needs to be matched first
+metrics_route = next(route for route in app.router.routes if getattr(route, "path", None) == "/metrics")
+app.router.routes.remove(metrics_route)
+app.router.routes.insert(0, metrics_route)
+
+# ======================
+# Startup: the app is ready now (see the "startup" log line)
+# Vector DB, embedding model + LLM clients are loaded in the background as soon as the server is listening
+# ======================
+
+startup.report()
+if setting_warm_up:
+  warm_up_in_background(database.warm_up, lambda: LLM.client, lambda: LLM.async_client, profile=startup)
 
 # ======================
 # Chainlit functions
@@ -66,38 +188,109 @@ async def main(message: cl.Message):
   msg = cl.Message(content="")
   await msg.send()
 
-  # if the user only types "importdata", call the import_data() function
-  if message.content == "importdata":
-    msg.content = await import_data()
+  # if the user only types "importdata", the import jobs are started. The other import commands control them.
+  command, _, job_id = message.content.strip().partition(" ")
+  if command == "importdata":
+    await import_data(msg)
+  elif command in IMPORT_COMMANDS:
+    msg.content = import_command(command, job_id.strip())
   else:
-    # else, send the user_query to the LLM
-    msg.content = await ask_llm(message.content)
+    # else, send the user_query to the LLM. The answer is streamed into the message.
+    await ask_llm(message.content, msg)
 
   await msg.update()
 
 @cl.step
-async def ask_llm(query_string):
+async def ask_llm(query_string, msg):
   """
-  Chainlit Step function: ask the LLM + return the result
+  Chainlit Step function: ask the LLM + stream the result token by token into the message
   """
-  response = LLM.ask_llm(query_string)
-  return response
+  async for token in LLM.ask_llm_stream_async(query_string):
+    await msg.stream_token(token)
+  return msg.content
 
-@cl.step
-async def import_data():
+# ======================
+# Data import (background jobs)
+# "importdata" starts the jobs, "importstatus" shows them
+# "importpause <id>", "importresume <id>", "importcancel <id>" (without id: all jobs)
+# ======================
+
+IMPORT_COMMANDS = ["importstatus", "importpause", "importresume", "importcancel"]
+
+# the event loop only keeps weak references to its tasks: the running progress tasks are kept here
+progress_tasks = set()
+
+async def import_data(msg):
   """
-  Chainlit Step function: Importing data to vectorDB
+  Start the import jobs + stream their progress into the message.
+  The importers run in the worker pool of the job runner: the chat is still answered from the current vectorDB.
   """
-  # Import data from API documentation  
-  datahandler.scrape_apidocs_catcenter()
+  if jobrunner.active_jobs():
+    msg.content = "An import is already running:\n" + format_jobs(jobrunner.active_jobs())
+    return
+
+  # Import data from API documentation + Catalyst Center PDF User Guide
+  apidocs = jobrunner.submit("apidocs")
+  userguide = jobrunner.submit("userguide", "data/b_cisco_catalyst_center_user_guide_237.pdf")
 
-  # Import data from Catalyst Center PDF User Guide
-  datahandler.scrape_pdfuserguide_catcenter("data/b_cisco_catalyst_center_user_guide_237.pdf")
+  # Build the endpoint catalog (exact path, REST operation + parameters of each API call) from the API specification
+  endpoint_catalog_job = jobrunner.submit("endpoint_catalog", "data/GA-2-3-7-swagger-v1.annotated.json")
 
-  # Import API Specs Document
+  # Import API Specs Document. Generating it uses the API docs + user guide as context: it starts after both are imported
   if setting_full_import:
-    datahandler.import_apispecs_generate_new_data("data/GA-2-3-7-swagger-v1.annotated.json")
+    apispecs = jobrunner.submit("apispecs_generate", "data/GA-2-3-7-swagger-v1.annotated.json", depends_on=[apidocs.id, userguide.id])
   else:
-    datahandler.import_apispecs_from_json()
+    apispecs = jobrunner.submit("apispecs")
+
+  jobs = [apidocs, userguide, endpoint_catalog_job, apispecs]
+  msg.content = "Import started:\n" + format_jobs(jobs)
+
+  # the progress is streamed into the message while the user can continue to chat
+  task = asyncio.create_task(stream_import_progress(msg, jobs))
+  progress_tasks.add(task)
+  task.add_done_callback(progress_tasks.discard)
+
+async def stream_import_progress(msg, jobs, interval = 2):
+  """
+  Update the message with the progress of the jobs until all of them are finished
+  """
+  while any(job.active for job in jobs):
+    await asyncio.sleep(interval)
+    msg.content = "Import running:\n" + format_jobs(jobs)
+    await msg.update()
+
+  msg.content = "All data imported!\n" + format_jobs(jobs)
+  await msg.update()
+
+def import_command(command, job_id):
+  """
+  Show or control the import jobs
+
+  Args:
+      command (str): "importstatus", "importpause", "importresume" or "importcancel"
+      job_id (str): id of one job. Empty: all jobs
+  """
+  if command == "importstatus":
+    jobs = list(jobrunner.jobs.values())[-10:]
+    return format_jobs(jobs) if jobs else "No import jobs."
+
+  if job_id and job_id not in jobrunner.jobs:
+    return f"Unknown import job '{job_id}'."
+  job_ids = [job_id] if job_id else [job.id for job in jobrunner.active_jobs()]
 
-  return "All data imported!"
\ No newline at end of file
+  control = {"importpause": jobrunner.pause, "importresume": jobrunner.resume, "importcancel": jobrunner.cancel}[command]
+  jobs = [control(job_id) for job_id in job_ids]
+  return format_jobs(jobs) if jobs else "No active import jobs."
+
+def format_jobs(jobs):
+  """
+  One line per job: status, processed sources + chunks, rate + ETA
+  """
+  lines = []
+  for job in jobs:
+    p = job.progress()
+    total = f"/{p['total']}" if p["total"] else ""
+    eta = f", ETA {p['eta']} s" if p["eta"] is not None else ""
+    error = f" ({p['error']})" if p["error"] else ""
+    lines.append(f"* `{p['id']}` **{p['kind']}**: {p['status']}{error} - {p['sources']}{total} sources, {p['chunks']} chunks, {p['rate']} sources/s{eta}")
+  return "\n".join(lines)
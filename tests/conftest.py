@@ -0,0 +1,10 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import sys
+
+# the modules of the app are top-level modules, the stand-ins for the embedding model + LLM are in benchmark/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmark")]
@@ -0,0 +1,53 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import AnswerCache
+from AnswerCache import SemanticAnswerCache
+from TalkToDatabase import IndexVersionFile
+
+QUESTION = [1.0, 0.0, 0.0]
+SIMILAR_QUESTION = [0.99, 0.05, 0.0]
+OTHER_QUESTION = [0.0, 1.0, 0.0]
+
+def test_similar_question_is_answered_from_cache():
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    cache.put(QUESTION, "gpt-4o", "1", "answer")
+
+    assert cache.get(SIMILAR_QUESTION, "gpt-4o", "1") == "answer"
+    assert cache.get(OTHER_QUESTION, "gpt-4o", "1") is None
+    assert cache.get(QUESTION, "llama3", "1") is None
+
+def test_expired_answers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(AnswerCache.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    cache.put(QUESTION, "gpt-4o", "1", "answer")
+
+    now[0] += 59
+    assert cache.get(QUESTION, "gpt-4o", "1") == "answer"
+    now[0] += 2
+    assert cache.get(QUESTION, "gpt-4o", "1") is None
+
+def test_least_recently_used_answer_is_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.put(QUESTION, "gpt-4o", "1", "first")
+    cache.put(OTHER_QUESTION, "gpt-4o", "1", "second")
+    # the first answer is used again: the second one is evicted by the third answer
+    assert cache.get(QUESTION, "gpt-4o", "1") == "first"
+    cache.put([0.0, 0.0, 1.0], "gpt-4o", "1", "third")
+
+    assert cache.get(OTHER_QUESTION, "gpt-4o", "1") is None
+    assert cache.get(QUESTION, "gpt-4o", "1") == "first"
+    assert cache.get([0.0, 0.0, 1.0], "gpt-4o", "1") == "third"
+
+def test_answers_are_invalidated_by_a_new_index_version(tmp_path):
+    index_version = IndexVersionFile(os.path.join(str(tmp_path), "collection_index_version"))
+    cache = SemanticAnswerCache()
+    cache.put(QUESTION, "gpt-4o", index_version.read(), "answer")
+    assert cache.get(QUESTION, "gpt-4o", index_version.read()) == "answer"
+
+    # an import of another process (e.g. the retrieval server) writes the stamp
+    IndexVersionFile(index_version.filepath).bump()
+    assert cache.get(QUESTION, "gpt-4o", index_version.read()) is None
@@ -0,0 +1,55 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+from Chunking import TextChunker, OpenAPIChunker
+
+DESCRIPTION = " ".join(f"The network device API returns the health of the device number {i}." for i in range(30))
+
+def document(parameters):
+    """ extended API specification document like DataHandler.import_apispecs_generate_new_data() assembles it """
+    parameters = "".join(f"- {name}: The {name} of the device. The query parameters should be used in the query. This query parameter is not required. \n" for name in parameters)
+    return (f"{DESCRIPTION}\n\nREST API query information delimited with XML tags\n<api-query>\nAPI query path:/dna/intent/api/v1/network-device\n"
+            f"REST operation:get\nREST API query parameters:\n{parameters}\n</api-query>")
+
+def test_text_chunks_respect_the_chunk_size():
+    chunker = TextChunker(chunk_size=200, overlap=40)
+    chunks = list(chunker.chunk(DESCRIPTION + "\n\n" + "x" * 500))
+
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert "".join(chunks).count("x") >= 500
+
+def test_text_chunks_overlap_by_sentences():
+    chunker = TextChunker(chunk_size=100, overlap=30)
+    chunks = list(chunker.chunk(" ".join(f"Sentence {i}." for i in range(40))))
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # the last sentences of a chunk (up to 30 characters) are repeated at the beginning of the next chunk
+        assert chunk.startswith(" ".join(previous.split(" ")[-4:]))
+
+def test_api_query_block_is_kept_together():
+    chunker = OpenAPIChunker(chunk_size=200, overlap=40)
+    chunks = list(chunker.chunk(document(["hostname", "managementIpAddress", "macAddress"])))
+
+    blocks = [chunk for chunk in chunks if "<api-query>" in chunk]
+    assert len(blocks) == 1
+    block = blocks[0]
+    assert block.startswith("REST API query information delimited with XML tags\n<api-query>")
+    assert block.endswith("</api-query>")
+    for part in ("API query path:/dna/intent/api/v1/network-device", "REST operation:get", "- hostname:", "- managementIpAddress:", "- macAddress:"):
+        assert part in block
+    # the description is chunked separately
+    assert all(len(chunk) <= 200 for chunk in chunks if chunk is not block)
+
+def test_long_api_query_block_repeats_the_header():
+    chunker = OpenAPIChunker(chunk_size=200, overlap=40, max_block_size=400)
+    parameters = [f"parameter{i}" for i in range(12)]
+    blocks = [chunk for chunk in chunker.chunk(document(parameters)) if "<api-query>" in chunk]
+
+    assert len(blocks) > 1
+    for block in blocks:
+        assert len(block) <= 400
+        assert "API query path:/dna/intent/api/v1/network-device\nREST operation:get" in block
+        assert block.endswith("</api-query>")
+    # every parameter is in exactly one part
+    assert [name for name in parameters if sum(f"- {name}:" in block for block in blocks) == 1] == parameters
@@ -0,0 +1,39 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+from ContextPacker import pack_context, estimate_tokens
+
+def hit(id, document):
+    return {"id": id, "document": document}
+
+def blocks(context):
+    return [block.split("\n", 1) for block in context.split("\n\n")]
+
+def test_adjacent_chunks_are_merged():
+    overlap = "the overlapping text of both chunks"
+    hits = [hit("page_2", overlap + " and the end of the page"), hit("other_0", "another source"), hit("page_1", "start of the page, " + overlap)]
+
+    assert blocks(pack_context(hits, 1000)) == [
+        ["[page_1-2]", "start of the page, " + overlap + " and the end of the page"],
+        ["[other_0]", "another source"],
+    ]
+
+def test_gaps_are_not_merged():
+    hits = [hit("page_1", "first chunk"), hit("page_3", "third chunk")]
+
+    assert blocks(pack_context(hits, 1000)) == [["[page_1]", "first chunk"], ["[page_3]", "third chunk"]]
+
+def test_duplicates_are_removed():
+    hits = [hit("guide_4", "the same text"), hit("apidocs_9", "the  same\ntext"), hit("guide_7", "something else")]
+
+    assert blocks(pack_context(hits, 1000)) == [["[guide_4]", "the same text"], ["[guide_7]", "something else"]]
+
+def test_token_budget():
+    hits = [hit("a_0", "a" * 400), hit("b_0", "b" * 4000), hit("c_0", "c" * 400), hit("d_0", "d" * 400)]
+
+    context = pack_context(hits, 250)
+    # the large block does not fit, the smaller (less relevant) blocks still fit until the budget is used up
+    assert [label for label, _ in blocks(context)] == ["[a_0]", "[c_0]"]
+    assert sum(estimate_tokens(block) for block in context.split("\n\n")) <= 250
+    assert pack_context(hits, 10) == ""
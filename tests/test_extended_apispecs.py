@@ -0,0 +1,79 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import json
+import os
+import threading
+import pytest
+from ExtendedApiSpecs import ExtendedApiSpecs
+
+@pytest.fixture(params=["specs.jsonl", "specs.jsonl.gz"])
+def specs(request, tmp_path):
+    return ExtendedApiSpecs(os.path.join(str(tmp_path), request.param))
+
+def test_last_line_wins(specs):
+    with specs.writer() as write:
+        write("getDevices", "old description", {"doc_type": "apispecs"}, "f1")
+        write("getSites", "sites", {"doc_type": "apispecs"}, "f2")
+        write("getDevices", "new description", {"doc_type": "apispecs"}, "f3")
+    assert not specs.writing()
+
+    assert [entry["id"] for entry in specs.read()] == ["getDevices", "getSites", "getDevices"]
+    offsets = specs.offsets()
+    assert specs.get(offsets["getDevices"])["document"] == "new description"
+
+    specs.compact(["getSites", "getDevices", "removedOperation"])
+    assert [(entry["id"], entry["document"]) for entry in specs.read()] == [("getSites", "sites"), ("getDevices", "new description")]
+
+def test_appends_to_an_interrupted_run(specs):
+    with specs.writer() as write:
+        write("getDevices", "devices", {})
+    with specs.writer() as write:
+        write("getSites", "sites", {})
+
+    assert [entry["id"] for entry in specs.read()] == ["getDevices", "getSites"]
+
+def test_incomplete_last_line_is_skipped(tmp_path):
+    specs = ExtendedApiSpecs(os.path.join(str(tmp_path), "specs.jsonl"))
+    with specs.writer() as write:
+        write("getDevices", "devices", {})
+    # the process was killed while it wrote the next line
+    with open(specs.filepath, "a") as f:
+        f.write('{"id": "getSites", "docum')
+
+    assert [entry["id"] for entry in specs.read()] == ["getDevices"]
+    assert list(specs.offsets()) == ["getDevices"]
+
+def test_stale_writing_marker_is_ignored(specs):
+    with open(specs.writing_path, "w") as f:
+        f.write("999999999")
+    assert not specs.writing()
+
+def test_read_follows_the_writer(specs):
+    written = threading.Event()
+    with specs.writer() as write:
+        write("op_0", "first", {})
+        entries = []
+        def read():
+            for entry in specs.read(follow=True, poll_interval=0.01):
+                entries.append(entry["id"])
+                written.set()
+        reader = threading.Thread(target=read)
+        reader.start()
+        assert written.wait(5)
+        for i in range(1, 5):
+            write(f"op_{i}", "more", {})
+    # the reader stops at the end of the file as soon as the writer is closed
+    reader.join(5)
+    assert not reader.is_alive()
+    assert entries == [f"op_{i}" for i in range(5)]
+
+def test_convert(specs, tmp_path):
+    json_path = os.path.join(str(tmp_path), "specs.json")
+    with open(json_path, "w") as f:
+        json.dump({"documents": ["devices", "sites"], "ids": ["getDevices", "getSites"], "metadatas": [{"tag": "Devices"}, {"tag": "Sites"}]}, f)
+
+    converted = ExtendedApiSpecs.convert(json_path, specs.filepath)
+    assert [(entry["id"], entry["document"], entry["metadata"]) for entry in converted.read()] == [
+        ("getDevices", "devices", {"tag": "Devices"}), ("getSites", "sites", {"tag": "Sites"})]
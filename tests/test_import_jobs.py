@@ -0,0 +1,104 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import threading
+from ImportJobs import JobRunner, job_progress, job_total
+
+class Importer:
+    """ importer with n sources, which waits at the given source until it is released """
+    def __init__(self, wait_at=None):
+        self.wait_at = wait_at
+        self.reached = threading.Event()
+        self.release = threading.Event()
+        self.imported = []
+
+    def __call__(self, sources):
+        seen = set()
+        job_total(sources)
+
+        def records():
+            for i in range(sources):
+                if i == self.wait_at:
+                    self.reached.set()
+                    self.release.wait(5)
+                seen.add(i)
+                yield f"document {i}", f"doc_{i}", {}
+
+        for _, id, _ in job_progress(records(), seen):
+            self.imported.append(id)
+
+def failing_importer():
+    raise RuntimeError("source not reachable")
+
+def create_runner(path, **importers):
+    runner = JobRunner(os.path.join(path, "chromadb", "import_jobs.json"))
+    for kind, importer in importers.items():
+        runner.register(kind, importer)
+    return runner
+
+def test_job_progress(tmp_path):
+    importer = Importer()
+    runner = create_runner(str(tmp_path), apidocs=importer, broken=failing_importer)
+
+    job = runner.submit("apidocs", 10)
+    failed = runner.submit("broken")
+    assert runner.wait(job.id, 5) and runner.wait(failed.id, 5)
+
+    assert importer.imported == [f"doc_{i}" for i in range(10)]
+    progress = job.progress()
+    assert (progress["status"], progress["sources"], progress["total"], progress["chunks"]) == ("done", 10, 10, 10)
+    assert (failed.status, failed.error) == ("failed", "source not reachable")
+
+def test_pause_resume_cancel(tmp_path):
+    paused_importer, cancelled_importer = Importer(wait_at=3), Importer(wait_at=3)
+    runner = create_runner(str(tmp_path), apidocs=paused_importer, userguide=cancelled_importer)
+
+    job = runner.submit("apidocs", 10)
+    assert paused_importer.reached.wait(5)
+    runner.pause(job.id)
+    paused_importer.release.set()
+    # the importer waits at its next record
+    assert not runner.wait(job.id, 0.2)
+    assert job.status == "paused" and len(paused_importer.imported) <= 4
+
+    runner.resume(job.id)
+    assert runner.wait(job.id, 5) and job.status == "done"
+    assert len(paused_importer.imported) == 10
+
+    job = runner.submit("userguide", 10)
+    assert cancelled_importer.reached.wait(5)
+    runner.cancel(job.id)
+    cancelled_importer.release.set()
+    assert runner.wait(job.id, 5) and job.status == "cancelled"
+    assert len(cancelled_importer.imported) <= 4
+
+def test_dependencies(tmp_path):
+    importer = Importer()
+    runner = create_runner(str(tmp_path), apidocs=importer, broken=failing_importer)
+
+    failed = runner.submit("broken")
+    dependent = runner.submit("apidocs", 5, depends_on=[failed.id])
+    assert runner.wait(dependent.id, 5)
+    assert dependent.status == "cancelled" and importer.imported == []
+
+    first = runner.submit("apidocs", 5)
+    second = runner.submit("apidocs", 5, depends_on=[first.id])
+    assert runner.wait(second.id, 5) and second.status == "done"
+    assert len(importer.imported) == 10
+
+def test_jobs_are_resumed_after_a_restart(tmp_path):
+    importer = Importer(wait_at=2)
+    runner = create_runner(str(tmp_path), apidocs=importer)
+    job = runner.submit("apidocs", 5)
+    assert importer.reached.wait(5)
+
+    # the app stops while the job is running: the new runner starts it again
+    restarted_importer = Importer()
+    restarted = create_runner(str(tmp_path), apidocs=restarted_importer)
+    assert restarted.jobs[job.id].status == "running"
+    assert [resumed.id for resumed in restarted.resume_jobs()] == [job.id]
+    assert restarted.wait(job.id, 5) and restarted.jobs[job.id].status == "done"
+    assert len(restarted_importer.imported) == 5
+    importer.release.set()
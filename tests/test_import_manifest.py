@@ -0,0 +1,92 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import pytest
+from fakes import FakeEmbeddingFunction
+from TalkToDatabase import VectorDB
+from ImportData import DataHandler
+from ImportManifest import ImportManifest
+from Metrics import IMPORTED_DOCUMENTS
+
+SOURCES = {f"doc{i}": [f"device health {i} part {j}" for j in range(3)] for i in range(5)}
+
+def create_handler(path):
+    database = VectorDB("manifest_test", FakeEmbeddingFunction(latency=0, latency_per_text=0), os.path.join(path, "chromadb"),
+                        embedding_cache_path=None, hybrid_search=False)
+    return DataHandler(database, None, endpoint_catalog=object())
+
+def import_sources(handler, sources, kind = "apidocs"):
+    """ import like the importers of DataHandler: unchanged sources are skipped, the chunks of the others are tracked """
+    def records(seen):
+        for source, chunks in sources.items():
+            seen.add(source)
+            fingerprint = ImportManifest.fingerprint(*chunks)
+            if handler.manifest.unchanged(kind, source, fingerprint):
+                continue
+            yield from handler.manifest.track(kind, source, fingerprint,
+                                              ((chunk, f"{source}_{i}", {"doc_type": kind}) for i, chunk in enumerate(chunks)))
+
+    before = IMPORTED_DOCUMENTS.value(kind=kind)
+    handler._import_records(kind, records)
+    return IMPORTED_DOCUMENTS.value(kind=kind) - before
+
+def stored_ids(handler):
+    return set(handler.database.collection.get()["ids"])
+
+def test_unchanged_reimport_writes_nothing(tmp_path):
+    handler = create_handler(str(tmp_path))
+    assert import_sources(handler, SOURCES) == 15
+    version = handler.database.active_version.name
+
+    assert import_sources(handler, SOURCES) == 0
+    # no new version of the collection for an import without changes
+    assert handler.database.active_version.name == version
+    assert len(stored_ids(handler)) == 15
+
+def test_changed_chunk_is_written_again(tmp_path):
+    handler = create_handler(str(tmp_path))
+    import_sources(handler, SOURCES)
+
+    changed = dict(SOURCES, doc2=["device health 2 part 0", "changed part", "device health 2 part 2"])
+    assert import_sources(handler, changed) == 1
+    assert handler.database.collection.get(ids=["doc2_1"])["documents"] == ["changed part"]
+
+def test_shrunk_source_deletes_stale_ids(tmp_path):
+    handler = create_handler(str(tmp_path))
+    import_sources(handler, SOURCES)
+
+    shrunk = dict(SOURCES, doc1=SOURCES["doc1"][:1])
+    del shrunk["doc4"]
+    assert import_sources(handler, shrunk) == 0
+    assert stored_ids(handler) == {f"doc{i}_{j}" for i in (0, 2, 3) for j in range(3)} | {"doc1_0"}
+    assert handler.manifest.entry("apidocs", "doc1")["chunks"].keys() == {"doc1_0"}
+    assert handler.manifest.entry("apidocs", "doc4") == {}
+
+def test_first_import_deletes_untracked_ids(tmp_path):
+    # collection which was imported before the manifest existed: surplus chunks + a user guide without metadata
+    handler = create_handler(str(tmp_path))
+    handler.database.collection_upsert(["old 0", "old 1", "old 2"], ["doc0_0", "doc0_1", "doc0_7"], [{"doc_type": "apidocs"}] * 3)
+    handler.database.collection_upsert(["old page"], ["user_guide_0"], None)
+    handler.database.collection_upsert(["spec"], ["op_0"], [{"doc_type": "apispecs"}])
+
+    import_sources(handler, {"doc0": SOURCES["doc0"]})
+    assert stored_ids(handler) == {"doc0_0", "doc0_1", "doc0_2", "user_guide_0", "op_0"}
+
+    import_sources(handler, {"p1": ["page one"]}, kind="userguide")
+    assert stored_ids(handler) == {"doc0_0", "doc0_1", "doc0_2", "p1_0", "op_0"}
+
+def test_failed_import_is_done_again(tmp_path):
+    handler = create_handler(str(tmp_path))
+    import_sources(handler, SOURCES)
+
+    changed = {source: [chunk + " new" for chunk in chunks] for source, chunks in SOURCES.items()}
+    def failing(seen):
+        yield from handler.manifest.track("apidocs", "doc0", ImportManifest.fingerprint(*changed["doc0"]), ((chunk, f"doc0_{i}", {"doc_type": "apidocs"}) for i, chunk in enumerate(changed["doc0"])))
+        raise RuntimeError("import failed")
+    with pytest.raises(RuntimeError):
+        handler._import_records("apidocs", failing)
+
+    # the manifest was reset to the saved state: the next import writes all changed sources
+    assert import_sources(handler, changed) == 15
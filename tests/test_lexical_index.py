@@ -0,0 +1,57 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+from fakes import FakeEmbeddingFunction
+from LexicalIndex import BM25Index, tokenize, reciprocal_rank_fusion
+from TalkToDatabase import VectorDB
+
+PATHS = ["/dna/intent/api/v1/network-device", "/dna/intent/api/v1/site-health", "/dna/intent/api/v1/client-health", "/dna/intent/api/v1/network-health"]
+
+def create_index(path):
+    index = BM25Index(os.path.join(path, "lexical_index.json"))
+    index.upsert([f"op_{i}" for i in range(len(PATHS))],
+                 [f"API query path:{p}\nREST operation:get\nReturns the health information." for p in PATHS],
+                 [{"doc_type": "apispecs"}] * len(PATHS))
+    index.upsert(["guide_0"], ["The site health dashboard of the user guide shows the health of each site."], [{"doc_type": "userguide"}])
+    return index
+
+def test_tokenize_keeps_paths_and_identifiers():
+    terms = tokenize("GET /dna/intent/api/v1/network-device?siteId")
+    assert "dna/intent/api/v1/network-device?siteid" not in terms
+    assert "dna/intent/api/v1/network-device" in terms
+    assert {"network", "device", "siteid", "site", "id"} <= set(terms)
+
+def test_exact_path_ranks_first(tmp_path):
+    index = create_index(str(tmp_path))
+
+    assert index.search("/dna/intent/api/v1/site-health", 3)[0][0] == "op_1"
+    assert [id for id, _ in index.search("site health", 5, doc_type="userguide")] == ["guide_0"]
+    assert index.search("unknown words", 5) == []
+
+def test_upsert_delete_and_persistence(tmp_path):
+    index = create_index(str(tmp_path))
+    index.upsert(["op_1"], ["API query path:/dna/intent/api/v1/template"], [{"doc_type": "apispecs"}])
+    index.delete(["op_2"])
+    index.save()
+
+    loaded = BM25Index(index.filepath)
+    assert len(loaded) == 4
+    assert [id for id, _ in loaded.search("template", 5)] == ["op_1"]
+    assert "op_2" not in [id for id, _ in loaded.search("client health", 5)]
+
+def test_reciprocal_rank_fusion():
+    fused = [id for id, _ in reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]])]
+    # ids which both rankings return rank first
+    assert fused == ["a", "c", "b", "d"]
+
+def test_hybrid_search_finds_exact_path(tmp_path):
+    database = VectorDB("lexical_test", FakeEmbeddingFunction(latency=0, latency_per_text=0), os.path.join(str(tmp_path), "chromadb"),
+                        embedding_cache_path=None)
+    with database.building_version():
+        database.collection_upsert_bulk((f"API query path:{p}\nREST operation:get", f"op_{i}", {"doc_type": "apispecs"}) for i, p in enumerate(PATHS))
+
+    hits = database.query_db_multi("/dna/intent/api/v1/client-health", {"apispecs": 2})["apispecs"]
+    assert hits[0]["id"] == "op_2"
+    assert hits[0]["score"] > hits[1]["score"]
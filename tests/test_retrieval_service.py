@@ -0,0 +1,63 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fakes import FakeEmbeddingFunction
+from TalkToDatabase import VectorDB
+from RetrievalService import RetrievalServer, RetrievalClient, RetrievalServiceError
+
+def create_database(path):
+    return VectorDB("service_test", FakeEmbeddingFunction(latency=0, latency_per_text=0), os.path.join(path, "chromadb"),
+                    embedding_cache_path=None)
+
+def records(count):
+    return ((f"document {i} about device health {i % 7}", f"doc_{i}", {"doc_type": "apidocs" if i % 2 else "apispecs"}) for i in range(count))
+
+def test_import_and_queries_through_the_server(tmp_path):
+    database = create_database(str(tmp_path))
+    with RetrievalServer(database, os.path.join(str(tmp_path), "retrieval.sock")) as server:
+        client = RetrievalClient(server.address, "service_test", database.database_path)
+        with client.building_version():
+            assert client.collection_upsert_bulk(records(100), batch_size=32) == 100
+        assert database.collection.count() == 100
+        assert client.index_version == database.index_version != ""
+
+        expected = database.query_db_multi("device health 3", {"apidocs": 4, "apispecs": 2})
+        assert client.query_db_multi("device health 3", {"apidocs": 4, "apispecs": 2}) == expected
+        assert asyncio.run(client.query_db_multi_async("device health 3", {"apidocs": 4, "apispecs": 2})) == expected
+
+        # many workers at the same time
+        with ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(lambda i: client.query_db_multi(f"device health {i}", {"apidocs": 3}), range(64)))
+        assert all(len(result["apidocs"]) == 3 for result in results)
+
+def test_failed_import_of_a_client_is_rolled_back(tmp_path):
+    database = create_database(str(tmp_path))
+    with RetrievalServer(database, os.path.join(str(tmp_path), "retrieval.sock")) as server:
+        client = RetrievalClient(server.address, "service_test", database.database_path)
+        with client.building_version():
+            client.collection_upsert_bulk(records(20))
+        version = database.active_version.name
+
+        with pytest.raises(ValueError):
+            with client.building_version():
+                client.collection_upsert(["failed document"], ["failed"], [{"doc_type": "apidocs"}])
+                raise ValueError("import failed")
+        assert database.active_version.name == version
+        assert database.collection.get(ids=["failed"])["ids"] == []
+
+def test_errors_are_returned_to_the_client(tmp_path):
+    database = create_database(str(tmp_path))
+    with RetrievalServer(database, os.path.join(str(tmp_path), "retrieval.sock")) as server:
+        client = RetrievalClient(server.address, "service_test", database.database_path)
+        with pytest.raises(RetrievalServiceError):
+            client._call("unknown_method")
+
+        # only one server per socket
+        with pytest.raises(RuntimeError):
+            RetrievalServer(database, server.address).__enter__()
+    assert not os.path.exists(server.address)
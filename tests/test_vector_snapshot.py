@@ -0,0 +1,67 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import numpy as np
+from fakes import FakeEmbeddingFunction
+from TalkToDatabase import VectorDB
+
+WORDS = "device site network health template discovery provisioning credential inventory interface client wireless fabric".split()
+
+def create_database(path, documents = 0):
+    database = VectorDB("snapshot_test", FakeEmbeddingFunction(latency=0, latency_per_text=0), os.path.join(path, "chromadb"),
+                        embedding_cache_path=None, hybrid_search=False, snapshot=True)
+    if documents:
+        records = ((" ".join(WORDS[(i * 7 + j) % len(WORDS)] for j in range(i % 5 + 2)), f"doc_{i}", {"doc_type": "apidocs" if i % 3 else "apispecs"}) for i in range(documents))
+        with database.building_version():
+            database.collection_upsert_bulk(records)
+    return database
+
+def search(database, snapshot, query_embeddings, n_results, where_clause):
+    database.snapshot = snapshot
+    return database._search(query_embeddings, n_results, where_clause, None)
+
+def test_empty_collection(tmp_path):
+    database = create_database(str(tmp_path))
+    database.open()
+
+    assert len(database.refresh_snapshot()) == 0
+    assert database.query_db_multi("device health", {None: 5, "apidocs": 5}) == {None: [], "apidocs": []}
+
+def test_snapshot_search_matches_chromadb(tmp_path):
+    database = create_database(str(tmp_path), documents=300)
+    snapshot = database.refresh_snapshot()
+    assert len(snapshot) == 300
+
+    collection = database.collection.get(include=["embeddings", "documents", "metadatas"])
+    query_embeddings = database.embeddings_function(["device health", "wireless client credential", "fabric site inventory"])
+    for where_clause in (None, "apidocs", "apispecs"):
+        expected = search(database, False, query_embeddings, 10, where_clause)
+        results = search(database, True, query_embeddings, 10, where_clause)
+        for query_embedding, expected_hits, hits in zip(query_embeddings, expected, results):
+            # exact search: the distances of a brute-force search over all documents (squared L2 like chromadb)
+            rows = [row for row, metadata in enumerate(collection["metadatas"]) if where_clause is None or metadata["doc_type"] == where_clause]
+            distances = sorted(float(np.sum((np.asarray(collection["embeddings"][row]) - query_embedding) ** 2)) for row in rows)
+            assert np.allclose([hit["distance"] for hit in hits], distances[:10], atol=1e-4)
+
+            # chromadb (approximate HNSW search) finds the same best hit + no closer hits than the snapshot
+            assert np.isclose(hits[0]["distance"], expected_hits[0]["distance"], atol=1e-4)
+            assert all(hit["distance"] <= expected_hit["distance"] + 1e-4 for hit, expected_hit in zip(hits, expected_hits))
+
+            # the same documents + metadata as in chromadb
+            for hit in hits:
+                row = collection["ids"].index(hit["id"])
+                assert hit["document"] == collection["documents"][row]
+                assert hit["metadata"] == collection["metadatas"][row]
+
+def test_snapshot_after_first_import(tmp_path):
+    # snapshot of the empty collection at the start, then the first import
+    database = create_database(str(tmp_path))
+    database.open()
+    with database.building_version():
+        database.collection_upsert_bulk((f"{word} document", f"doc_{i}", {"doc_type": "apidocs"}) for i, word in enumerate(WORDS))
+
+    snapshot = database._current_snapshot(database.active_version)
+    assert snapshot is not None and len(snapshot) == len(WORDS)
+    assert database.query_db_multi("wireless", {"apidocs": 1})["apidocs"][0]["id"] == f"doc_{WORDS.index('wireless')}"
@@ -0,0 +1,71 @@
+"""
+Cisco Sample Code License 1.1
+Author: flopach 2024
+"""
+import os
+import pytest
+from fakes import FakeEmbeddingFunction
+from TalkToDatabase import VectorDB
+
+def create_database(path, documents = 20):
+    database = VectorDB("versioning_test", FakeEmbeddingFunction(latency=0, latency_per_text=0), os.path.join(path, "chromadb"),
+                        embedding_cache_path=None)
+    with database.building_version():
+        database.collection_upsert_bulk((f"old document {i}", f"doc_{i}", {"doc_type": "apidocs"}) for i in range(documents))
+    return database
+
+def documents(database, ids):
+    results = database.collection.get(ids=ids)
+    return dict(zip(results["ids"], results["documents"]))
+
+def test_failed_import_rolls_back_only_its_own_ids(tmp_path):
+    database = create_database(str(tmp_path))
+    version = database.active_version.name
+
+    # two imports at the same time write into the same new version, the second one fails
+    with database.building_version():
+        database.collection_upsert(["new document 0", "added document"], ["doc_0", "added"], [{"doc_type": "apidocs"}] * 2)
+        with pytest.raises(RuntimeError):
+            with database.building_version():
+                database.collection_upsert(["new document 1", "failed document"], ["doc_1", "failed"], [{"doc_type": "apidocs"}] * 2)
+                database.collection_delete(["doc_2"])
+                raise RuntimeError("import failed")
+        # queries use the active version until the imports are finished
+        assert database.active_version.name == version
+        assert documents(database, ["doc_0", "added"]) == {"doc_0": "old document 0"}
+
+    assert database.active_version.name != version
+    assert documents(database, ["doc_0", "doc_1", "doc_2", "added", "failed"]) == {
+        "doc_0": "new document 0", "doc_1": "old document 1", "doc_2": "old document 2", "added": "added document"}
+    assert database.collection.count() == 21
+    assert len(database.lexical_index) == 21
+
+def test_unchanged_import_keeps_version(tmp_path):
+    database = create_database(str(tmp_path))
+    version, index_version = database.active_version.name, database.index_version
+
+    with database.building_version():
+        pass
+    assert database.active_version.name == version
+    assert database.index_version == index_version
+
+def test_shrunk_import_is_activated(tmp_path):
+    database = create_database(str(tmp_path), documents=200)
+    index_version = database.index_version
+
+    with database.building_version():
+        database.collection_delete([f"doc_{i}" for i in range(40, 200)])
+    assert database.collection.count() == 40
+    assert database.index_version != index_version
+
+def test_incomplete_version_is_discarded(tmp_path):
+    database = create_database(str(tmp_path), documents=200)
+    version = database.active_version.name
+
+    # documents which are missing in the new version without being deleted by an import (e.g. an interrupted copy)
+    with pytest.raises(ValueError):
+        with database.building_version():
+            database.collection_upsert(["new document 0"], ["doc_0"], [{"doc_type": "apidocs"}])
+            database._build.collection.delete(ids=[f"doc_{i}" for i in range(40, 200)])
+    assert database.active_version.name == version
+    assert database.collection.count() == 200